@@ -0,0 +1,50 @@
+"""Admission control: turn new work away while the node is saturated.
+
+New websocket connections and room creations are checked against live
+load signals: open connections, event loop lag and frames waiting in
+outbound queues. Work that was already admitted (open connections, their
+rooms, resuming sessions) is never refused, so a saturated node sheds new
+load quickly instead of getting slower for everyone.
+"""
+import random
+from typing import NamedTuple, Optional
+
+
+class Overload(NamedTuple):
+    reason: str
+    # Seconds the client should wait before trying again
+    retry_after: int
+
+
+class AdmissionController:
+    """Limits of 0 are not enforced"""
+
+    def __init__(self, max_connections: int = 0, max_loop_lag: float = 0.0, max_queued_frames: int = 0,
+                 retry_after: int = 5, smoothing: float = 0.3):
+        self.max_connections = max_connections
+        self.max_loop_lag = max_loop_lag
+        self.max_queued_frames = max_queued_frames
+        self.retry_after = retry_after
+        self.smoothing = smoothing
+        # Exponentially smoothed so one slow tick does not flip admission
+        self.loop_lag = 0.0
+        self.queued_frames = 0
+
+    def sample(self, loop_lag: float, queued_frames: int):
+        """Record the latest load readings; called from the loop lag monitor"""
+        self.loop_lag += self.smoothing * (loop_lag - self.loop_lag)
+        self.queued_frames = queued_frames
+
+    def overload(self, reason: str) -> Overload:
+        # Spread retries out so rejected clients do not all come back at once
+        return Overload(reason, self.retry_after + random.randint(0, self.retry_after))
+
+    def check(self, connections: int) -> Optional[Overload]:
+        """Whether new work would overload the node, given the open connection count"""
+        if self.max_connections and connections >= self.max_connections:
+            return self.overload("too many connections")
+        if self.max_loop_lag and self.loop_lag > self.max_loop_lag:
+            return self.overload("event loop overloaded")
+        if self.max_queued_frames and self.queued_frames > self.max_queued_frames:
+            return self.overload("outbound queues backed up")
+        return None
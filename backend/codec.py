@@ -0,0 +1,114 @@
+import json
+from typing import Dict, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON backend
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional binary codec
+    msgpack = None
+
+Payload = Union[str, bytes]
+
+SUBPROTOCOL_PREFIX = "collabshare."
+
+
+class Codec:
+    """Wire format for one connection; binary codecs travel as binary frames"""
+    name = ""
+    binary = False
+
+    def encode(self, message: dict) -> Payload:
+        raise NotImplementedError
+
+    def decode(self, data: Payload) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def encode(self, message: dict) -> Payload:
+        return json.dumps(message, separators=(",", ":"))
+
+    def decode(self, data: Payload) -> dict:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """Same wire format as JsonCodec, encoded by orjson"""
+    name = "orjson"
+
+    def encode(self, message: dict) -> Payload:
+        return orjson.dumps(message).decode()
+
+    def decode(self, data: Payload) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    def encode(self, message: dict) -> Payload:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: Payload) -> dict:
+        if isinstance(data, str):
+            data = data.encode()
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: Dict[str, Codec] = {"json": JsonCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def get_codec(name: Optional[str], default: str = "json") -> Codec:
+    """Look up a codec by name, falling back to the default when it is unavailable"""
+    if name and name in CODECS:
+        return CODECS[name]
+    return CODECS.get(default, CODECS["json"])
+
+
+def negotiate(websocket: WebSocket, default: str = "json"):
+    """Pick a codec from the offered subprotocols or the ?codec= query parameter.
+
+    Returns the codec and the subprotocol to echo back on accept, if any.
+    """
+    for offered in websocket.scope.get("subprotocols", ()):
+        if offered.startswith(SUBPROTOCOL_PREFIX) and offered[len(SUBPROTOCOL_PREFIX):] in CODECS:
+            return CODECS[offered[len(SUBPROTOCOL_PREFIX):]], offered
+    return get_codec(websocket.query_params.get("codec"), default), None
+
+
+class Frame:
+    """An outbound message encoded at most once per codec and shared by every recipient"""
+    __slots__ = ("message", "msg_type", "_encoded")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.msg_type: str = message["type"]
+        self._encoded: Dict[str, Payload] = {}
+
+    def encode(self, codec: Codec) -> Payload:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.message)
+        return data
+
+
+async def receive_payload(websocket: WebSocket) -> Payload:
+    """Receive the next text or binary frame, raising WebSocketDisconnect on close"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    return text if text is not None else message["bytes"]
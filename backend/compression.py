@@ -0,0 +1,217 @@
+"""Compression of relayed signaling: permessage-deflate and compressed SDP.
+
+Websocket compression (RFC 7692) is negotiated per connection with
+tunable window bits, level and memory level; frames below a minimum size
+are sent uncompressed, which the RFC allows per message and which leaves
+the compression context untouched. Each connection keeps its own
+compressor, so a smaller window trades ratio for memory per connection.
+
+Clients that connect with ?caps=sdp_deflate may also send and receive the
+`sdp` of offers and answers as `sdp_deflate`: raw deflate (base64) primed
+with a preset dictionary of common SDP lines, which shrinks even the first
+offer on a connection. The dictionary is part of the wire format; changing
+it needs a new capability name.
+"""
+import base64
+import zlib
+from typing import Any, Dict, NamedTuple, Optional, Type
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Frame, Opcode
+
+
+class DeflateSettings(NamedTuple):
+    # LZ77 window of the server's compressor, 9-15 bits
+    window_bits: int = 12
+    # Messages shorter than this many bytes are sent uncompressed
+    min_size: int = 256
+    level: int = 6
+    mem_level: int = 5
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that leaves messages below `min_size` uncompressed"""
+
+    def __init__(self, extension: PerMessageDeflate, min_size: int):
+        super().__init__(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+        self.min_size = min_size
+        # Whether the fragments of the message being sent go out as they are
+        self._passthrough = False
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not Opcode.CONT:
+            self._passthrough = frame.fin and len(frame.data) < self.min_size
+        if self._passthrough:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, settings: DeflateSettings):
+        super().__init__(
+            server_max_window_bits=settings.window_bits,
+            compress_settings={"level": settings.level, "memLevel": settings.mem_level},
+        )
+        self.min_size = settings.min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(extension, self.min_size)
+
+
+def websocket_protocol(settings: Optional[DeflateSettings]) -> Type:
+    """uvicorn websocket protocol negotiating compression with `settings`, or not at all if None"""
+    from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+
+    class DeflateWebSocketProtocol(WebSocketProtocol):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.available_extensions = [ThresholdDeflateFactory(settings)] if settings else []
+
+    return DeflateWebSocketProtocol
+
+
+# Client capability for SDP sent as `sdp_deflate`
+SDP_DEFLATE_CAP = "sdp_deflate"
+
+# Lines that turn up in most browser offers and answers. zlib finds matches
+# closer to the end of the dictionary in fewer bits, so the most common
+# lines come last.
+SDP_DICTIONARY = "\r\n".join([
+    "a=rtpmap:45 AV1/90000",
+    "a=rtpmap:98 VP9/90000",
+    "a=fmtp:98 profile-id=0",
+    "a=rtpmap:100 VP9/90000",
+    "a=fmtp:100 profile-id=2",
+    "a=rtpmap:102 H264/90000",
+    "a=fmtp:102 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f",
+    "a=rtpmap:104 H264/90000",
+    "a=fmtp:104 level-asymmetry-allowed=1;packetization-mode=0;profile-level-id=42001f",
+    "a=rtpmap:106 H264/90000",
+    "a=fmtp:106 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42e01f",
+    "a=rtpmap:112 H264/90000",
+    "a=fmtp:112 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=64001f",
+    "a=rtpmap:123 ulpfec/90000",
+    "a=rtpmap:122 red/90000",
+    "a=rtpmap:9 G722/8000",
+    "a=rtpmap:0 PCMU/8000",
+    "a=rtpmap:8 PCMA/8000",
+    "a=rtpmap:13 CN/8000",
+    "a=rtpmap:110 telephone-event/48000",
+    "a=rtpmap:126 telephone-event/8000",
+    "a=rtpmap:63 red/48000/2",
+    "a=fmtp:63 111/111",
+    "a=extmap:14 urn:3gpp:video-orientation",
+    "a=extmap:5 http://www.webrtc.org/experiments/rtp-hdrext/playout-delay",
+    "a=extmap:6 http://www.webrtc.org/experiments/rtp-hdrext/video-content-type",
+    "a=extmap:7 http://www.webrtc.org/experiments/rtp-hdrext/video-timing",
+    "a=extmap:8 http://www.webrtc.org/experiments/rtp-hdrext/color-space",
+    "a=extmap:13 urn:ietf:params:rtp-hdrext:toffset",
+    "a=extmap:10 urn:ietf:params:rtp-hdrext:sdes:rtp-stream-id",
+    "a=extmap:11 urn:ietf:params:rtp-hdrext:sdes:repaired-rtp-stream-id",
+    "m=application 9 UDP/DTLS/SCTP webrtc-datachannel",
+    "a=sctp-port:5000",
+    "a=max-message-size:262144",
+    "a=candidate:1 1 udp 2122260223 192.168.1.2 54321 typ host generation 0 network-id 1",
+    "a=candidate:2 1 udp 1686052607 203.0.113.7 54321 typ srflx raddr 192.168.1.2 rport 54321 generation 0",
+    "a=end-of-candidates",
+    "a=ssrc-group:FID 1 2",
+    "a=ssrc:1 cname:",
+    "a=ssrc:1 msid:",
+    "m=video 9 UDP/TLS/RTP/SAVPF 96 97 98 99 100 101 102 103 104 105 106 107 108 109 127 125 39 40 45 46 112 113",
+    "a=rtpmap:96 VP8/90000",
+    "a=rtcp-fb:96 goog-remb",
+    "a=rtcp-fb:96 transport-cc",
+    "a=rtcp-fb:96 ccm fir",
+    "a=rtcp-fb:96 nack",
+    "a=rtcp-fb:96 nack pli",
+    "a=rtpmap:97 rtx/90000",
+    "a=fmtp:97 apt=96",
+    "a=rtpmap:99 rtx/90000",
+    "a=fmtp:99 apt=98",
+    "a=rtcp-rsize",
+    "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time",
+    "a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01",
+    "a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid",
+    "a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level",
+    "a=rtpmap:111 opus/48000/2",
+    "a=rtcp-fb:111 transport-cc",
+    "a=fmtp:111 minptime=10;useinbandfec=1",
+    "m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=ice-ufrag:",
+    "a=ice-pwd:",
+    "a=ice-options:trickle",
+    "a=fingerprint:sha-256 ",
+    "a=setup:actpass",
+    "a=setup:active",
+    "a=mid:0",
+    "a=sendrecv",
+    "a=msid:- ",
+    "a=rtcp-mux",
+    "v=0",
+    "o=- 1 2 IN IP4 127.0.0.1",
+    "s=-",
+    "t=0 0",
+    "a=group:BUNDLE 0 1 2",
+    "a=extmap-allow-mixed",
+    "a=msid-semantic: WMS",
+    "",
+]).encode()
+
+
+def compress_sdp(sdp: str, level: int = 9) -> str:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=SDP_DICTIONARY)
+    return base64.b64encode(compressor.compress(sdp.encode()) + compressor.flush()).decode()
+
+
+def decompress_sdp(data: str, max_size: int = 1 << 20) -> str:
+    """Inverse of compress_sdp; ValueError if `data` is malformed or inflates past `max_size`"""
+    try:
+        decompressor = zlib.decompressobj(-15, zdict=SDP_DICTIONARY)
+        sdp = decompressor.decompress(base64.b64decode(data, validate=True), max_size)
+    except (zlib.error, ValueError) as e:
+        raise ValueError(f"Malformed compressed SDP: {e}") from None
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Compressed SDP is truncated or too large")
+    return sdp.decode()
+
+
+class SdpCompressor:
+    """Converts relayed session descriptions to the form each recipient accepts"""
+
+    def __init__(self, min_size: int = 512):
+        self.min_size = min_size
+        self.compressed = 0
+        self.decompressed = 0
+        # Bytes of SDP saved by relaying compressed descriptions
+        self.bytes_saved = 0
+
+    def relay(self, description: Dict[str, Any], compressed: bool) -> Dict[str, Any]:
+        """`description` as it should go to a recipient that does or does not take `sdp_deflate`"""
+        if not compressed:
+            if "sdp_deflate" not in description:
+                return description
+            description = dict(description)
+            description["sdp"] = decompress_sdp(description.pop("sdp_deflate"))
+            self.decompressed += 1
+            return description
+        sdp = description.get("sdp")
+        if isinstance(sdp, str) and len(sdp) >= self.min_size:
+            packed = compress_sdp(sdp)
+            if len(packed) < len(sdp):
+                self.compressed += 1
+                self.bytes_saved += len(sdp) - len(packed)
+                description = dict(description)
+                del description["sdp"]
+                description["sdp_deflate"] = packed
+        return description
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Tuple, Type
+
+from pydantic import ValidationError
+
+from codec import Frame, Payload
+from logsetup import redact
+from metrics import BYTES_IN, FRAMES_IN, FRAMES_RATE_LIMITED, FRAMES_REJECTED, HANDLER_SECONDS, RATE_LIMIT_DISCONNECTS
+from messages import InboundMessage
+from outbound import ClientConnection
+from ratelimit import ALL_FRAMES
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[ClientConnection, InboundMessage], Awaitable[None]]
+
+
+class Dispatcher:
+    """Routes decoded client frames to handlers by their "type" field.
+
+    Each type is registered with a pydantic model that is compiled once, so
+    dispatch is a dict lookup plus validation. Frames that fail to decode,
+    name an unknown type or fail validation are answered with an error
+    message and the connection carries on.
+
+    Frames are held to the connection's rate limits twice: the limit for
+    all frames before decoding, and the one for its type before validation.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[Type[InboundMessage], Handler]] = {}
+
+    def handler(self, msg_type: str, model: Type[InboundMessage]):
+        def register(func: Handler) -> Handler:
+            self._routes[msg_type] = (model, func)
+            return func
+        return register
+
+    @property
+    def message_types(self):
+        return self._routes.keys()
+
+    async def dispatch(self, connection: ClientConnection, payload: Payload):
+        if connection.limiter is not None and not await self._admit(connection, ALL_FRAMES):
+            return
+        try:
+            message = connection.codec.decode(payload)
+        except Exception:
+            self.reject(connection, "Malformed frame", "malformed")
+            return
+        if not isinstance(message, dict):
+            self.reject(connection, "Malformed frame", "malformed")
+            return
+        msg_type = message.get("type")
+        known_type = msg_type if isinstance(msg_type, str) else None
+        logger.debug("Received %s from %s (%s): %s", msg_type, connection.client_id,
+                     connection.client_ip, redact(message), extra={"msg_type": known_type})
+
+        route = self._routes.get(known_type)
+        # Unrouted types share one label so clients cannot add series at will
+        FRAMES_IN.inc(known_type if route is not None else "unknown")
+        BYTES_IN.inc(known_type if route is not None else "unknown", amount=len(payload))
+        if route is None:
+            self.reject(connection, f"Unknown message type: {msg_type}", "unknown_type")
+            return
+
+        if connection.limiter is not None and not await self._admit(connection, known_type):
+            return
+
+        model, handler = route
+        try:
+            parsed = model.model_validate(message)
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            self.reject(connection, f"Invalid {msg_type} message: {field}: {error['msg']}", "invalid")
+            return
+
+        start = time.perf_counter()
+        try:
+            await handler(connection, parsed)
+        except Exception:
+            logger.exception("Handler for %s failed for client %s", msg_type, connection.client_id)
+            self.reject(connection, f"Could not process {msg_type}", "handler_error")
+        HANDLER_SECONDS.observe(time.perf_counter() - start, msg_type)
+
+    async def _admit(self, connection: ClientConnection, msg_type: str) -> bool:
+        """Apply the rate limit for `msg_type`, waiting out a throttle; False if the frame is dropped"""
+        limiter = connection.limiter
+        delay = limiter.check(msg_type)
+        if delay == 0:
+            return True
+        label = "all" if msg_type == ALL_FRAMES else msg_type
+        FRAMES_RATE_LIMITED.inc(label, "drop" if delay is None else "throttle")
+        if limiter.offender:
+            # Frames may still arrive until the close goes through; evict once
+            if limiter.violations == limiter.max_violations + 1:
+                logger.warning("Disconnecting %s: %d frames over its rate limits", connection.client_id, limiter.violations)
+                RATE_LIMIT_DISCONNECTS.inc()
+                connection.evict("rate limit exceeded")
+            return False
+        if delay is None:
+            if limiter.first_violation:
+                self.reject(connection, f"Rate limit exceeded for {msg_type}", "rate_limited")
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    @staticmethod
+    def reject(connection: ClientConnection, reason: str, label: str):
+        FRAMES_REJECTED.inc(label)
+        connection.enqueue(Frame({"type": "error", "message": reason}))
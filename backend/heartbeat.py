@@ -0,0 +1,65 @@
+"""Application-level heartbeat that finds and reaps half-open connections.
+
+A single task sweeps the connections of clients that connected with
+?caps=heartbeat once per interval. Any frame from such a client counts as
+a sign of life; one that has been quiet for an interval is sent a `ping`
+(which it answers with `pong`), and one that has been quiet for longer
+than the timeout is handed to `reap`. Other clients may not know the
+messages, so they are only covered by the websocket protocol's own
+ping/pong, which the server runs for every connection.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable
+
+from codec import Frame
+from outbound import ClientConnection
+
+logger = logging.getLogger(__name__)
+
+# Client capability for application-level ping/pong
+HEARTBEAT_CAP = "heartbeat"
+
+
+class Heartbeat:
+    def __init__(
+        self,
+        connections: Callable[[], Iterable[ClientConnection]],
+        reap: Callable[[ClientConnection], Awaitable[None]],
+        interval: float = 20.0,
+        timeout: float = 60.0,
+    ):
+        self.connections = connections
+        self.reap = reap
+        self.interval = interval
+        self.timeout = timeout
+        self.pings_sent = 0
+        self.reaped = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+    async def sweep(self):
+        now = time.monotonic()
+        # One ping frame per sweep, encoded at most once per codec
+        ping = Frame({"type": "ping", "ts": time.time()})
+        silent = []
+        for connection in self.connections():
+            if HEARTBEAT_CAP not in connection.caps:
+                continue
+            idle = now - connection.last_seen
+            if idle > self.timeout:
+                silent.append(connection)
+            elif idle >= self.interval:
+                connection.enqueue(ping)
+                self.pings_sent += 1
+        for connection in silent:
+            self.reaped += 1
+            logger.warning("Reaping %s: nothing received for %.0fs", connection.client_id, now - connection.last_seen)
+            try:
+                await self.reap(connection)
+            except Exception:
+                logger.exception("Failed to reap %s", connection.client_id)
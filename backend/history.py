@@ -0,0 +1,96 @@
+"""Bounded per-room chat history with server-assigned sequence numbers.
+
+Each room keeps its most recent chat messages up to a message count and a
+byte budget, and all rooms together stay under a global byte budget by
+evicting the oldest messages first, wherever they are. Sizes are the
+approximate JSON size of each message, so the budgets track the payload
+held rather than Python object overhead.
+"""
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+
+def message_size(message: dict) -> int:
+    """Approximate JSON size of a flat message"""
+    return 2 + sum(len(key) + len(str(value)) + 6 for key, value in message.items())
+
+
+class _RoomLog:
+    __slots__ = ("entries", "next_seq", "bytes")
+
+    def __init__(self):
+        # (seq, message, size), oldest first
+        self.entries: Deque[Tuple[int, dict, int]] = deque()
+        self.next_seq = 1
+        self.bytes = 0
+
+
+class ChatHistory:
+    def __init__(self, max_messages: int = 100, max_bytes: int = 64 << 10, max_total_bytes: int = 32 << 20):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self._rooms: Dict[str, _RoomLog] = {}
+        # (room log, seq) of every stored message, oldest first; entries of
+        # messages already evicted by their room, or of a dropped room whose
+        # code was reused since, are skipped and compacted
+        self._order: Deque[Tuple[_RoomLog, int]] = deque()
+        self.total_bytes = 0
+        self.total_messages = 0
+
+    def append(self, room_id: str, message: dict) -> int:
+        """Store a message, stamping it with the room's next sequence number"""
+        log = self._rooms.get(room_id)
+        if log is None:
+            log = self._rooms[room_id] = _RoomLog()
+        seq = message["seq"] = log.next_seq
+        log.next_seq += 1
+        size = message_size(message)
+        log.entries.append((seq, message, size))
+        log.bytes += size
+        self.total_bytes += size
+        self.total_messages += 1
+        self._order.append((log, seq))
+
+        while log.entries and (len(log.entries) > self.max_messages or log.bytes > self.max_bytes):
+            self._evict_oldest(log)
+        while self.total_bytes > self.max_total_bytes and self._order:
+            oldest, oldest_seq = self._order.popleft()
+            if oldest.entries and oldest.entries[0][0] == oldest_seq:
+                self._evict_oldest(oldest)
+        if len(self._order) > 2 * self.total_messages + 64:
+            self._compact()
+        return seq
+
+    def _evict_oldest(self, log: _RoomLog):
+        _, _, size = log.entries.popleft()
+        log.bytes -= size
+        self.total_bytes -= size
+        self.total_messages -= 1
+
+    def _compact(self):
+        # A room keeps a contiguous run of seqs, so an entry is live if it
+        # is not older than its room's oldest message
+        self._order = deque((log, seq) for log, seq in self._order if log.entries and seq >= log.entries[0][0])
+
+    def since(self, room_id: str, after_seq: int) -> Tuple[List[dict], bool]:
+        """Messages with seq > after_seq, and whether some of them were already evicted"""
+        log = self._rooms.get(room_id)
+        if log is None:
+            return [], False
+        messages = [message for seq, message, _ in log.entries if seq > after_seq]
+        first_kept = log.entries[0][0] if log.entries else log.next_seq
+        return messages, first_kept > after_seq + 1
+
+    def latest_seq(self, room_id: str) -> int:
+        log = self._rooms.get(room_id)
+        return 0 if log is None else log.next_seq - 1
+
+    def drop(self, room_id: str):
+        log = self._rooms.pop(room_id, None)
+        if log is not None:
+            self.total_bytes -= log.bytes
+            self.total_messages -= len(log.entries)
+            # Leaves the log's entries in _order matching nothing
+            log.entries.clear()
+            log.bytes = 0
@@ -0,0 +1,101 @@
+"""Coalescing of trickled ICE candidates.
+
+Peers trickle candidates one frame at a time, so a mesh room produces a
+burst of tiny frames right after every join. For targets that opted in,
+candidates are buffered per (sender, target) pair for a short window and
+forwarded as one `webrtc_ice_candidates` message. Exact duplicates are
+dropped, and an end-of-candidates marker (a null candidate or an empty
+candidate string) flushes the pair at once.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Client capability that opts a connection into batched candidates
+ICE_BATCH_CAP = "ice_batch"
+
+Send = Callable[[dict, str], Awaitable[Any]]
+
+
+def is_end_of_candidates(candidate: Optional[dict]) -> bool:
+    return candidate is None or not candidate.get("candidate")
+
+
+def candidate_key(candidate: dict) -> Tuple:
+    return (candidate.get("candidate"), candidate.get("sdpMid"), candidate.get("sdpMLineIndex"))
+
+
+class _Batch:
+    __slots__ = ("room_id", "candidates", "seen", "timer")
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.candidates: List[Optional[dict]] = []
+        self.seen: Set[Tuple] = set()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class IceCoalescer:
+    """Per-pair candidate buffers, flushed through `send(message, target)`"""
+
+    def __init__(self, send: Send, window: float = 0.05):
+        self.send = send
+        self.window = window
+        # sender -> target -> batch; kept between flushes so duplicates are
+        # recognised for the whole gathering phase, until end-of-candidates
+        self._batches: Dict[str, Dict[str, _Batch]] = {}
+        # Flushes started by timers, kept so they are not garbage collected
+        # before they run
+        self._flushes: Set[asyncio.Task] = set()
+        self.duplicates_dropped = 0
+
+    async def add(self, sender: str, target: str, room_id: str, candidate: Optional[dict]):
+        batch = self._batches.setdefault(sender, {}).get(target)
+        if batch is None or batch.room_id != room_id:
+            if batch is not None and batch.timer is not None:
+                # Candidates gathered for the room the sender left are stale
+                batch.timer.cancel()
+            batch = self._batches[sender][target] = _Batch(room_id)
+        if is_end_of_candidates(candidate):
+            batch.candidates.append(candidate)
+            del self._batches[sender][target]
+            await self._flush(sender, target, batch)
+            return
+        key = candidate_key(candidate)
+        if key in batch.seen:
+            self.duplicates_dropped += 1
+            return
+        batch.seen.add(key)
+        batch.candidates.append(candidate)
+        if batch.timer is None:
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window, self._start_flush, sender, target, batch
+            )
+
+    def _start_flush(self, sender: str, target: str, batch: _Batch):
+        task = asyncio.create_task(self._flush(sender, target, batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, sender: str, target: str, batch: _Batch):
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        if not batch.candidates:
+            return
+        candidates, batch.candidates = batch.candidates, []
+        await self.send({
+            "type": "webrtc_ice_candidates",
+            "candidates": candidates,
+            "from": sender,
+            "room_id": batch.room_id
+        }, target)
+
+    def discard(self, client_id: str):
+        """Forget every buffer the client sends from; pending candidates are dropped"""
+        for batch in self._batches.pop(client_id, {}).values():
+            if batch.timer is not None:
+                batch.timer.cancel()
+
+    @property
+    def pending_pairs(self) -> int:
+        return sum(len(targets) for targets in self._batches.values())
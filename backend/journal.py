@@ -0,0 +1,257 @@
+"""Durable room registry for the memory backend: an append-only log plus snapshots.
+
+Room creations and deletions are queued in memory and appended to the
+log in batches by one background task, so a request never waits for the
+disk; a crash loses at most the last flush interval. Once the log holds
+more records than there are live rooms, the registry is written out as a
+snapshot and a new log generation is started, which keeps startup time
+proportional to the number of live rooms. Files are read through mmap at
+startup.
+
+Files in the directory: `rooms.snapshot`, whose first line names the
+first log generation still to replay over it, and `rooms.<gen>.log`.
+Records are tab-separated lines: "c <id> <max> <created_at>" for a new
+room and "d <id>" for a deleted one. Replaying a record twice is
+harmless, and a torn record at the end of a log is ignored.
+
+Only room metadata is kept. Members, chat history and versions start over
+after a restart.
+"""
+import asyncio
+import logging
+import mmap
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from rooms import Room
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = "rooms.snapshot"
+
+
+def log_name(generation: int) -> str:
+    return f"rooms.{generation}.log"
+
+
+def encode_create(room: Room) -> str:
+    return f"c\t{room.id}\t{room.max_participants}\t{room.created_at.isoformat()}\n"
+
+
+def encode_delete(room_id: str) -> str:
+    return f"d\t{room_id}\n"
+
+
+def replay(path: str, rooms: Dict[str, Room]) -> Tuple[int, int]:
+    """Apply the records in `path` to `rooms`.
+
+    Returns how many records there were and where the last complete one ends.
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return 0, 0
+    count = end = 0
+    with file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0, 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line in iter(data.readline, b""):
+                if not line.endswith(b"\n"):
+                    logger.warning("Ignoring torn record at the end of %s", path)
+                    break
+                end += len(line)
+                fields = line[:-1].decode().split("\t")
+                try:
+                    if fields[0] == "c":
+                        rooms[fields[1]] = Room(fields[1], int(fields[2]), datetime.fromisoformat(fields[3]), 0)
+                    elif fields[0] == "d":
+                        rooms.pop(fields[1], None)
+                    elif fields[0] != "g":
+                        raise ValueError(fields[0])
+                except (IndexError, ValueError):
+                    logger.warning("Skipping malformed record in %s: %r", path, line)
+                    continue
+                count += 1
+    return count, end
+
+
+class RoomJournal:
+    def __init__(self, directory: str, flush_interval: float = 0.1, fsync: bool = True, compact_min: int = 1000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # The log is compacted once it has more records than this or than
+        # there are live rooms, whichever is larger
+        self.compact_min = compact_min
+        self.generation = 0
+        self.rooms: Dict[str, Room] = {}
+        self._pending: List[str] = []
+        # Records in the current log generation
+        self._log_records = 0
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        # Held while writing, so a flush or compaction requested from
+        # outside never overlaps the background task's
+        self._lock = asyncio.Lock()
+        self.records_written = 0
+        self.snapshots = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load(self) -> Dict[str, Room]:
+        """Rebuild the registry from disk.
+
+        Nothing is written until the first flush. The returned dict is the
+        one later snapshots are taken from, so the backend must keep its
+        rooms in it.
+        """
+        rooms = self.rooms
+        if not os.path.isdir(self.directory):
+            return rooms
+        try:
+            with open(self._path(SNAPSHOT), "rb") as file:
+                header = file.readline().split(b"\t")
+            self.generation = int(header[1]) if header[0] == b"g" else 0
+        except FileNotFoundError:
+            pass
+        replay(self._path(SNAPSHOT), rooms)
+        generations = sorted(
+            int(name.split(".")[1]) for name in os.listdir(self.directory)
+            if name.startswith("rooms.") and name.endswith(".log") and name.split(".")[1].isdigit()
+        )
+        for generation in generations:
+            if generation < self.generation:
+                # Already in the snapshot; left behind by a crash during compaction
+                os.remove(self._path(log_name(generation)))
+                continue
+            path = self._path(log_name(generation))
+            self._log_records, end = replay(path, rooms)
+            self.generation = generation
+            if os.path.getsize(path) > end:
+                # New records must not run on from a torn one
+                os.truncate(path, end)
+        return rooms
+
+    def created(self, room: Room):
+        self._pending.append(encode_create(room))
+
+    def deleted(self, room_id: str):
+        self._pending.append(encode_delete(room_id))
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except OSError:
+                logger.exception("Could not write the room log in %s", self.directory)
+
+    async def flush(self):
+        """Write out queued records, compacting the log once it outgrows the registry"""
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self._pending:
+            lines, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._append, "".join(lines).encode())
+            except OSError:
+                # Retried with the next flush; records may land twice, which replay tolerates
+                self._pending[:0] = lines
+                raise
+            self._log_records += len(lines)
+            self.records_written += len(lines)
+        if self._log_records > max(self.compact_min, len(self.rooms)):
+            await self._compact()
+
+    async def compact(self):
+        """Snapshot the registry and move on to a new log generation.
+
+        Records queued for the old generation are written to its log first,
+        so the previous snapshot plus the logs stay complete until the new
+        snapshot is in place. Records queued meanwhile go to the new one.
+        """
+        async with self._lock:
+            await self._compact()
+
+    async def _compact(self):
+        generation = self.generation
+        old_lines, self._pending = self._pending, []
+        live = list(self.rooms.values())
+        try:
+            await asyncio.to_thread(self._snapshot, "".join(old_lines).encode(), live)
+        except OSError:
+            if self.generation == generation:
+                self._pending[:0] = old_lines
+            raise
+        self.records_written += len(old_lines)
+        self.snapshots += 1
+
+    def _append(self, data: bytes):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self._path(log_name(self.generation)), "ab")
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _snapshot(self, old_data: bytes, live: List[Room]):
+        if old_data:
+            self._append(old_data)
+        generation = self.generation + 1
+        temporary = self._path(SNAPSHOT + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(f"g\t{generation}\n")
+            file.writelines(encode_create(room) for room in live)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self._path(SNAPSHOT))
+        self._sync_directory()
+        # From here on records go to the new generation's log, opened on
+        # the next write
+        self.generation = generation
+        self._log_records = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self._path(log_name(generation - 1)))
+        except FileNotFoundError:
+            pass
+
+    def _sync_directory(self):
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    async def close(self):
+        """Write out everything queued, then stop"""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_journal(directory: Optional[str], **kwargs) -> Optional[RoomJournal]:
+    return RoomJournal(directory, **kwargs) if directory else None
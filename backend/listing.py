@@ -0,0 +1,119 @@
+"""Cursor-paginated, filtered room listings.
+
+Rooms are listed in (creation time, room ID) order and a cursor is the
+key of the last room a page covered, so a listing resumes correctly even
+when rooms are created or deleted between pages, and pages from several
+workers can be merged. Each page examines a bounded number of rooms: when
+filters reject many of them, a page may come back short (even empty)
+with a next_cursor to continue from.
+"""
+import base64
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from state import Room, RoomKey
+
+
+class RoomFilter(NamedTuple):
+    not_full: bool = False
+    created_after: Optional[datetime] = None
+    min_participants: Optional[int] = None
+    max_participants: Optional[int] = None
+
+    def matches(self, room: Room) -> bool:
+        count = len(room.participants)
+        if self.not_full and count >= room.max_participants:
+            return False
+        if self.created_after is not None and room.created_at <= self.created_after:
+            return False
+        if self.min_participants is not None and count < self.min_participants:
+            return False
+        if self.max_participants is not None and count > self.max_participants:
+            return False
+        return True
+
+
+def naive_utc(moment: datetime) -> datetime:
+    """Room timestamps are naive UTC; bring a client-supplied time in line"""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def encode_cursor(key: RoomKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> RoomKey:
+    """Inverse of encode_cursor; raises ValueError for anything else"""
+    try:
+        timestamp, room_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(timestamp), str(room_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class PageScan:
+    """Iterate one page of matching rooms; `next_key` is set once it ends.
+
+    Stops after `limit` matches or after examining `scan_budget` rooms.
+    next_key stays None only if the listing was exhausted.
+    """
+
+    def __init__(self, rooms: AsyncIterator[Tuple[RoomKey, Room]], room_filter: RoomFilter, limit: int, scan_budget: int):
+        self.rooms = rooms
+        self.room_filter = room_filter
+        self.limit = limit
+        self.scan_budget = scan_budget
+        self.next_key: Optional[RoomKey] = None
+
+    async def __aiter__(self):
+        scanned = returned = 0
+        async for key, room in self.rooms:
+            scanned += 1
+            if self.room_filter.matches(room):
+                yield key, room
+                returned += 1
+                if returned >= self.limit:
+                    self.next_key = key
+                    return
+            if scanned >= self.scan_budget:
+                self.next_key = key
+                return
+
+
+async def page_chunks(page: PageScan, summary: bool) -> AsyncIterator[str]:
+    """The page as JSON text, one room per chunk, so it never has to be held whole"""
+    yield '{"rooms":['
+    separator = ""
+    async for _, room in page:
+        yield separator + json.dumps(room.summary() if summary else room.id)
+        separator = ","
+    cursor = None if page.next_key is None else encode_cursor(page.next_key)
+    yield '],"next_cursor":' + json.dumps(cursor) + "}"
+
+
+def merge_pages(pages: Iterable[Tuple[List[Tuple[RoomKey, Dict]], Optional[RoomKey]]], limit: int):
+    """Merge per-worker pages into one, returning (summaries, next key).
+
+    Only rooms up to the smallest key a worker with more rooms stopped at
+    are safe to return; anything past it could skip that worker's rooms.
+    """
+    items: List[Tuple[RoomKey, Dict]] = []
+    cutoff: Optional[RoomKey] = None
+    for page_items, next_key in pages:
+        items.extend(page_items)
+        if next_key is not None and (cutoff is None or next_key < cutoff):
+            cutoff = next_key
+    items.sort(key=lambda item: item[0])
+    if cutoff is not None:
+        items = [item for item in items if item[0] <= cutoff]
+    if len(items) > limit:
+        items = items[:limit]
+        cutoff = items[-1][0]
+    return [room for _, room in items], cutoff
+
+
+def summary_key(summary: Dict) -> RoomKey:
+    return (datetime.fromisoformat(summary["created_at"]).timestamp(), summary["id"])
@@ -0,0 +1,169 @@
+"""Logging that stays off the event loop's hot path.
+
+Records are handed to a background thread through a queue and only
+formatted there, so the loop pays for creating a record, not for
+formatting or writing it. Per-message-type sampling and rate caps drop
+most of the high-volume signaling logs before they are even queued, and
+payloads are wrapped so SDP and chat text are redacted or truncated when
+(and only if) the record is formatted.
+
+Hot-path calls pass the message type as `extra={"msg_type": ...}` so the
+filters can tell them apart.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_redact_enabled = True
+_max_field = 64
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """Parse 'type=value,type=value' into a dict of floats"""
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        msg_type, _, value = entry.partition("=")
+        rates[msg_type.strip()] = float(value)
+    return rates
+
+
+def _redact_value(key: Optional[str], value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _redact_value(k, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(key, v) for v in value]
+    if isinstance(value, str):
+        if _redact_enabled and key in ("sdp", "message", "candidate"):
+            return f"<{key}: {len(value)} chars>"
+        if len(value) > _max_field:
+            return f"{value[:_max_field]}...(+{len(value) - _max_field} chars)"
+    return value
+
+
+class Redacted:
+    """Defers redaction of a payload until the log record is formatted"""
+    __slots__ = ("payload", "key")
+
+    def __init__(self, payload: Any, key: Optional[str] = None):
+        self.payload = payload
+        self.key = key
+
+    def __str__(self) -> str:
+        return str(_redact_value(self.key, self.payload))
+
+
+def redact(payload: Any, key: Optional[str] = None) -> Redacted:
+    return Redacted(payload, key)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records per message type and cap each type's rate.
+
+    Records without a msg_type pass untouched. Suppressed records are
+    counted and the count is attached to the next record let through.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self.suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg_type = getattr(record, "msg_type", None)
+        if msg_type is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample_rates.get(msg_type)
+        if rate is not None and random.random() >= rate:
+            return self._suppress(msg_type)
+        limit = self.rate_limits.get(msg_type)
+        if limit is not None:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(msg_type, (limit, now))
+            tokens = min(limit, tokens + (now - last) * limit)
+            if tokens < 1:
+                self._buckets[msg_type] = (tokens, now)
+                return self._suppress(msg_type)
+            self._buckets[msg_type] = (tokens - 1, now)
+        suppressed = self.suppressed.pop(msg_type, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def _suppress(self, msg_type: str) -> bool:
+        self.suppressed[msg_type] = self.suppressed.get(msg_type, 0) + 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats in prepare(), i.e. on the calling thread.
+    Log arguments must therefore not be mutated after the call, which holds
+    for the ids, strings and received payloads logged here.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with any `extra` fields as top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(
+    level: str = "INFO",
+    fmt: str = "text",
+    sample_rates: Optional[Dict[str, float]] = None,
+    rate_limits: Optional[Dict[str, float]] = None,
+    redact_payloads: bool = True,
+    max_field: int = 64,
+) -> QueueListener:
+    """Route all logging through a queue to a background writer thread"""
+    global _redact_enabled, _max_field
+    _redact_enabled = redact_payloads
+    _max_field = max_field
+
+    output = logging.StreamHandler()
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rates or {}, rate_limits or {}))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
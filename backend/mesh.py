@@ -0,0 +1,70 @@
+"""Server-side plan of who negotiates with whom in a full-mesh room.
+
+Every pair of room members needs exactly one peer connection, and one
+side must make the first offer. The rule is fixed and needs no shared
+state: of the two client IDs, the one that sorts first offers, and the
+other side is the polite peer when renegotiations collide (it rolls back
+its own offer). Clients that connect with ?caps=mesh_plan are told their
+part of the plan in `mesh_plan` messages as members join. Offers they
+send against the plan are not relayed, unless the pair already finished
+its first negotiation, after which either side may renegotiate.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Client capability that opts a connection into the mesh plan
+MESH_PLAN_CAP = "mesh_plan"
+
+
+def offers_to(client_id: str, peer: str) -> bool:
+    """Whether `client_id` makes the first offer to `peer`"""
+    return client_id < peer
+
+
+def split_peers(client_id: str, peers: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """(peers `client_id` offers to, peers it waits for an offer from)"""
+    offer_to, await_from = [], []
+    for peer in peers:
+        if peer != client_id:
+            (offer_to if offers_to(client_id, peer) else await_from).append(peer)
+    return offer_to, await_from
+
+
+class MeshPlanner:
+    def __init__(self):
+        # (room ID, offerer) pairs each client answered as the planned
+        # answerer; it may send offers of its own to them from then on
+        self._answered: Dict[str, Set[Tuple[str, str]]] = {}
+        # The same pairs from the offerer's side: offerer -> (room ID,
+        # answerer), so a leaver's pairs can be found from either end
+        self._answered_by: Dict[str, Set[Tuple[str, str]]] = {}
+        self.suppressed = 0
+
+    def allows_offer(self, room_id: str, sender: str, target: str) -> bool:
+        return offers_to(sender, target) or (room_id, target) in self._answered.get(sender, ())
+
+    def answered(self, room_id: str, sender: str, target: str):
+        """Record an answer from `sender` to `target`'s offer"""
+        if offers_to(target, sender):
+            self._answered.setdefault(sender, set()).add((room_id, target))
+            self._answered_by.setdefault(target, set()).add((room_id, sender))
+
+    def forget(self, client_id: str, room_id: Optional[str] = None):
+        """Drop every pair `client_id` is part of, in one room or all of them.
+
+        A client that rejoins starts over with its first negotiations, so
+        neither its own answers nor those given to it may carry over.
+        """
+        for index, reverse in ((self._answered, self._answered_by), (self._answered_by, self._answered)):
+            pairs = index.get(client_id)
+            if pairs is None:
+                continue
+            dropped = [pair for pair in pairs if room_id is None or pair[0] == room_id]
+            pairs.difference_update(dropped)
+            if not pairs:
+                del index[client_id]
+            for pair_room, peer in dropped:
+                peer_pairs = reverse.get(peer)
+                if peer_pairs is not None:
+                    peer_pairs.discard((pair_room, client_id))
+                    if not peer_pairs:
+                        del reverse[peer]
@@ -0,0 +1,56 @@
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class InboundMessage(BaseModel):
+    """Base schema for client frames; unknown fields are ignored"""
+    model_config = ConfigDict(extra="ignore")
+
+    type: str
+
+
+class JoinRoom(InboundMessage):
+    room_id: str
+    username: Optional[str] = None
+
+
+class LeaveRoom(InboundMessage):
+    room_id: str
+
+
+class RosterSync(InboundMessage):
+    room_id: str
+
+
+class Pong(InboundMessage):
+    pass
+
+
+class ChatMessage(InboundMessage):
+    room_id: str
+    message: str
+    username: Optional[str] = None
+
+
+class ChatHistoryRequest(InboundMessage):
+    room_id: str
+    after_seq: int = 0
+
+
+class WebRTCOffer(InboundMessage):
+    target: str
+    offer: Dict[str, Any]
+    room_id: str
+
+
+class WebRTCAnswer(InboundMessage):
+    target: str
+    answer: Dict[str, Any]
+    room_id: str
+
+
+class WebRTCIceCandidate(InboundMessage):
+    target: str
+    candidate: Optional[Dict[str, Any]]
+    room_id: str
@@ -0,0 +1,198 @@
+"""In-process metrics exported in the Prometheus text format.
+
+Instruments are plain dicts keyed by label values, updated without locks
+from the event loop, so recording costs a dict update (plus a bisect for
+histograms). Everything is rendered on demand by GET /metrics.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; suits both per-frame handling and fan-out to large rooms
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, Sequence[str], float]]:
+        """(name suffix, label values, extra label names, value) for every sample"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra_names, value in self.samples():
+            labels = _format_labels(self.label_names + tuple(extra_names), values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonic count; `fn` reads the current value from elsewhere instead"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.fn = fn
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            yield "", (), (), self.fn()
+        for values, value in self.values.items():
+            yield "", values, (), value
+
+
+class Gauge(Metric):
+    """Current value, either set directly or read from `fn` at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def samples(self):
+        if self.fn is not None:
+            yield "", (), (), self.fn()
+        for values, value in self.values.items():
+            yield "", values, (), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", values + (_format_value(bound),), ("le",), cumulative
+            yield "_sum", values, (), total
+            yield "_count", values, (), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+FRAMES_IN = REGISTRY.counter("collabshare_frames_received_total", "Frames received from clients", ["type"])
+BYTES_IN = REGISTRY.counter("collabshare_received_bytes_total", "Payload bytes received from clients", ["type"])
+FRAMES_REJECTED = REGISTRY.counter("collabshare_frames_rejected_total", "Frames answered with an error", ["reason"])
+FRAMES_RATE_LIMITED = REGISTRY.counter("collabshare_frames_rate_limited_total", "Frames over a rate limit", ["type", "action"])
+RATE_LIMIT_DISCONNECTS = REGISTRY.counter("collabshare_rate_limit_disconnects_total", "Clients disconnected for exceeding rate limits")
+RATE_LIMIT = REGISTRY.gauge("collabshare_rate_limit_per_second", "Configured frames per second per client", ["type"])
+RATE_LIMIT_BURST = REGISTRY.gauge("collabshare_rate_limit_burst", "Configured burst size per client", ["type"])
+HANDLER_SECONDS = REGISTRY.histogram("collabshare_handler_seconds", "Time spent handling a frame", ["type"])
+FRAMES_OUT = REGISTRY.counter("collabshare_frames_sent_total", "Frames written to client sockets", ["type"])
+BYTES_OUT = REGISTRY.counter("collabshare_sent_bytes_total", "Payload bytes written to client sockets", ["type"])
+FRAMES_DROPPED = REGISTRY.counter("collabshare_frames_dropped_total", "Outbound frames shed by a full queue", ["type"])
+SEND_FAILURES = REGISTRY.counter("collabshare_send_failures_total", "Sends that timed out or failed", ["reason"])
+EVICTIONS = REGISTRY.counter("collabshare_evictions_total", "Clients evicted for slow or failed delivery")
+FANOUT_SECONDS = REGISTRY.histogram("collabshare_broadcast_seconds", "Time to queue a broadcast for every room member")
+HTTP_SECONDS = REGISTRY.histogram("collabshare_http_request_seconds", "REST request duration", ["method", "route", "status"])
+ADMISSION_REJECTED = REGISTRY.counter("collabshare_admission_rejected_total", "New work turned away by admission control",
+                                      ["kind", "reason"])
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "collabshare_event_loop_lag_seconds", "How late the event loop woke a timer",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+async def monitor_loop_lag(interval: float = 0.5, on_sample: Optional[Callable[[float], None]] = None):
+    """Sleep for `interval` over and over and record how late each wakeup is"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG_SECONDS.observe(lag)
+        if on_sample is not None:
+            on_sample(lag)
+
+
+class TimedRoute(APIRoute):
+    """Route class that records every request in HTTP_SECONDS by route template"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed(request):
+            start = time.perf_counter()
+            status = "500"
+            try:
+                response = await handler(request)
+                status = str(response.status_code)
+                return response
+            except HTTPException as e:
+                status = str(e.status_code)
+                raise
+            finally:
+                HTTP_SECONDS.observe(time.perf_counter() - start, request.method, self.path_format, status)
+
+        return timed
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from codec import Codec, Frame, Payload
+from metrics import BYTES_OUT, FRAMES_DROPPED, FRAMES_OUT, SEND_FAILURES
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryStatus(str, Enum):
+    """Outcome of handing one message to one recipient"""
+    QUEUED = "queued"
+    RELAYED = "relayed"
+    COALESCED = "coalesced"
+    BUFFERED = "buffered"
+    DROPPED = "dropped"
+    DELIVERED = "delivered"
+    TIMED_OUT = "timed_out"
+    FAILED = "failed"
+    EVICTED = "evicted"
+    NOT_CONNECTED = "not_connected"
+
+
+class OverflowPolicy(str, Enum):
+    """What to do with a message type when a peer's outbound queue is full"""
+    KEEP = "keep"                # never dropped, may push the queue over its limit
+    DROP_OLDEST = "drop_oldest"  # evict the oldest queued message of a droppable type
+    DROP_NEWEST = "drop_newest"  # discard the incoming message
+    COALESCE = "coalesce"        # replace a queued message with the same key
+
+
+# Signaling must never be lost; chat and ICE can be shed under pressure
+DEFAULT_POLICIES: Dict[str, OverflowPolicy] = {
+    "webrtc_offer": OverflowPolicy.KEEP,
+    "webrtc_answer": OverflowPolicy.KEEP,
+    "webrtc_ice_candidate": OverflowPolicy.DROP_OLDEST,
+    "webrtc_ice_candidates": OverflowPolicy.DROP_OLDEST,
+    "chat_message": OverflowPolicy.DROP_OLDEST,
+    "ping": OverflowPolicy.DROP_NEWEST,
+}
+
+
+def parse_policies(spec: str) -> Dict[str, OverflowPolicy]:
+    """Parse 'type=policy,type=policy' overrides on top of DEFAULT_POLICIES"""
+    policies = dict(DEFAULT_POLICIES)
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        msg_type, _, policy = entry.partition("=")
+        policies[msg_type.strip()] = OverflowPolicy(policy.strip())
+    return policies
+
+
+class _Outgoing:
+    __slots__ = ("frame", "msg_type", "data", "key", "policy")
+
+    def __init__(self, frame: Frame, msg_type: str, data: Payload, key: Optional[Hashable], policy: OverflowPolicy):
+        self.frame = frame
+        self.msg_type = msg_type
+        self.data = data
+        self.key = key
+        self.policy = policy
+
+
+class ClientConnection:
+    """A connected websocket with a bounded outbound queue and its own writer task.
+
+    Producers only ever append to the queue, so a slow peer can hold up
+    nothing but its own writer.
+    """
+    __slots__ = ("websocket", "client_id", "client_ip", "codec", "policies", "max_messages", "max_bytes",
+                 "overlimit_grace", "send_timeout", "max_missed_sends", "caps", "limiter", "_on_evict", "_queue",
+                 "_queued_bytes", "_wakeup", "_writer", "_over_limit_since", "missed_sends", "dropped", "detached",
+                 "last_seen")
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        codec: Codec,
+        on_evict: Callable[[str, str], None],
+        policies: Dict[str, OverflowPolicy],
+        max_messages: int = 256,
+        max_bytes: int = 1 << 20,
+        overlimit_grace: float = 5.0,
+        send_timeout: float = 2.0,
+        max_missed_sends: int = 3,
+        caps: FrozenSet[str] = frozenset(),
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.client_ip = websocket.client.host if websocket.client else "unknown"
+        self.codec = codec
+        self.policies = policies
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.overlimit_grace = overlimit_grace
+        self.send_timeout = send_timeout
+        self.max_missed_sends = max_missed_sends
+        # Optional protocol features the client asked for with ?caps=
+        self.caps = caps
+        # Inbound rate limits, applied by the dispatcher
+        self.limiter = limiter
+        self._on_evict = on_evict
+        self._queue: Deque[_Outgoing] = deque()
+        self._queued_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._over_limit_since: Optional[float] = None
+        self.missed_sends = 0
+        self.dropped = 0
+        # Set once this connection no longer owns the client's session:
+        # another connection took it over, or it was reaped
+        self.detached = False
+        # When the client last sent anything, for the heartbeat
+        self.last_seen = time.monotonic()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def evict(self, reason: str):
+        self._on_evict(self.client_id, reason)
+
+    def enqueue(self, frame: Frame, key: Optional[Hashable] = None) -> DeliveryStatus:
+        msg_type = frame.msg_type
+        data = frame.encode(self.codec)
+        policy = self.policies.get(msg_type, OverflowPolicy.KEEP)
+        item = _Outgoing(frame, msg_type, data, key, policy)
+
+        if policy is OverflowPolicy.COALESCE and key is not None:
+            for index, queued in enumerate(self._queue):
+                if queued.key == key:
+                    self._queued_bytes += len(data) - len(queued.data)
+                    self._queue[index] = item
+                    return DeliveryStatus.COALESCED
+
+        status = DeliveryStatus.QUEUED
+        if self._is_full(len(data)):
+            if policy is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                FRAMES_DROPPED.inc(msg_type)
+                return DeliveryStatus.DROPPED
+            if not self._drop_oldest_droppable() and policy is not OverflowPolicy.KEEP:
+                self.dropped += 1
+                FRAMES_DROPPED.inc(msg_type)
+                return DeliveryStatus.DROPPED
+
+        self._queue.append(item)
+        self._queued_bytes += len(data)
+        self._wakeup.set()
+
+        if self._over_limit():
+            now = time.monotonic()
+            if self._over_limit_since is None:
+                self._over_limit_since = now
+            elif now - self._over_limit_since > self.overlimit_grace:
+                self._on_evict(self.client_id, "outbound queue over limit")
+                return DeliveryStatus.EVICTED
+        return status
+
+    def _is_full(self, incoming: int) -> bool:
+        return len(self._queue) >= self.max_messages or self._queued_bytes + incoming > self.max_bytes
+
+    def _over_limit(self) -> bool:
+        return len(self._queue) > self.max_messages or self._queued_bytes > self.max_bytes
+
+    def _drop_oldest_droppable(self) -> bool:
+        for index, queued in enumerate(self._queue):
+            if queued.policy is not OverflowPolicy.KEEP:
+                del self._queue[index]
+                self._queued_bytes -= len(queued.data)
+                self.dropped += 1
+                FRAMES_DROPPED.inc(queued.msg_type)
+                return True
+        return False
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            item = self._queue.popleft()
+            self._queued_bytes -= len(item.data)
+            if self._over_limit_since is not None and not self._over_limit():
+                self._over_limit_since = None
+            if await self._send(item) in (DeliveryStatus.FAILED, DeliveryStatus.EVICTED):
+                return
+
+    async def _send(self, item: _Outgoing) -> DeliveryStatus:
+        """Send with a deadline; evict peers that keep missing it or whose socket fails"""
+        try:
+            if self.codec.binary:
+                send = self.websocket.send_bytes(item.data)
+            else:
+                send = self.websocket.send_text(item.data)
+            await asyncio.wait_for(send, timeout=self.send_timeout)
+        except asyncio.TimeoutError:
+            self.missed_sends += 1
+            SEND_FAILURES.inc("timeout")
+            logger.warning("Send of %s to %s missed its %ss deadline (%d/%d)", item.msg_type, self.client_id,
+                           self.send_timeout, self.missed_sends, self.max_missed_sends)
+            if self.missed_sends >= self.max_missed_sends:
+                self._on_evict(self.client_id, "too many missed send deadlines")
+                return DeliveryStatus.EVICTED
+            return DeliveryStatus.TIMED_OUT
+        except Exception as e:
+            SEND_FAILURES.inc("error")
+            logger.warning("Send to %s failed: %s", self.client_id, e)
+            self._on_evict(self.client_id, "send failed")
+            return DeliveryStatus.FAILED
+        self.missed_sends = 0
+        FRAMES_OUT.inc(item.msg_type)
+        BYTES_OUT.inc(item.msg_type, amount=len(item.data))
+        return DeliveryStatus.DELIVERED
+
+    async def close(self, code: int = 1000):
+        """Stop the writer, discard anything still queued and close the socket"""
+        self.stop()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=self.send_timeout)
+        except Exception as e:
+            logger.debug("Closing %s failed: %s", self.client_id, e)
+
+    def detach(self) -> List[Tuple[Frame, Optional[Hashable]]]:
+        """Stop writing and hand back what was still queued, for another connection to send"""
+        pending = [(item.frame, item.key) for item in self._queue]
+        self.detached = True
+        self.stop()
+        return pending
+
+    def stop(self):
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+        self._queue.clear()
+        self._queued_bytes = 0
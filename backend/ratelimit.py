@@ -0,0 +1,96 @@
+"""Per-connection token buckets for inbound frames.
+
+Limits are given per message type as "type=rate:burst" (frames per second
+and the most that may arrive at once), with ":throttle" appended for types
+that must not be lost: those are delayed until a token is due instead of
+dropped. The "*" entry applies to every frame of a connection and is
+checked before the frame is decoded. A connection that keeps going over
+its limits is reported as an offender so it can be disconnected.
+"""
+import time
+from typing import Dict, NamedTuple, Optional
+
+# Key of the limit that covers every frame, whatever its type
+ALL_FRAMES = "*"
+
+
+class Limit(NamedTuple):
+    rate: float
+    burst: float
+    throttle: bool = False
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """Parse 'type=rate:burst[:throttle],...'"""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        msg_type, _, value = entry.partition("=")
+        rate, _, rest = value.partition(":")
+        burst, _, mode = rest.partition(":")
+        if mode not in ("", "drop", "throttle"):
+            raise ValueError(f"Unknown rate limit mode for {msg_type}: {mode}")
+        limit = Limit(float(rate), float(burst or rate), mode == "throttle")
+        # A bucket that never refills or never holds a whole token would
+        # drop every frame, or hold it forever when throttling
+        if limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f"Rate limit for {msg_type} needs a rate above 0 and a burst of at least 1: {value}")
+        limits[msg_type.strip()] = limit
+    return limits
+
+
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, limit: Limit, now: float):
+        self.rate = limit.rate
+        self.burst = limit.burst
+        self.tokens = limit.burst
+        self.stamp = now
+
+
+class RateLimiter:
+    """Token buckets of one connection, created as each type is first seen"""
+
+    def __init__(self, limits: Dict[str, Limit], max_violations: int = 200, window: float = 10.0):
+        self.limits = limits
+        self.max_violations = max_violations
+        self.window = window
+        self._buckets: Dict[str, _Bucket] = {}
+        # Frames over the limit in the current window
+        self.violations = 0
+        self._window_start = time.monotonic()
+
+    def check(self, msg_type: str) -> Optional[float]:
+        """Take a token for a frame: 0 if it may go ahead, seconds to hold it for, or None to drop it"""
+        limit = self.limits.get(msg_type)
+        if limit is None:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(msg_type)
+        if bucket is None:
+            bucket = self._buckets[msg_type] = _Bucket(limit, now)
+        else:
+            bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.stamp) * bucket.rate)
+            bucket.stamp = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+
+        if now - self._window_start > self.window:
+            self._window_start = now
+            self.violations = 0
+        self.violations += 1
+        if not limit.throttle:
+            return None
+        # Borrow the token; the frame waits until the debt is paid off
+        bucket.tokens -= 1
+        return -bucket.tokens / bucket.rate
+
+    @property
+    def first_violation(self) -> bool:
+        """Whether the frame just checked was the first over the limit in this window"""
+        return self.violations == 1
+
+    @property
+    def offender(self) -> bool:
+        return self.violations > self.max_violations
@@ -0,0 +1,293 @@
+"""Minimal asyncio client for the Redis serialization protocol (RESP2).
+
+Only what the state backend needs: pipelined commands on one connection,
+optimistic transactions (WATCH, then MULTI/EXEC) on pooled connections of
+their own, and a separate subscriber connection for pub/sub. Works against
+Redis, Valkey, KeyDB or any other server that speaks RESP.
+
+Both connections reconnect by themselves with exponential backoff. While
+the command connection is down, commands fail at once with
+ConnectionError instead of waiting for it to come back. Messages
+published while the subscriber is reconnecting are lost, as with any
+pub/sub client.
+"""
+import asyncio
+import logging
+import random
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+Arg = Union[str, bytes, int, float]
+Command = Tuple[Arg, ...]
+
+logger = logging.getLogger(__name__)
+
+# Reconnect delays in seconds: the first retry waits RECONNECT_MIN, and
+# each failure doubles the wait up to RECONNECT_MAX
+RECONNECT_MIN = 0.1
+RECONNECT_MAX = 5.0
+
+
+class RespError(Exception):
+    """Error reply sent by the server"""
+
+
+def parse_url(url: str) -> Tuple[str, int, int, Optional[str]]:
+    """Split redis://[:password@]host[:port][/db] into its parts"""
+    parsed = urlparse(url)
+    db = int(parsed.path.lstrip("/") or 0)
+    return parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password
+
+
+def encode_command(args: Tuple[Arg, ...]) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        else:
+            data = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    line = await reader.readuntil(b"\r\n")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        return RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode()
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unexpected reply prefix {prefix!r}")
+
+
+async def _open(url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    host, port, db, password = parse_url(url)
+    reader, writer = await asyncio.open_connection(host, port)
+    for command in ((("AUTH", password),) if password else ()) + ((("SELECT", db),) if db else ()):
+        writer.write(encode_command(command))
+        reply = await read_reply(reader)
+        if isinstance(reply, RespError):
+            writer.close()
+            raise reply
+    return reader, writer
+
+
+async def _reopen(url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Connect to `url`, retrying with jittered exponential backoff until it works"""
+    delay = RECONNECT_MIN
+    while True:
+        await asyncio.sleep(delay * random.uniform(0.5, 1))
+        try:
+            return await _open(url)
+        except (OSError, RespError) as e:
+            logger.debug("Reconnecting to %s failed: %r", url, e)
+        delay = min(delay * 2, RECONNECT_MAX)
+
+
+class Transaction:
+    """An optimistic transaction on a connection of its own.
+
+    The keys passed to RespClient.transaction are watched before the body
+    runs; commit() then applies its commands only if none of them changed
+    in the meantime.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self.committed = False
+
+    async def _call(self, commands: Tuple[Command, ...]) -> List[Any]:
+        self._writer.write(b"".join(encode_command(command) for command in commands))
+        try:
+            return [await read_reply(self._reader) for _ in commands]
+        except (OSError, EOFError) as e:
+            raise ConnectionError(f"RESP connection lost: {e!r}") from e
+
+    async def read(self, *commands: Command) -> List[Any]:
+        """Replies to `commands`, sent in one round trip"""
+        replies = await self._call(commands)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def commit(self, *commands: Command) -> Optional[List[Any]]:
+        """Run `commands` atomically; None if a watched key changed, so nothing ran"""
+        self.committed = True
+        replies = await self._call((("MULTI",),) + commands + (("EXEC",),))
+        # MULTI and each queued command are acknowledged before EXEC's reply
+        results = replies[-1]
+        if isinstance(results, RespError):
+            raise results
+        for reply in replies[:-1] + (results or []):
+            if isinstance(reply, RespError):
+                raise reply
+        return results
+
+
+class RespClient:
+    """Pipelined command connection: requests are written as they come and
+    replies are matched to callers in order by a single reader task."""
+
+    # Idle transaction connections kept open for reuse
+    max_spare_connections = 4
+
+    def __init__(self, url: str):
+        self.url = url
+        self._spare: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def connect(self):
+        self._attach(*await _open(self.url))
+
+    def _attach(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writer = writer
+        self._reader_task = asyncio.create_task(self._read_replies(reader, writer))
+
+    async def _reconnect(self):
+        self._attach(*await _reopen(self.url))
+        logger.info("Reconnected to %s", self.url)
+
+    async def _read_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RespError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except Exception as e:
+            # Commands issued from here on fail at once rather than queue
+            # behind a connection that may not come back soon
+            self._writer = None
+            writer.close()
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError(f"RESP connection lost: {e!r}"))
+            if not self._closed:
+                logger.warning("Lost connection to %s (%r), reconnecting", self.url, e)
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def execute(self, *args: Arg) -> Any:
+        if self._writer is None:
+            raise ConnectionError("RESP client is not connected")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(encode_command(args))
+        return await future
+
+    @asynccontextmanager
+    async def transaction(self, *keys: str) -> AsyncIterator[Transaction]:
+        """Watch `keys` on a pooled connection for the body of the `async with`.
+
+        WATCH is per connection, so each transaction has one to itself
+        rather than sharing the pipelined connection.
+        """
+        if self._writer is None:
+            raise ConnectionError("RESP client is not connected")
+        if self._spare:
+            connection = self._spare.pop()
+        else:
+            try:
+                connection = await _open(self.url)
+            except OSError as e:
+                raise ConnectionError(f"RESP connection failed: {e!r}") from e
+        transaction = Transaction(*connection)
+        try:
+            await transaction.read(("WATCH",) + keys)
+            yield transaction
+            if not transaction.committed:
+                await transaction.read(("UNWATCH",))
+        except BaseException:
+            # The connection may be mid-reply or still watching; don't reuse it
+            connection[1].close()
+            raise
+        if len(self._spare) < self.max_spare_connections and not self._closed:
+            self._spare.append(connection)
+        else:
+            connection[1].close()
+
+    async def close(self):
+        self._closed = True
+        for task in (self._reader_task, self._reconnect_task):
+            if task is not None:
+                task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        for _, writer in self._spare:
+            writer.close()
+        self._spare.clear()
+
+
+class RespSubscriber:
+    """Dedicated connection in subscribe mode"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.channels: Tuple[str, ...] = ()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def subscribe(self, *channels: str):
+        if self._writer is None:
+            self._reader, self._writer = await _open(self.url)
+        self.channels += channels
+        self._writer.write(encode_command(("SUBSCRIBE",) + channels))
+        await self._writer.drain()
+
+    async def _resubscribe(self, error: Exception):
+        logger.warning("Lost subscriber connection to %s (%r), reconnecting", self.url, error)
+        self._writer.close()
+        while True:
+            self._reader, self._writer = await _reopen(self.url)
+            try:
+                self._writer.write(encode_command(("SUBSCRIBE",) + self.channels))
+                await self._writer.drain()
+            except OSError:
+                self._writer.close()
+                continue
+            logger.info("Resubscribed to %d channels on %s", len(self.channels), self.url)
+            return
+
+    async def messages(self) -> AsyncIterator[Tuple[str, str]]:
+        """Yield (channel, data) for every published message, resubscribing if the connection drops"""
+        while True:
+            try:
+                reply = await read_reply(self._reader)
+            except (OSError, EOFError, RespError) as e:
+                await self._resubscribe(e)
+                continue
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                yield reply[1], reply[2]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
@@ -0,0 +1,98 @@
+"""In-memory records of the room registry.
+
+Rooms are plain __slots__ objects rather than dicts or pydantic models:
+a node may hold hundreds of thousands of them, most idle, and a slotted
+record costs a fraction of a dict with the same fields. They are turned
+into their wire form by hand, which is also cheaper than a generic
+encoder.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Rooms are listed in (creation timestamp, room ID) order; a key is also
+# the position to resume a listing after
+RoomKey = Tuple[float, str]
+
+
+class Membership:
+    """Insertion-ordered set of client IDs with O(1) add, remove and contains.
+
+    The ordered snapshot sent over the wire is built once per change and
+    shared until the next one.
+    """
+    __slots__ = ("_members", "_snapshot")
+
+    def __init__(self, members: Iterable[str] = ()):
+        self._members: Dict[str, None] = dict.fromkeys(members)
+        self._snapshot: Optional[Tuple[str, ...]] = None
+
+    def add(self, client_id: str) -> bool:
+        if client_id in self._members:
+            return False
+        self._members[client_id] = None
+        self._snapshot = None
+        return True
+
+    def discard(self, client_id: str) -> bool:
+        if client_id not in self._members:
+            return False
+        del self._members[client_id]
+        self._snapshot = None
+        return True
+
+    def snapshot(self) -> Tuple[str, ...]:
+        """Members in join order, as an immutable sequence safe to share"""
+        if self._snapshot is None:
+            self._snapshot = tuple(self._members)
+        return self._snapshot
+
+    def __contains__(self, client_id: object) -> bool:
+        return client_id in self._members
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._members)
+
+    def __repr__(self) -> str:
+        return f"Membership({list(self._members)!r})"
+
+
+class Room:
+    """A room's registry entry: identity, limits, members and version"""
+    __slots__ = ("id", "participants", "created_at", "max_participants", "version")
+
+    def __init__(self, room_id: str, max_participants: int, created_at: datetime, version: int,
+                 participants: Iterable[str] = ()):
+        self.id = room_id
+        self.participants = Membership(participants)
+        self.created_at = created_at
+        self.max_participants = max_participants
+        # Bumped on every membership change
+        self.version = version
+
+    def key(self) -> RoomKey:
+        return (self.created_at.timestamp(), self.id)
+
+    def to_dict(self) -> Dict:
+        """The room as it appears in REST responses"""
+        return {
+            "id": self.id,
+            "participants": self.participants.snapshot(),
+            "created_at": self.created_at.isoformat(),
+            "max_participants": self.max_participants,
+            "version": self.version,
+        }
+
+    def summary(self) -> Dict:
+        """Participant count instead of the roster, for room listings"""
+        return {
+            "id": self.id,
+            "participants": len(self.participants),
+            "max_participants": self.max_participants,
+            "created_at": self.created_at.isoformat(),
+        }
+
+    def __repr__(self) -> str:
+        return f"Room({self.id!r}, participants={list(self.participants)!r}, version={self.version})"
@@ -1,15 +1,42 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import Deque, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
 import uuid
+import secrets
 import asyncio
-from datetime import datetime
 import json
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlencode
+
+from admission import AdmissionController, Overload
+from codec import Frame, negotiate, receive_payload
+from compression import SDP_DEFLATE_CAP, DeflateSettings, SdpCompressor, websocket_protocol
+from dispatcher import Dispatcher
+from heartbeat import Heartbeat
+from history import ChatHistory
+from journal import open_journal
+from ice import ICE_BATCH_CAP, IceCoalescer
+from listing import (PageScan, RoomFilter, decode_cursor, encode_cursor, merge_pages, naive_utc, page_chunks,
+                     summary_key)
+from logsetup import configure_logging, parse_rates, redact
+from mesh import MESH_PLAN_CAP, MeshPlanner, split_peers
+from metrics import ADMISSION_REJECTED, EVICTIONS, FANOUT_SECONDS, RATE_LIMIT, RATE_LIMIT_BURST, REGISTRY, TimedRoute, monitor_loop_lag
+from messages import ChatHistoryRequest, ChatMessage, JoinRoom, LeaveRoom, Pong, RosterSync, WebRTCAnswer, WebRTCIceCandidate, WebRTCOffer
+from outbound import ClientConnection, DeliveryStatus, parse_policies
+from ratelimit import RateLimiter, parse_limits
+from sharding import direct_port, fetch_json, generate_owned_code, owner_of, worker_url
+from rooms import Room
+from sessions import RESUME_CAP, ClientSession, HeldSession, new_token
+from state import JoinStatus, LeaveResult, create_backend
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -18,60 +45,534 @@ load_dotenv(ROOT_DIR / '.env')
 app = FastAPI()
 
 # Create API router
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
+
+# In-memory storage for rooms; used by the default "memory" state backend,
+# which can keep it on disk across restarts (see ROOM_LOG_DIR)
+rooms: Dict[str, Room] = {}
+
+# Chat history kept so members can catch up with chat_history: at most
+# CHAT_HISTORY_MESSAGES messages and CHAT_HISTORY_ROOM_BYTES per room, and
+# CHAT_HISTORY_TOTAL_BYTES across all rooms of this process, dropping the
+# oldest messages first; 0 messages turns history off
+CHAT_HISTORY_MESSAGES = int(os.environ.get("CHAT_HISTORY_MESSAGES", "100"))
+CHAT_HISTORY_ROOM_BYTES = int(os.environ.get("CHAT_HISTORY_ROOM_BYTES", str(64 << 10)))
+CHAT_HISTORY_TOTAL_BYTES = int(os.environ.get("CHAT_HISTORY_TOTAL_BYTES", str(32 << 20)))
+chat_history = ChatHistory(CHAT_HISTORY_MESSAGES, CHAT_HISTORY_ROOM_BYTES, CHAT_HISTORY_TOTAL_BYTES)
+
+# State backend: "memory" keeps rooms in this process, "redis" shares them
+# through a RESP server so peers of one room can sit on different nodes
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Multi-worker mode: set by the launcher in __main__ for each worker process.
+# Every room is owned by the worker its code hashes to.
+WORKERS = int(os.environ.get("WORKERS", "1"))
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", "0"))
+WORKER_BASE_PORT = int(os.environ.get("WORKER_BASE_PORT", "8001"))
+
+# Durable rooms for the memory backend: with ROOM_LOG_DIR set, room creations
+# and deletions are appended to a log there, written in batches every
+# ROOM_LOG_FLUSH_INTERVAL seconds (and fsynced unless ROOM_LOG_FSYNC is off),
+# and compacted into a snapshot once the log outgrows the live rooms. Rooms
+# are restored from it on startup. In multi-worker mode each worker keeps
+# its own directory, so the worker count must stay the same across restarts
+ROOM_LOG_DIR = os.environ.get("ROOM_LOG_DIR", "")
+ROOM_LOG_FLUSH_INTERVAL = float(os.environ.get("ROOM_LOG_FLUSH_INTERVAL", "0.1"))
+ROOM_LOG_FSYNC = os.environ.get("ROOM_LOG_FSYNC", "true").lower() in ("1", "true", "yes")
+room_journal = open_journal(
+    os.path.join(ROOM_LOG_DIR, f"worker-{WORKER_INDEX}") if ROOM_LOG_DIR and WORKERS > 1 else ROOM_LOG_DIR,
+    flush_interval=ROOM_LOG_FLUSH_INTERVAL,
+    fsync=ROOM_LOG_FSYNC,
+) if STATE_BACKEND == "memory" else None
+if room_journal is not None:
+    rooms = room_journal.load()
+state = create_backend(STATE_BACKEND, rooms, REDIS_URL, chat_history, room_journal)
+
+# Rooms that became empty since the last cleanup, in the order they emptied
+# (a dict used as an ordered set), and running room lifecycle counters
+pending_empty_rooms: Dict[str, None] = {}
+# Newly created rooms with the monotonic time after which they may be
+# reclaimed if still nobody joined, so a room is not deleted between its
+# creation and its creator's join_room
+NEW_ROOM_GRACE = float(os.environ.get("NEW_ROOM_GRACE", "60"))
+unjoined_rooms: Deque[Tuple[float, str]] = deque()
+# Rooms restored from the room log are shared codes that should outlive a
+# restart: they stay until they next empty, or with RESTORED_ROOM_GRACE set,
+# are also reclaimed if nobody joined them within that many seconds
+RESTORED_ROOM_GRACE = float(os.environ.get("RESTORED_ROOM_GRACE", "0"))
+unjoined_restored_rooms: Deque[Tuple[float, str]] = deque(
+    (time.monotonic() + RESTORED_ROOM_GRACE, room_id) for room_id in rooms
+) if RESTORED_ROOM_GRACE > 0 else deque()
+# Rooms in either queue that nobody joined yet. Queue entries stay until
+# their deadline even if the room was joined meanwhile, so this is what
+# counts as pending
+unjoined_room_ids: Set[str] = {room_id for _, room_id in unjoined_restored_rooms}
+room_stats = {"rooms_created": 0, "rooms_reclaimed": 0}
+session_stats = {"sessions_resumed": 0, "sessions_expired": 0}
+
+# Encoded GET /api/rooms/{room_id} bodies by room, each with the room version
+# it was encoded at; beyond ROOM_CACHE_SIZE rooms the least recently
+# encoded entry is dropped
+ROOM_CACHE_SIZE = int(os.environ.get("ROOM_CACHE_SIZE", "10000"))
+room_bodies: Dict[str, Tuple[int, bytes]] = {}
+
+# Outbound delivery settings: per-send deadline (seconds), how many
+# consecutive missed deadlines a peer may accumulate before it is evicted,
+# and the bounds of each connection's outbound queue
+SEND_TIMEOUT = float(os.environ.get("SEND_TIMEOUT", "2.0"))
+MAX_MISSED_SENDS = int(os.environ.get("MAX_MISSED_SENDS", "3"))
+OUTBOUND_QUEUE_MESSAGES = int(os.environ.get("OUTBOUND_QUEUE_MESSAGES", "256"))
+OUTBOUND_QUEUE_BYTES = int(os.environ.get("OUTBOUND_QUEUE_BYTES", str(1 << 20)))
+OUTBOUND_OVERLIMIT_GRACE = float(os.environ.get("OUTBOUND_OVERLIMIT_GRACE", "5.0"))
+OUTBOUND_POLICIES = parse_policies(os.environ.get("OUTBOUND_POLICIES", ""))
+
+# Inbound rate limits per client, as "type=rate:burst[:throttle],...": frames
+# per second and burst size, with throttled types delayed rather than
+# dropped; "*" covers all frames and is checked before decoding. A client
+# going over its limits more than RATE_LIMIT_MAX_VIOLATIONS times within
+# RATE_LIMIT_WINDOW seconds is disconnected. An empty RATE_LIMITS turns
+# rate limiting off
+RATE_LIMITS = parse_limits(os.environ.get(
+    "RATE_LIMITS",
+    "*=100:200:throttle,chat_message=5:20,webrtc_ice_candidate=50:100,"
+    "webrtc_offer=5:20:throttle,webrtc_answer=5:20:throttle,join_room=5:10:throttle",
+))
+RATE_LIMIT_MAX_VIOLATIONS = int(os.environ.get("RATE_LIMIT_MAX_VIOLATIONS", "200"))
+RATE_LIMIT_WINDOW = float(os.environ.get("RATE_LIMIT_WINDOW", "10"))
+for limited_type, limit in RATE_LIMITS.items():
+    RATE_LIMIT.set(limit.rate, "all" if limited_type == "*" else limited_type)
+    RATE_LIMIT_BURST.set(limit.burst, "all" if limited_type == "*" else limited_type)
+
+# Clients connecting with ?caps=resume keep their rooms for RESUME_GRACE
+# seconds after their socket drops abnormally, with up to
+# RESUME_BUFFER_MESSAGES messages kept for them, and can reconnect with
+# ?resume=<token> to carry on; 0 seconds turns this off
+RESUME_GRACE = float(os.environ.get("RESUME_GRACE", "15"))
+RESUME_BUFFER_MESSAGES = int(os.environ.get("RESUME_BUFFER_MESSAGES", "512"))
+
+# Clients connecting with ?caps=roster_delta get roster_delta add/remove
+# messages instead of participant_joined with the full roster and
+# participant_left. Each delta carries the room version it produced and the
+# one it applies to (base_version); deltas at or below the version of the
+# room_joined snapshot are stale, and on a gap a client sends roster_sync
+# to get a roster_snapshot
+ROSTER_DELTA_CAP = "roster_delta"
 
-# In-memory storage for rooms (no database persistence needed)
-rooms: Dict[str, Dict] = {}
+# How long ICE candidates for one sender/target pair are buffered before
+# being forwarded as a single webrtc_ice_candidates message (seconds), for
+# clients that connect with ?caps=ice_batch; 0 relays every candidate as is
+ICE_BATCH_WINDOW = float(os.environ.get("ICE_BATCH_WINDOW", "0.05"))
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s [%(levelname)s] %(message)s')
+# Websocket compression (permessage-deflate) for clients that offer it,
+# when the server is started with `python server.py`: WS_DEFLATE_WINDOW_BITS
+# (9-15) sizes the compression window every connection keeps, and frames
+# shorter than WS_DEFLATE_MIN_SIZE bytes are sent uncompressed
+WS_DEFLATE = os.environ.get("WS_DEFLATE", "true").lower() in ("1", "true", "yes")
+WS_DEFLATE_WINDOW_BITS = int(os.environ.get("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_MIN_SIZE = int(os.environ.get("WS_DEFLATE_MIN_SIZE", "256"))
+WS_DEFLATE_LEVEL = int(os.environ.get("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MEM_LEVEL = int(os.environ.get("WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_SETTINGS = DeflateSettings(WS_DEFLATE_WINDOW_BITS, WS_DEFLATE_MIN_SIZE, WS_DEFLATE_LEVEL,
+                                      WS_DEFLATE_MEM_LEVEL) if WS_DEFLATE else None
+
+# Clients connecting with ?caps=sdp_deflate get the SDP of offers and
+# answers of at least SDP_DEFLATE_MIN_SIZE bytes as dictionary-compressed
+# sdp_deflate, and may send it that way too
+SDP_DEFLATE_MIN_SIZE = int(os.environ.get("SDP_DEFLATE_MIN_SIZE", "512"))
+
+# GET /api/rooms: default and largest page size, how many rooms one page
+# may examine while filtering, and the page size above which the response
+# is streamed instead of built in one piece
+ROOM_LIST_DEFAULT_LIMIT = int(os.environ.get("ROOM_LIST_DEFAULT_LIMIT", "100"))
+ROOM_LIST_MAX_LIMIT = int(os.environ.get("ROOM_LIST_MAX_LIMIT", "1000"))
+ROOM_LIST_SCAN_BUDGET = int(os.environ.get("ROOM_LIST_SCAN_BUDGET", "5000"))
+ROOM_LIST_STREAM_THRESHOLD = int(os.environ.get("ROOM_LIST_STREAM_THRESHOLD", "200"))
+
+# Clients connected with ?caps=heartbeat that sent nothing for
+# HEARTBEAT_INTERVAL seconds are sent a ping, and those silent for
+# HEARTBEAT_TIMEOUT seconds are reaped as half-open; an interval of 0
+# turns the heartbeat off. Other clients rely on websocket ping/pong
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", "20"))
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", "60"))
+
+# Seconds between event loop lag probes for /metrics and admission control
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+
+# Admission control: new websocket connections and POST /api/rooms are
+# refused with a retry-after hint (ADMISSION_RETRY_AFTER seconds plus
+# jitter) while this node has ADMISSION_MAX_CONNECTIONS open connections,
+# its smoothed event loop lag is above ADMISSION_MAX_LOOP_LAG seconds, or
+# more than ADMISSION_MAX_QUEUED_FRAMES frames wait in outbound queues.
+# MAX_ROOMS caps the number of rooms; in multi-worker mode with the memory
+# backend each worker takes an equal share. 0 disables a limit
+ADMISSION_MAX_CONNECTIONS = int(os.environ.get("ADMISSION_MAX_CONNECTIONS", "10000"))
+ADMISSION_MAX_LOOP_LAG = float(os.environ.get("ADMISSION_MAX_LOOP_LAG", "0.25"))
+ADMISSION_MAX_QUEUED_FRAMES = int(os.environ.get("ADMISSION_MAX_QUEUED_FRAMES", "100000"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "5"))
+MAX_ROOMS = int(os.environ.get("MAX_ROOMS", "0"))
+admission = AdmissionController(ADMISSION_MAX_CONNECTIONS, ADMISSION_MAX_LOOP_LAG, ADMISSION_MAX_QUEUED_FRAMES,
+                                ADMISSION_RETRY_AFTER)
+
+# Codec used when a client does not ask for one; falls back to stdlib JSON
+# if the named backend is not installed
+DEFAULT_CODEC = os.environ.get("DEFAULT_CODEC", "orjson")
+
+# Set up logging: records are written by a background thread. LOG_FORMAT is
+# "text" or "json"; LOG_SAMPLE_RATES keeps a fraction of each message type's
+# per-frame logs and LOG_RATE_LIMITS caps them per second ("type=value,...");
+# LOG_REDACT hides SDP, ICE candidates and chat text, and longer strings are
+# cut at LOG_MAX_FIELD characters
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_SAMPLE_RATES = parse_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+LOG_RATE_LIMITS = parse_rates(os.environ.get("LOG_RATE_LIMITS", "webrtc_ice_candidate=20,chat_message=50"))
+LOG_REDACT = os.environ.get("LOG_REDACT", "true").lower() in ("1", "true", "yes")
+LOG_MAX_FIELD = int(os.environ.get("LOG_MAX_FIELD", "64"))
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_RATE_LIMITS, LOG_REDACT, LOG_MAX_FIELD)
 logger = logging.getLogger(__name__)
 
 # WebSocket connection manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.room_connections: Dict[str, List[str]] = {}
+    def __init__(self, state):
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.state = state
+        # Per-client records of this node's clients, connected or held. Room
+        # membership lives in the state backend; a session only keeps the
+        # reverse index for its client so its rooms are found without
+        # scanning every room. It also keeps the resume token of a client
+        # that asked for resumable sessions, and the held session of one
+        # that dropped and may resume
+        self.sessions: Dict[str, ClientSession] = {}
+        self.held_count = 0
+
+    async def connect(self, websocket: WebSocket, client_id: str) -> ClientConnection:
+        codec, subprotocol = negotiate(websocket, DEFAULT_CODEC)
+        await websocket.accept(subprotocol=subprotocol)
+        connection = ClientConnection(
+            websocket,
+            client_id,
+            codec,
+            on_evict=self.evict,
+            policies=OUTBOUND_POLICIES,
+            max_messages=OUTBOUND_QUEUE_MESSAGES,
+            max_bytes=OUTBOUND_QUEUE_BYTES,
+            overlimit_grace=OUTBOUND_OVERLIMIT_GRACE,
+            send_timeout=SEND_TIMEOUT,
+            max_missed_sends=MAX_MISSED_SENDS,
+            caps=frozenset(filter(None, websocket.query_params.get("caps", "").split(","))),
+            limiter=RateLimiter(RATE_LIMITS, RATE_LIMIT_MAX_VIOLATIONS, RATE_LIMIT_WINDOW) if RATE_LIMITS else None,
+        )
+        pending = self._resume(client_id, websocket.query_params.get("resume"))
+        session = self.session(client_id)
+        previous = self.active_connections.get(client_id)
+        if previous is not None and pending is None:
+            # A new socket under the same client ID replaces the old one
+            previous.detach()
+            asyncio.create_task(previous.close(code=1000))
+        self.active_connections[client_id] = connection
+        connection.start()
+        if RESUME_CAP in connection.caps:
+            token = session.resume_token = new_token()
+            connection.enqueue(Frame({
+                "type": "session",
+                "resume_token": token,
+                "resume_grace": RESUME_GRACE,
+                "resumed": pending is not None,
+                "rooms": sorted(session.rooms)
+            }))
+        else:
+            # Without the cap the client gets no new token, so the session
+            # cannot be held again
+            session.resume_token = None
+        # Whoever took the session over gets what was buffered for it,
+        # whether or not it asked for the session message
+        for frame, key in pending or ():
+            connection.enqueue(frame, key=key)
+        await self.state.set_presence(client_id, NODE_ID)
+        logger.info("Client connected: %s from IP %s using %s%s", client_id, connection.client_ip, codec.name,
+                    " (resumed)" if pending is not None else "")
+        return connection
+
+    def session(self, client_id: str) -> ClientSession:
+        """The client's session record, created on first use"""
+        session = self.sessions.get(client_id)
+        if session is None:
+            session = self.sessions[client_id] = ClientSession()
+        return session
+
+    def can_resume(self, client_id: str, token: Optional[str]) -> bool:
+        """Whether connecting with `token` would resume the client's session"""
+        session = self.sessions.get(client_id)
+        if session is None:
+            return False
+        if session.held is not None:
+            return session.held.matches(token)
+        current_token = session.resume_token
+        return current_token is not None and token is not None and secrets.compare_digest(token, current_token)
+
+    def held_session(self, client_id: str) -> Optional[HeldSession]:
+        session = self.sessions.get(client_id)
+        return None if session is None else session.held
+
+    def take_held(self, client_id: str) -> Optional[HeldSession]:
+        """Detach the client's held session, if any, from its record"""
+        session = self.sessions.get(client_id)
+        if session is None or session.held is None:
+            return None
+        held, session.held = session.held, None
+        self.held_count -= 1
+        return held
+
+    def _resume(self, client_id: str, token: Optional[str]) -> Optional[List[Tuple[Frame, Optional[Hashable]]]]:
+        """Take over the client's session if `token` matches it, returning the messages to replay.
 
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-        client_ip = websocket.client.host if hasattr(websocket, 'client') else 'unknown'
-        logger.info(f"Client connected: {client_id} from IP {client_ip}")
+        Either a held session is resumed, or a connection that has not
+        noticed its socket is gone yet is replaced. This runs without
+        yielding to the event loop, so nothing sent to the client in the
+        meantime is lost or sent twice.
+        """
+        if not self.can_resume(client_id, token):
+            return None
+        held = self.take_held(client_id)
+        if held is not None:
+            held.cancel()
+            session_stats["sessions_resumed"] += 1
+            return list(held.frames)
+        previous = self.active_connections.get(client_id)
+        if previous is not None:
+            asyncio.create_task(previous.close(code=1000))
+            session_stats["sessions_resumed"] += 1
+            return previous.detach()
+        return None
 
-    def disconnect(self, client_id: str):
+    def hold(self, connection: ClientConnection, code: int) -> bool:
+        """Keep the session of a client whose socket dropped, if it can resume.
+
+        Clients that closed normally, or were evicted for being too slow,
+        are not held.
+        """
+        client_id = connection.client_id
+        session = self.sessions.get(client_id)
+        if session is None or session.resume_token is None or RESUME_GRACE <= 0 or code in (1000, 1001):
+            return False
+        if self.active_connections.get(client_id) is not connection:
+            return False
+        del self.active_connections[client_id]
+        self.held_count += 1
+        session.held = HeldSession(
+            session.resume_token, connection.caps, connection.detach(), RESUME_BUFFER_MESSAGES, RESUME_GRACE,
+            lambda: expire_session(client_id),
+        )
+        logger.info("Holding session of %s for %ss", client_id, RESUME_GRACE)
+        return True
+
+    async def disconnect(self, client_id: str) -> Set[str]:
+        """Forget a client and return the rooms it was in.
+
+        Membership in those rooms is left to the caller, which also has to
+        tell the remaining participants.
+        """
         if client_id in self.active_connections:
-            logger.info(f"Client disconnected: {client_id}")
+            logger.info("Client disconnected: %s", client_id)
+            self.active_connections.pop(client_id).stop()
+        session = self.sessions.pop(client_id, None)
+        ice_coalescer.discard(client_id)
+        await self.state.clear_presence(client_id)
+        return set() if session is None else set(session.rooms)
+
+    def accepts(self, client_id: str, cap: str) -> bool:
+        """Whether a locally connected (or held) client asked for the given capability"""
+        connection = self.active_connections.get(client_id) or self.held_session(client_id)
+        return connection is not None and cap in connection.caps
+
+    def in_room(self, room_id: str, client_id: str) -> bool:
+        session = self.sessions.get(client_id)
+        return session is not None and room_id in session.rooms
+
+    async def join_room(self, room_id: str, client_id: str):
+        result = await self.state.add_participant(room_id, client_id)
+        if result.status is JoinStatus.JOINED:
+            self.session(client_id).add_room(room_id)
+        return result
+
+    async def leave_room(self, room_id: str, client_id: str) -> Optional[LeaveResult]:
+        """Leave a room; returns how many remain and the new room version, or None if not a member"""
+        session = self.sessions.get(client_id)
+        if session is not None:
+            session.discard_room(room_id)
+        return await self.state.remove_participant(room_id, client_id)
+
+    def evict(self, client_id: str, reason: str):
+        """Drop a peer from fan-out and close its socket in the background.
+
+        Room membership is released by the websocket handler once the close
+        surfaces there as a WebSocketDisconnect.
+        """
+        connection = self.active_connections.get(client_id)
+        if connection is None:
+            return
+        logger.warning("Evicting client %s: %s", client_id, reason)
+        EVICTIONS.inc()
+        # A failed send means the socket is gone, which a client may resume
+        # from, so its session is held right away; a slow client may not
+        if reason != "send failed" or not self.hold(connection, 1006):
             del self.active_connections[client_id]
-        
-        # Remove from rooms
-        for room_id, participants in self.room_connections.items():
-            if client_id in participants:
-                logger.info(f"Client {client_id} left room {room_id}")
-                participants.remove(client_id)
-                
-        # Clean up empty rooms
-        self.room_connections = {k: v for k, v in self.room_connections.items() if v}
+            session = self.sessions.get(client_id)
+            if session is not None:
+                session.resume_token = None
+        asyncio.create_task(connection.close(code=1008))
 
-    async def send_personal_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(message)
+    def _enqueue(self, frame: Frame, client_id: str) -> DeliveryStatus:
+        connection = self.active_connections.get(client_id)
+        if connection is None:
+            held = self.held_session(client_id)
+            if held is not None:
+                return held.buffer(frame, key=(frame.msg_type, frame.message.get("from")))
+            return DeliveryStatus.NOT_CONNECTED
+        return connection.enqueue(frame, key=(frame.msg_type, frame.message.get("from")))
 
-    async def broadcast_to_room(self, message: str, room_id: str):
-        if room_id in self.room_connections:
-            for client_id in self.room_connections[room_id]:
-                if client_id in self.active_connections:
-                    await self.active_connections[client_id].send_text(message)
+    async def _relay(self, message: dict, client_ids: List[str], results: Dict[str, DeliveryStatus],
+                     cap: Optional[str] = None, alternative: Optional[Tuple[str, dict]] = None):
+        """Publish a message once to each node hosting some of the given clients.
 
-manager = ConnectionManager()
+        With `cap`, the receiving node only delivers it to clients that
+        asked for that capability, since only it knows their caps. An
+        `alternative` (capability, message) pair travels along, and the
+        receiving node picks it for the clients that asked for it.
+        """
+        by_node: Dict[str, List[str]] = {}
+        for client_id, node_id in (await self.state.locate(client_ids)).items():
+            if node_id != NODE_ID:
+                by_node.setdefault(node_id, []).append(client_id)
+        for node_id, recipients in by_node.items():
+            envelope = {"to": recipients, "message": message}
+            if cap is not None:
+                envelope["cap"] = cap
+            if alternative is not None:
+                envelope["alternative"] = list(alternative)
+            await self.state.publish(node_id, envelope)
+            for client_id in recipients:
+                results[client_id] = DeliveryStatus.RELAYED
 
-# Models
-class Room(BaseModel):
-    id: str
-    participants: List[str]
-    created_at: datetime
-    max_participants: int = 5
+    async def deliver_relayed(self, envelope: dict):
+        """Queue a message published by another node for our local recipients"""
+        frame = Frame(envelope["message"])
+        cap = envelope.get("cap")
+        alternative_cap, alternative_frame = None, None
+        if "alternative" in envelope:
+            alternative_cap, alternative_message = envelope["alternative"]
+            alternative_frame = Frame(alternative_message)
+        for client_id in envelope["to"]:
+            if cap is None or self.accepts(client_id, cap):
+                if alternative_frame is not None and self.accepts(client_id, alternative_cap):
+                    self._enqueue(alternative_frame, client_id)
+                else:
+                    self._enqueue(frame, client_id)
 
+    async def send_personal_message(self, message: dict, client_id: str) -> DeliveryStatus:
+        status = self._enqueue(Frame(message), client_id)
+        if status is DeliveryStatus.NOT_CONNECTED:
+            results = {client_id: status}
+            await self._relay(message, [client_id], results)
+            status = results[client_id]
+        return status
+
+    async def multicast(self, message: dict, client_ids: Iterable[str], cap: Optional[str] = None) -> Dict[str, DeliveryStatus]:
+        """Queue one message for several clients, encoding it at most once per codec.
+
+        With `cap`, only clients that asked for that capability get it;
+        those on other nodes are filtered by the node they are on.
+        """
+        frame = Frame(message)
+        results = {}
+        for client_id in client_ids:
+            connection = self.active_connections.get(client_id) or self.held_session(client_id)
+            if cap is None or connection is None or cap in connection.caps:
+                results[client_id] = self._enqueue(frame, client_id)
+        remote = [c for c, status in results.items() if status is DeliveryStatus.NOT_CONNECTED]
+        if remote:
+            await self._relay(message, remote, results, cap)
+        return results
+
+    async def broadcast_to_room(
+        self, message: dict, room_id: str, alternative: Optional[Tuple[str, dict]] = None
+    ) -> Dict[str, DeliveryStatus]:
+        """Queue a message for every room member and return per-recipient results.
+
+        The message is encoded at most once per codec in use and the same
+        payload is queued for every local member. Members connected to other
+        nodes get it through one relay publish per node. Each member's writer
+        task delivers on its own schedule, so a stalled peer holds up neither
+        the other recipients nor the caller.
+
+        `alternative` is a (capability, message) pair: members that asked
+        for the capability get that message instead, wherever they are
+        connected.
+        """
+        start = time.perf_counter()
+        frame = Frame(message)
+        alternative_frame = Frame(alternative[1]) if alternative is not None else None
+        results = {
+            client_id: self._enqueue(
+                alternative_frame if alternative_frame is not None and self.accepts(client_id, alternative[0]) else frame,
+                client_id,
+            )
+            for client_id in await self.state.participants(room_id)
+        }
+        remote = [c for c, status in results.items() if status is DeliveryStatus.NOT_CONNECTED]
+        if remote:
+            await self._relay(message, remote, results, alternative=alternative)
+        undelivered = [c for c, status in results.items()
+                       if status not in (DeliveryStatus.QUEUED, DeliveryStatus.RELAYED, DeliveryStatus.BUFFERED)]
+        if undelivered:
+            logger.info("Broadcast to room %s not queued for %d/%d peers: %s", room_id, len(undelivered), len(results), undelivered)
+        FANOUT_SECONDS.observe(time.perf_counter() - start)
+        return results
+
+manager = ConnectionManager(state)
+ice_coalescer = IceCoalescer(manager.send_personal_message, ICE_BATCH_WINDOW)
+mesh = MeshPlanner()
+sdp_compressor = SdpCompressor(SDP_DEFLATE_MIN_SIZE)
+heartbeat = Heartbeat(lambda: list(manager.active_connections.values()), lambda c: reap_connection(c),
+                      HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT)
+
+# Values the server already tracks, read when /metrics is scraped
+ROOMS = REGISTRY.gauge("collabshare_rooms", "Rooms known to this worker's state backend")
+REGISTRY.gauge("collabshare_active_connections", "Open websocket connections",
+               fn=lambda: len(manager.active_connections))
+REGISTRY.gauge("collabshare_outbound_queued_frames", "Frames waiting in outbound queues",
+               fn=lambda: sum(c.queue_depth for c in manager.active_connections.values()))
+REGISTRY.gauge("collabshare_rooms_pending_cleanup", "Rooms queued for reclamation",
+               fn=lambda: len(pending_empty_rooms) + len(unjoined_room_ids))
+REGISTRY.counter("collabshare_rooms_created_total", "Rooms created", fn=lambda: room_stats["rooms_created"])
+REGISTRY.counter("collabshare_rooms_reclaimed_total", "Empty rooms deleted", fn=lambda: room_stats["rooms_reclaimed"])
+REGISTRY.gauge("collabshare_chat_history_messages", "Chat messages kept for chat_history",
+               fn=lambda: state.chat_usage()["messages"])
+REGISTRY.gauge("collabshare_chat_history_bytes", "Approximate size of the chat messages kept",
+               fn=lambda: state.chat_usage()["bytes"])
+REGISTRY.gauge("collabshare_sessions_held", "Dropped clients whose session may still resume",
+               fn=lambda: manager.held_count)
+REGISTRY.counter("collabshare_sessions_resumed_total", "Sessions resumed after a dropped connection",
+                 fn=lambda: session_stats["sessions_resumed"])
+REGISTRY.counter("collabshare_sessions_expired_total", "Held sessions that ran out of grace or buffer",
+                 fn=lambda: session_stats["sessions_expired"])
+REGISTRY.gauge("collabshare_admission_loop_lag_seconds", "Smoothed event loop lag used for admission control",
+               fn=lambda: admission.loop_lag)
+REGISTRY.counter("collabshare_offers_suppressed_total", "Offers not relayed because they went against the mesh plan",
+                 fn=lambda: mesh.suppressed)
+REGISTRY.counter("collabshare_sdp_bytes_saved_total", "SDP bytes saved by relaying offers and answers compressed",
+                 fn=lambda: sdp_compressor.bytes_saved)
+REGISTRY.counter("collabshare_room_log_records_total", "Room creations and deletions written to the room log",
+                 fn=lambda: 0 if room_journal is None else room_journal.records_written)
+REGISTRY.counter("collabshare_heartbeat_pings_total", "Pings sent to idle clients", fn=lambda: heartbeat.pings_sent)
+REGISTRY.counter("collabshare_connections_reaped_total", "Connections dropped for missing the heartbeat",
+                 fn=lambda: heartbeat.reaped)
+REGISTRY.counter("collabshare_ice_duplicates_dropped_total", "Duplicate ICE candidates not relayed",
+                 fn=lambda: ice_coalescer.duplicates_dropped)
+
+# Models
 class RoomCreate(BaseModel):
     max_participants: int = 5
 
@@ -80,178 +581,571 @@ def generate_room_code() -> str:
     """Generate a 6-character room code"""
     return str(uuid.uuid4())[:8].upper()
 
-def cleanup_empty_rooms():
-    """Remove rooms with no participants"""
-    empty_rooms = [room_id for room_id, room_data in rooms.items() if len(room_data["participants"]) == 0]
-    for room_id in empty_rooms:
-        del rooms[room_id]
+def track_if_empty(room_id: str, left: Optional[LeaveResult]):
+    """Queue a room for cleanup_empty_rooms once its last participant is gone"""
+    if left is not None and left.remaining == 0:
+        pending_empty_rooms[room_id] = None
+
+async def remove_participant(room_id: str, client_id: str) -> Optional[LeaveResult]:
+    """Remove a client from a room, queueing the room for cleanup if it empties"""
+    left = await manager.leave_room(room_id, client_id)
+    track_if_empty(room_id, left)
+    mesh.forget(client_id, room_id)
+    return left
+
+async def announce_plan(room_id: str, newcomer: str, participants: Sequence[str]):
+    """Tell members following the mesh plan which new pairs to open with the newcomer.
+
+    The newcomer gets its whole part of the plan; everyone else gets one
+    of two shared messages, so a join costs two encodings however large
+    the room is.
+    """
+    if manager.accepts(newcomer, MESH_PLAN_CAP):
+        offer_to, await_from = split_peers(newcomer, participants)
+        await manager.send_personal_message({
+            "type": "mesh_plan",
+            "room_id": room_id,
+            "offer_to": offer_to,
+            "await_from": await_from
+        }, newcomer)
+    # Members on other nodes get the plan through the relay, and their own
+    # node drops it for those that did not ask for it
+    answer_newcomer, offer_newcomer = split_peers(newcomer, participants)
+    if offer_newcomer:
+        await manager.multicast({"type": "mesh_plan", "room_id": room_id, "offer_to": [newcomer], "await_from": []},
+                                offer_newcomer, cap=MESH_PLAN_CAP)
+    if answer_newcomer:
+        await manager.multicast({"type": "mesh_plan", "room_id": room_id, "offer_to": [], "await_from": [newcomer]},
+                                answer_newcomer, cap=MESH_PLAN_CAP)
+
+async def announce_departure(room_id: str, client_id: str, left: LeaveResult):
+    await manager.broadcast_to_room({
+        "type": "participant_left",
+        "client_id": client_id
+    }, room_id, alternative=(ROSTER_DELTA_CAP, {
+        "type": "roster_delta",
+        "room_id": room_id,
+        "op": "remove",
+        "client_id": client_id,
+        "version": left.version,
+        "base_version": left.previous_version
+    }))
+
+async def release_client(client_id: str):
+    """Take a departed client out of its rooms and tell the others"""
+    left_rooms = await manager.disconnect(client_id)
+    mesh.forget(client_id)
+    for room_id in left_rooms:
+        logger.info("Client %s left room %s", client_id, room_id)
+        left = await state.remove_participant(room_id, client_id)
+        track_if_empty(room_id, left)
+        if left is not None:
+            await announce_departure(room_id, client_id, left)
+    await cleanup_empty_rooms()
+
+async def reap_connection(connection: ClientConnection):
+    """Drop a connection that stopped answering the heartbeat.
+
+    Its socket is most likely half-open, so the client is released here
+    rather than when a WebSocketDisconnect surfaces, or its session is
+    held if it can resume.
+    """
+    if not manager.hold(connection, 1006):
+        connection.detach()
+        await release_client(connection.client_id)
+    asyncio.create_task(connection.close(code=1001))
+
+def end_held_session(client_id: str) -> bool:
+    """Give up on a held session; the caller then releases the client"""
+    held = manager.take_held(client_id)
+    if held is None:
+        return False
+    held.cancel()
+    session_stats["sessions_expired"] += 1
+    logger.info("Session of %s expired", client_id)
+    return True
+
+def expire_session(client_id: str):
+    """End a held session that ran out of grace period or buffer"""
+    if end_held_session(client_id):
+        asyncio.create_task(release_client(client_id))
+
+async def cleanup_empty_rooms():
+    """Remove rooms that became empty since the last cleanup.
+
+    Only rooms queued by remove_participant, and rooms from create_room or
+    the room log whose grace period is over, are examined; a room that was
+    refilled in the meantime is simply skipped.
+    """
+    while pending_empty_rooms:
+        room_id = next(iter(pending_empty_rooms))
+        del pending_empty_rooms[room_id]
+        if await state.delete_room_if_empty(room_id):
+            room_stats["rooms_reclaimed"] += 1
+            room_bodies.pop(room_id, None)
+    now = time.monotonic()
+    for unjoined in (unjoined_rooms, unjoined_restored_rooms):
+        while unjoined and unjoined[0][0] <= now:
+            _, room_id = unjoined.popleft()
+            if room_id not in unjoined_room_ids:
+                continue
+            unjoined_room_ids.discard(room_id)
+            if await state.delete_room_if_empty(room_id):
+                room_stats["rooms_reclaimed"] += 1
+                room_bodies.pop(room_id, None)
+
+def owns_room(room_id: str) -> bool:
+    return owner_of(room_id, WORKERS) == WORKER_INDEX
+
+def encode_room(room: Room) -> Tuple[int, bytes]:
+    """Encode a room for GET /api/rooms/{room_id} once per version"""
+    entry = (room.version, json.dumps({"room": room.to_dict()}, ensure_ascii=False, separators=(",", ":")).encode())
+    room_bodies.pop(room.id, None)
+    room_bodies[room.id] = entry
+    if len(room_bodies) > ROOM_CACHE_SIZE:
+        del room_bodies[next(iter(room_bodies))]
+    return entry
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
 
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "WebRTC Collaboration Server"}
 
+def overloaded_response(overload: Overload) -> JSONResponse:
+    return JSONResponse(
+        {"error": f"Server overloaded: {overload.reason}", "retry_after": overload.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(overload.retry_after)},
+    )
+
+async def room_cap_reached() -> bool:
+    """Whether MAX_ROOMS rooms exist, after reclaiming any that emptied"""
+    if not MAX_ROOMS:
+        return False
+    cap = MAX_ROOMS if state.shared else max(1, MAX_ROOMS // WORKERS)
+    if await state.room_count() < cap:
+        return False
+    await cleanup_empty_rooms()
+    return await state.room_count() >= cap
+
 @api_router.post("/rooms")
 async def create_room(room_data: RoomCreate):
-    room_id = generate_room_code()
-    room = {
-        "id": room_id,
-        "participants": [],
-        "created_at": datetime.utcnow(),
-        "max_participants": room_data.max_participants
-    }
-    rooms[room_id] = room
-    return {"room_id": room_id, "room": room}
+    overload = admission.check(len(manager.active_connections))
+    if overload is None and await room_cap_reached():
+        overload = admission.overload("room limit reached")
+    if overload is not None:
+        ADMISSION_REJECTED.inc("room", overload.reason)
+        logger.warning("Refusing room creation: %s", overload.reason)
+        return overloaded_response(overload)
+    room_id = generate_owned_code(generate_room_code, WORKER_INDEX, WORKERS)
+    room = await state.create_room(room_id, room_data.max_participants, datetime.utcnow())
+    unjoined_rooms.append((time.monotonic() + NEW_ROOM_GRACE, room_id))
+    unjoined_room_ids.add(room_id)
+    room_stats["rooms_created"] += 1
+    return {"room_id": room_id, "room": room.to_dict()}
 
 @api_router.get("/rooms/{room_id}")
-async def get_room(room_id: str):
-    if room_id not in rooms:
+async def get_room(room_id: str, request: Request):
+    if not owns_room(room_id):
+        owner = owner_of(room_id, WORKERS)
+        return RedirectResponse(
+            worker_url(request.url.scheme, request.url.hostname, WORKER_BASE_PORT, owner, request.url.path),
+            status_code=307,
+        )
+    # Unchanged rooms are answered from the version alone, changed ones from
+    # the body cached for that version where possible
+    version = await state.room_version(room_id)
+    if version is None:
         return {"error": "Room not found"}
-    return {"room": rooms[room_id]}
+    headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    entry = room_bodies.get(room_id)
+    if entry is None or entry[0] != version:
+        room = await state.get_room(room_id)
+        if room is None:
+            return {"error": "Room not found"}
+        entry = encode_room(room)
+        headers["ETag"] = f'"{entry[0]}"'
+    return Response(entry[1], media_type="application/json", headers=headers)
 
 @api_router.get("/rooms")
-async def list_rooms():
-    return {"rooms": list(rooms.keys())}
+async def list_rooms(
+    request: Request,
+    scope: str = "all",
+    cursor: Optional[str] = None,
+    limit: int = ROOM_LIST_DEFAULT_LIMIT,
+    fields: str = "id",
+    not_full: bool = False,
+    created_after: Optional[datetime] = None,
+    min_participants: Optional[int] = None,
+    max_participants: Optional[int] = None,
+):
+    """One page of rooms in creation order: IDs, or summaries with fields=summary.
+
+    Pass the returned next_cursor to get the following page; the listing is
+    complete once next_cursor is null.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    limit = max(1, min(limit, ROOM_LIST_MAX_LIMIT))
+    created_after = naive_utc(created_after) if created_after is not None else None
+    if created_after is not None and (after is None or after[0] < created_after.timestamp()):
+        after = (created_after.timestamp(), "")
+    room_filter = RoomFilter(not_full, created_after, min_participants, max_participants)
+    page = PageScan(state.iter_rooms(after), room_filter, limit, ROOM_LIST_SCAN_BUDGET)
+    summary = fields == "summary"
+
+    if WORKERS == 1 or scope == "local" or state.shared:
+        if limit > ROOM_LIST_STREAM_THRESHOLD:
+            return StreamingResponse(page_chunks(page, summary), media_type="application/json")
+        return Response("".join([chunk async for chunk in page_chunks(page, summary)]), media_type="application/json")
+
+    # Every worker holds its own rooms: merge a page from each of them
+    query = urlencode({**request.query_params, "scope": "local", "fields": "summary", "limit": limit})
+    siblings = [index for index in range(WORKERS) if index != WORKER_INDEX]
+    replies = await asyncio.gather(
+        *(fetch_json("127.0.0.1", direct_port(WORKER_BASE_PORT, index), f"/api/rooms?{query}") for index in siblings),
+        return_exceptions=True,
+    )
+    pages = [([(key, room.summary()) async for key, room in page], page.next_key)]
+    for index, reply in zip(siblings, replies):
+        if isinstance(reply, Exception) or "rooms" not in reply:
+            logger.warning("Could not list rooms of worker %d: %r", index, reply)
+            continue
+        next_key = decode_cursor(reply["next_cursor"]) if reply["next_cursor"] else None
+        pages.append(([(summary_key(room), room) for room in reply["rooms"]], next_key))
+    rooms, next_key = merge_pages(pages, limit)
+    return {
+        "rooms": rooms if summary else [room["id"] for room in rooms],
+        "next_cursor": encode_cursor(next_key) if next_key is not None else None,
+    }
+
+@api_router.get("/stats")
+async def stats():
+    return {
+        "rooms": await state.room_count(),
+        "active_connections": len(manager.active_connections),
+        "rooms_pending_cleanup": len(pending_empty_rooms) + len(unjoined_room_ids),
+        "ice_duplicates_dropped": ice_coalescer.duplicates_dropped,
+        "chat_history": state.chat_usage(),
+        "sessions_held": manager.held_count,
+        "connections_reaped": heartbeat.reaped,
+        "offers_suppressed": mesh.suppressed,
+        "room_log": None if room_journal is None else {
+            "pending": room_journal.pending,
+            "records_written": room_journal.records_written,
+            "snapshots": room_journal.snapshots,
+        },
+        "sdp_compression": {
+            "compressed": sdp_compressor.compressed,
+            "decompressed": sdp_compressor.decompressed,
+            "bytes_saved": sdp_compressor.bytes_saved,
+        },
+        **room_stats,
+        **session_stats,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    ROOMS.set(await state.room_count())
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# WebSocket message handlers
+dispatcher = Dispatcher()
+
+@dispatcher.handler("join_room", JoinRoom)
+async def handle_join_room(connection: ClientConnection, message: JoinRoom):
+    client_id = connection.client_id
+    client_ip = connection.client_ip
+    room_id = message.room_id
+    username = message.username if message.username is not None else f"User_{client_id[:8]}"
+    logger.info("%s (%s) attempting to join room %s from IP %s", username, client_id, room_id, client_ip)
+    
+    if not owns_room(room_id):
+        # Hand the client off to the worker that owns this room
+        url = connection.websocket.url
+        scheme = "wss" if url.scheme in ("wss", "https") else "ws"
+        await manager.send_personal_message({
+            "type": "room_redirect",
+            "room_id": room_id,
+            "url": worker_url(scheme, url.hostname, WORKER_BASE_PORT, owner_of(room_id, WORKERS),
+                              f"{url.path}?{url.query}" if url.query else url.path)
+        }, client_id)
+        return
+    
+    result = await manager.join_room(room_id, client_id)
+    
+    if result.status is JoinStatus.NOT_FOUND:
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "Room not found"
+        }, client_id)
+        return
+    
+    if result.status is JoinStatus.FULL:
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "Room is full"
+        }, client_id)
+        return
+    
+    if result.status is JoinStatus.JOINED:
+        participants = result.participants
+        unjoined_room_ids.discard(room_id)
+        
+        logger.info("%s (%s) joined room %s from IP %s", username, client_id, room_id, client_ip)
+        
+        # Notify all participants
+        await manager.broadcast_to_room({
+            "type": "participant_joined",
+            "client_id": client_id,
+            "username": username,
+            "participants": participants
+        }, room_id, alternative=(ROSTER_DELTA_CAP, {
+            "type": "roster_delta",
+            "room_id": room_id,
+            "op": "add",
+            "client_id": client_id,
+            "username": username,
+            "version": result.version,
+            "base_version": result.previous_version
+        }))
+        
+        # Send current participants to new user
+        await manager.send_personal_message({
+            "type": "room_joined",
+            "room_id": room_id,
+            "participants": participants,
+            "username": username,
+            "version": result.version,
+            "chat_seq": await state.chat_seq(room_id) if CHAT_HISTORY_MESSAGES > 0 else 0
+        }, client_id)
+
+        await announce_plan(room_id, client_id, participants)
+
+        if len(participants) == 1:
+            await manager.send_personal_message({
+                "type": "room_ready",
+                "room_id": room_id,
+                "you_are_sender": True
+            }, client_id)
+
+@dispatcher.handler("leave_room", LeaveRoom)
+async def handle_leave_room(connection: ClientConnection, message: LeaveRoom):
+    client_id = connection.client_id
+    room_id = message.room_id
+    logger.info("Client %s leaving room %s", client_id, room_id)
+    
+    left = await remove_participant(room_id, client_id)
+    if left is not None:
+        await announce_departure(room_id, client_id, left)
+        
+        await cleanup_empty_rooms()
+
+@dispatcher.handler("roster_sync", RosterSync)
+async def handle_roster_sync(connection: ClientConnection, message: RosterSync):
+    """Resend the full roster to a member that noticed a gap in roster_delta versions"""
+    client_id = connection.client_id
+    room = await state.get_room(message.room_id) if manager.in_room(message.room_id, client_id) else None
+    if room is None:
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "Not in room"
+        }, client_id)
+        return
+    await manager.send_personal_message({
+        "type": "roster_snapshot",
+        "room_id": room.id,
+        "participants": room.participants.snapshot(),
+        "version": room.version
+    }, client_id)
+
+@dispatcher.handler("pong", Pong)
+async def handle_pong(connection: ClientConnection, message: Pong):
+    """Nothing to do: every frame, pong included, already refreshed connection.last_seen"""
+
+@dispatcher.handler("chat_message", ChatMessage)
+async def handle_chat_message(connection: ClientConnection, message: ChatMessage):
+    client_id = connection.client_id
+    room_id = message.room_id
+    chat_message = message.message
+    username = message.username if message.username is not None else f"User_{client_id[:8]}"
+    logger.info("Chat in room %s from %s (%s): %s", room_id, username, client_id, redact(chat_message, "message"),
+                extra={"msg_type": "chat_message"})
+    
+    if manager.in_room(room_id, client_id):
+        chat = {
+            "type": "chat_message",
+            "message": chat_message,
+            "username": username,
+            "timestamp": datetime.utcnow().isoformat(),
+            "from": client_id
+        }
+        if CHAT_HISTORY_MESSAGES > 0:
+            await state.append_chat(room_id, chat)
+        await manager.broadcast_to_room(chat, room_id)
+
+@dispatcher.handler("chat_history", ChatHistoryRequest)
+async def handle_chat_history(connection: ClientConnection, message: ChatHistoryRequest):
+    """Send a member every kept chat message after `after_seq` in one frame"""
+    client_id = connection.client_id
+    if not manager.in_room(message.room_id, client_id):
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "Not in room"
+        }, client_id)
+        return
+    messages, truncated = await state.chat_since(message.room_id, message.after_seq)
+    await manager.send_personal_message({
+        "type": "chat_history",
+        "room_id": message.room_id,
+        "messages": messages,
+        "truncated": truncated
+    }, client_id)
+
+@dispatcher.handler("webrtc_offer", WebRTCOffer)
+async def handle_webrtc_offer(connection: ClientConnection, message: WebRTCOffer):
+    client_id = connection.client_id
+    logger.info("WebRTC offer from %s to %s in room %s", client_id, message.target, message.room_id,
+                extra={"msg_type": "webrtc_offer"})
+    
+    if manager.accepts(client_id, MESH_PLAN_CAP) and not mesh.allows_offer(message.room_id, client_id, message.target):
+        # The target makes the first offer for this pair; relaying this one would cause glare
+        mesh.suppressed += 1
+        await manager.send_personal_message({
+            "type": "offer_suppressed",
+            "target": message.target,
+            "room_id": message.room_id
+        }, client_id)
+        return
+    
+    try:
+        offer = sdp_compressor.relay(message.offer, manager.accepts(message.target, SDP_DEFLATE_CAP))
+    except ValueError as e:
+        await manager.send_personal_message({
+            "type": "error",
+            "message": str(e)
+        }, client_id)
+        return
+    
+    await manager.send_personal_message({
+        "type": "webrtc_offer",
+        "offer": offer,
+        "from": client_id,
+        "room_id": message.room_id
+    }, message.target)
+
+@dispatcher.handler("webrtc_answer", WebRTCAnswer)
+async def handle_webrtc_answer(connection: ClientConnection, message: WebRTCAnswer):
+    client_id = connection.client_id
+    logger.info("WebRTC answer from %s to %s in room %s", client_id, message.target, message.room_id,
+                extra={"msg_type": "webrtc_answer"})
+    
+    try:
+        answer = sdp_compressor.relay(message.answer, manager.accepts(message.target, SDP_DEFLATE_CAP))
+    except ValueError as e:
+        await manager.send_personal_message({
+            "type": "error",
+            "message": str(e)
+        }, client_id)
+        return
+    
+    mesh.answered(message.room_id, client_id, message.target)
+    await manager.send_personal_message({
+        "type": "webrtc_answer",
+        "answer": answer,
+        "from": client_id,
+        "room_id": message.room_id
+    }, message.target)
+
+@dispatcher.handler("webrtc_ice_candidate", WebRTCIceCandidate)
+async def handle_webrtc_ice_candidate(connection: ClientConnection, message: WebRTCIceCandidate):
+    client_id = connection.client_id
+    logger.info("ICE candidate from %s to %s in room %s", client_id, message.target, message.room_id,
+                extra={"msg_type": "webrtc_ice_candidate"})
+    
+    if ICE_BATCH_WINDOW > 0 and manager.accepts(message.target, ICE_BATCH_CAP):
+        await ice_coalescer.add(client_id, message.target, message.room_id, message.candidate)
+        return
+    
+    await manager.send_personal_message({
+        "type": "webrtc_ice_candidate",
+        "candidate": message.candidate,
+        "from": client_id,
+        "room_id": message.room_id
+    }, message.target)
+
+async def refuse_connection(websocket: WebSocket, client_id: str, overload: Overload):
+    """Tell a new client to come back later and close with 1013 (try again later)"""
+    ADMISSION_REJECTED.inc("connection", overload.reason)
+    logger.warning("Refusing connection from %s: %s", client_id, overload.reason)
+    codec, subprotocol = negotiate(websocket, DEFAULT_CODEC)
+    await websocket.accept(subprotocol=subprotocol)
+    payload = Frame({"type": "overloaded", "reason": overload.reason, "retry_after": overload.retry_after}).encode(codec)
+    if codec.binary:
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+    await websocket.close(code=1013)
 
 # WebSocket endpoint
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
-    client_ip = websocket.client.host if hasattr(websocket, 'client') else 'unknown'
+    token = websocket.query_params.get("resume")
+    if not manager.can_resume(client_id, token):
+        overload = admission.check(len(manager.active_connections))
+        if overload is not None:
+            await refuse_connection(websocket, client_id, overload)
+            return
+    held = manager.held_session(client_id)
+    if held is not None and not held.matches(token):
+        # A new connection under this ID cannot pick up the held session
+        end_held_session(client_id)
+        await release_client(client_id)
+    connection = await manager.connect(websocket, client_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            logger.debug(f"Received message from {client_id} ({client_ip}): {message}")
-            
-            if message["type"] == "join_room":
-                room_id = message["room_id"]
-                username = message.get("username", f"User_{client_id[:8]}")
-                logger.info(f"{username} ({client_id}) attempting to join room {room_id} from IP {client_ip}")
-                
-                if room_id not in rooms:
-                    await manager.send_personal_message(json.dumps({
-                        "type": "error",
-                        "message": "Room not found"
-                    }), client_id)
-                    continue
+            payload = await receive_payload(websocket)
+            connection.last_seen = time.monotonic()
+            await dispatcher.dispatch(connection, payload)
                 
-                room = rooms[room_id]
-                
-                if len(room["participants"]) >= room["max_participants"]:
-                    await manager.send_personal_message(json.dumps({
-                        "type": "error",
-                        "message": "Room is full"
-                    }), client_id)
-                    continue
-                
-                if client_id not in room["participants"]:
-                    room["participants"].append(client_id)
-                    
-                    if room_id not in manager.room_connections:
-                        manager.room_connections[room_id] = []
-                    manager.room_connections[room_id].append(client_id)
-                    
-                    logger.info(f"{username} ({client_id}) joined room {room_id} from IP {client_ip}")
-                    
-                    # Notify all participants
-                    await manager.broadcast_to_room(json.dumps({
-                        "type": "participant_joined",
-                        "client_id": client_id,
-                        "username": username,
-                        "participants": room["participants"]
-                    }), room_id)
-                    
-                    # Send current participants to new user
-                    await manager.send_personal_message(json.dumps({
-                        "type": "room_joined",
-                        "room_id": room_id,
-                        "participants": room["participants"],
-                        "username": username
-                    }), client_id)
-
-                    if len(room["participants"]) == 1:
-                        await manager.send_personal_message(json.dumps({
-                            "type": "room_ready",
-                            "room_id": room_id,
-                            "you_are_sender": True
-                        }), client_id)
-            
-            elif message["type"] == "leave_room":
-                room_id = message["room_id"]
-                logger.info(f"Client {client_id} leaving room {room_id}")
-                
-                if room_id in rooms and client_id in rooms[room_id]["participants"]:
-                    rooms[room_id]["participants"].remove(client_id)
-                    
-                    if room_id in manager.room_connections:
-                        manager.room_connections[room_id].remove(client_id)
-                    
-                    await manager.broadcast_to_room(json.dumps({
-                        "type": "participant_left",
-                        "client_id": client_id
-                    }), room_id)
-                    
-                    cleanup_empty_rooms()
-            
-            elif message["type"] == "chat_message":
-                room_id = message["room_id"]
-                chat_message = message["message"]
-                username = message.get("username", f"User_{client_id[:8]}")
-                logger.info(f"Chat in room {room_id} from {username} ({client_id}): {chat_message}")
-                
-                if room_id in rooms and client_id in rooms[room_id]["participants"]:
-                    await manager.broadcast_to_room(json.dumps({
-                        "type": "chat_message",
-                        "message": chat_message,
-                        "username": username,
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "from": client_id
-                    }), room_id)
-            
-            elif message["type"] == "webrtc_offer":
-                target_id = message["target"]
-                offer = message["offer"]
-                room_id = message["room_id"]
-                logger.info(f"WebRTC offer from {client_id} to {target_id} in room {room_id}")
-                
-                await manager.send_personal_message(json.dumps({
-                    "type": "webrtc_offer",
-                    "offer": offer,
-                    "from": client_id,
-                    "room_id": room_id
-                }), target_id)
-            
-            elif message["type"] == "webrtc_answer":
-                target_id = message["target"]
-                answer = message["answer"]
-                room_id = message["room_id"]
-                logger.info(f"WebRTC answer from {client_id} to {target_id} in room {room_id}")
-                
-                await manager.send_personal_message(json.dumps({
-                    "type": "webrtc_answer",
-                    "answer": answer,
-                    "from": client_id,
-                    "room_id": room_id
-                }), target_id)
-            
-            elif message["type"] == "webrtc_ice_candidate":
-                target_id = message["target"]
-                candidate = message["candidate"]
-                room_id = message["room_id"]
-                logger.info(f"ICE candidate from {client_id} to {target_id} in room {room_id}")
-                
-                await manager.send_personal_message(json.dumps({
-                    "type": "webrtc_ice_candidate",
-                    "candidate": candidate,
-                    "from": client_id,
-                    "room_id": room_id
-                }), target_id)
-                
-    except WebSocketDisconnect:
-        manager.disconnect(client_id)
-        logger.info(f"WebSocketDisconnect: {client_id} from IP {client_ip}")
-        cleanup_empty_rooms()
+    except WebSocketDisconnect as e:
+        logger.info("WebSocketDisconnect: %s from IP %s", client_id, connection.client_ip)
+        # A resumed connection took over, or the session waits for one
+        if connection.detached or manager.hold(connection, e.code):
+            return
+        await release_client(client_id)
+
+def sample_load(loop_lag: float):
+    admission.sample(loop_lag, sum(c.queue_depth for c in manager.active_connections.values()))
+
+@app.on_event("startup")
+async def start_state_backend():
+    await state.start()
+    await state.subscribe(NODE_ID, manager.deliver_relayed)
+    # Keep a reference so the probe task is not garbage collected
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_loop_lag(LOOP_LAG_INTERVAL, sample_load))
+    if HEARTBEAT_INTERVAL > 0:
+        app.state.heartbeat = asyncio.create_task(heartbeat.run())
+    if room_journal is not None:
+        room_journal.start()
+        logger.info("Restored %d rooms from %s", len(rooms), room_journal.directory)
+    logger.info("Node %s using %s state backend", NODE_ID, STATE_BACKEND)
+
+@app.on_event("shutdown")
+async def stop_state_backend():
+    if room_journal is not None:
+        await room_journal.close()
+    await state.close()
 
 # Include API router
 app.include_router(api_router)
@@ -266,5 +1160,22 @@ app.add_middleware(
 )
 
 if __name__ == "__main__":
+    import argparse
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    from sharding import launch_workers, worker_sockets
+
+    parser = argparse.ArgumentParser(description="WebRTC Collaboration Server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "1")),
+                        help="worker processes; rooms are sharded across them by code")
+    args = parser.parse_args()
+
+    if "WORKER_INDEX" in os.environ:
+        server = uvicorn.Server(uvicorn.Config(app, host=args.host, ws=websocket_protocol(WS_DEFLATE_SETTINGS)))
+        asyncio.run(server.serve(sockets=worker_sockets(args.host, WORKER_BASE_PORT, WORKER_INDEX)))
+    elif args.workers > 1:
+        sys.exit(launch_workers(os.path.abspath(__file__), args.workers, args.host, args.port))
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, ws=websocket_protocol(WS_DEFLATE_SETTINGS))
\ No newline at end of file
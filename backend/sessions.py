@@ -0,0 +1,80 @@
+"""Sessions kept open across a dropped connection so the client can resume.
+
+A client that connects with ?caps=resume is sent a resume token in a
+`session` message. If its socket then drops abnormally, its room
+membership is kept and messages for it are buffered for a grace period;
+reconnecting to /ws/{client_id}?resume=<token> within that period swaps
+the new socket in and replays the buffer, so the rest of the room never
+sees the client leave. A session whose buffer overflows, or whose grace
+period runs out, ends through the normal leave path.
+
+Everything the connection manager keeps about one of its clients, apart
+from the open connection itself, is a slotted ClientSession record.
+"""
+import asyncio
+import secrets
+from collections import deque
+from typing import Callable, Deque, FrozenSet, Hashable, Iterable, Optional, Tuple
+
+from codec import Frame
+from outbound import DeliveryStatus
+
+# Client capability that opts a connection into resumable sessions
+RESUME_CAP = "resume"
+
+Pending = Tuple[Frame, Optional[Hashable]]
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class HeldSession:
+    """A disconnected client's session, buffering messages until it resumes or expires"""
+
+    __slots__ = ("token", "caps", "frames", "max_frames", "_expire", "_timer")
+
+    def __init__(self, token: str, caps: FrozenSet[str], pending: Iterable[Pending], max_frames: int,
+                 grace: float, expire: Callable[[], None]):
+        self.token = token
+        self.caps = caps
+        self.frames: Deque[Pending] = deque(pending)
+        self.max_frames = max_frames
+        self._expire = expire
+        self._timer = asyncio.get_running_loop().call_later(grace, expire)
+
+    def matches(self, token: Optional[str]) -> bool:
+        return token is not None and secrets.compare_digest(token, self.token)
+
+    def buffer(self, frame: Frame, key: Optional[Hashable] = None) -> DeliveryStatus:
+        """Keep a message for replay; a full buffer ends the session instead"""
+        if len(self.frames) >= self.max_frames:
+            self.cancel()
+            self._expire()
+            return DeliveryStatus.DROPPED
+        self.frames.append((frame, key))
+        return DeliveryStatus.BUFFERED
+
+    def cancel(self):
+        self._timer.cancel()
+
+
+class ClientSession:
+    """A local client's rooms, resume token and held session, from connecting until it is released"""
+
+    __slots__ = ("rooms", "resume_token", "held")
+
+    def __init__(self):
+        # A tuple rather than a set: nearly every client is in one room, and
+        # an empty or one-element tuple is far smaller than a set
+        self.rooms: Tuple[str, ...] = ()
+        self.resume_token: Optional[str] = None
+        self.held: Optional[HeldSession] = None
+
+    def add_room(self, room_id: str):
+        if room_id not in self.rooms:
+            self.rooms += (room_id,)
+
+    def discard_room(self, room_id: str):
+        if room_id in self.rooms:
+            self.rooms = tuple(r for r in self.rooms if r != room_id)
@@ -0,0 +1,101 @@
+"""Room-affinity sharding across worker processes on one host.
+
+Every room is owned by exactly one worker, chosen by hashing its code, so
+a room's state is only ever touched by one event loop. All workers accept
+on the shared public port; each also listens on a direct port of its own
+(base port + 1 + index) that clients are redirected to once they ask for a
+room owned elsewhere.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import zlib
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+def owner_of(room_id: str, workers: int) -> int:
+    """Index of the worker that owns a room"""
+    return zlib.crc32(room_id.encode()) % workers if workers > 1 else 0
+
+
+def generate_owned_code(generate: Callable[[], str], worker_index: int, workers: int) -> str:
+    """Draw codes until one hashes to this worker; about `workers` tries on average"""
+    while True:
+        code = generate()
+        if owner_of(code, workers) == worker_index:
+            return code
+
+
+def direct_port(base_port: int, worker_index: int) -> int:
+    return base_port + 1 + worker_index
+
+
+def worker_url(scheme: str, host: str, base_port: int, worker_index: int, path: str) -> str:
+    return f"{scheme}://{host}:{direct_port(base_port, worker_index)}{path}"
+
+
+async def fetch_json(host: str, port: int, path: str, timeout: float = 2.0):
+    """GET a JSON document from a sibling worker over plain HTTP/1.0"""
+    async def fetch():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}:{port}\r\n\r\n".encode())
+            data = await reader.read()
+        finally:
+            writer.close()
+        _, _, body = data.partition(b"\r\n\r\n")
+        return json.loads(body)
+    return await asyncio.wait_for(fetch(), timeout)
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def launch_workers(script: str, workers: int, host: str, port: int) -> int:
+    """Start one process per worker sharing the public listening socket.
+
+    Each child re-runs `script` with WORKER_INDEX/WORKERS/WORKER_BASE_PORT
+    and SHARED_SOCKET_FD in its environment. Returns the first non-zero
+    child exit code, if any.
+    """
+    shared = bind_socket(host, port)
+    children: List[subprocess.Popen] = []
+    for index in range(workers):
+        env = dict(
+            os.environ,
+            WORKERS=str(workers),
+            WORKER_INDEX=str(index),
+            WORKER_BASE_PORT=str(port),
+            SHARED_SOCKET_FD=str(shared.fileno()),
+        )
+        children.append(subprocess.Popen([sys.executable, script], env=env, pass_fds=(shared.fileno(),)))
+    logger.info("Started %d workers on %s:%d (direct ports %d-%d)", workers, host, port, port + 1, port + workers)
+
+    def stop(signum, frame):
+        for child in children:
+            child.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    codes = [child.wait() for child in children]
+    shared.close()
+    return next((code for code in codes if code), 0)
+
+
+def worker_sockets(host: str, base_port: int, worker_index: int) -> List[socket.socket]:
+    """The inherited public socket plus this worker's own direct-port socket"""
+    shared = socket.socket(fileno=int(os.environ["SHARED_SOCKET_FD"]))
+    return [shared, bind_socket(host, direct_port(base_port, worker_index))]
@@ -0,0 +1,463 @@
+"""Room registry, membership and presence behind a swappable backend.
+
+MemoryBackend keeps everything in this process, which is all a single
+node needs. RedisBackend keeps it in any RESP-speaking server so several
+nodes can share rooms, and relays messages to clients connected elsewhere
+over pub/sub.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from history import ChatHistory
+from journal import RoomJournal
+from resp import RespClient, RespSubscriber
+from rooms import Room, RoomKey
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[dict], Awaitable[None]]
+
+class JoinStatus(str, Enum):
+    JOINED = "joined"
+    ALREADY_JOINED = "already_joined"
+    FULL = "full"
+    NOT_FOUND = "not_found"
+
+
+class JoinResult(NamedTuple):
+    status: JoinStatus
+    participants: Tuple[str, ...] = ()
+    # Room version after the join and the version it replaced
+    version: int = 0
+    previous_version: int = 0
+
+
+class LeaveResult(NamedTuple):
+    remaining: int
+    version: int
+    previous_version: int
+
+
+class StateBackend:
+    """Interface every state backend implements"""
+
+    # Whether every node and worker sees the same rooms
+    shared = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def create_room(self, room_id: str, max_participants: int, created_at: datetime) -> Room:
+        raise NotImplementedError
+
+    async def get_room(self, room_id: str) -> Optional[Room]:
+        """The room's record; callers must not modify it, as it may be the backend's own"""
+        raise NotImplementedError
+
+    async def room_version(self, room_id: str) -> Optional[int]:
+        """The room's current version, or None if it does not exist.
+
+        Versions come from one sequence shared by all rooms, so they only
+        grow, also across a room code being reused after deletion.
+        """
+        raise NotImplementedError
+
+    def iter_rooms(self, after: Optional[RoomKey] = None) -> AsyncIterator[Tuple[RoomKey, Room]]:
+        """Yield (key, room) in key order for every room whose key is greater than `after`.
+
+        Rooms created or deleted while iterating may or may not be seen.
+        """
+        raise NotImplementedError
+
+    async def room_count(self) -> int:
+        raise NotImplementedError
+
+    async def add_participant(self, room_id: str, client_id: str) -> JoinResult:
+        raise NotImplementedError
+
+    async def remove_participant(self, room_id: str, client_id: str) -> Optional[LeaveResult]:
+        """Remove a member; returns how many remain and the new room version, or None if it was not a member"""
+        raise NotImplementedError
+
+    async def participants(self, room_id: str) -> Sequence[str]:
+        raise NotImplementedError
+
+    async def delete_room_if_empty(self, room_id: str) -> bool:
+        raise NotImplementedError
+
+    # Chat history
+    async def append_chat(self, room_id: str, message: dict) -> int:
+        """Keep a chat message in the room's history, stamping it with its "seq" and returning it"""
+        raise NotImplementedError
+
+    async def chat_since(self, room_id: str, after_seq: int) -> Tuple[List[dict], bool]:
+        """Kept messages with a seq above `after_seq` in seq order, and whether earlier ones after it are gone"""
+        raise NotImplementedError
+
+    async def chat_seq(self, room_id: str) -> int:
+        """Sequence number of the room's latest chat message, 0 if none"""
+        raise NotImplementedError
+
+    def chat_usage(self) -> Dict[str, int]:
+        """Chat history held by this process"""
+        return {"messages": 0, "bytes": 0}
+
+    # Presence and relay; a single node has nothing to do here
+    async def set_presence(self, client_id: str, node_id: str):
+        pass
+
+    async def clear_presence(self, client_id: str):
+        pass
+
+    async def locate(self, client_ids: Iterable[str]) -> Dict[str, str]:
+        """Map the given clients to the node they are connected to, where known"""
+        return {}
+
+    async def publish(self, node_id: str, envelope: dict):
+        pass
+
+    async def subscribe(self, node_id: str, deliver: Deliver):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Process-local state backed by a plain dict of Room records, handed out without copying.
+
+    With a journal, room creations and deletions are also logged so the
+    registry survives a restart.
+    """
+
+    def __init__(self, rooms: Dict[str, Room], history: ChatHistory, journal: Optional[RoomJournal] = None):
+        self.rooms = rooms
+        self.history = history
+        self.journal = journal
+        # Versions of a registry that outlives the process start from the
+        # clock, so they keep growing past any a client saw before a restart
+        self._versions = itertools.count(1 if journal is None else time.time_ns() // 1000)
+        for room in rooms.values():
+            room.version = next(self._versions)
+        # Sorted keys of every room, for listing from a cursor
+        self._order: List[RoomKey] = sorted(room.key() for room in rooms.values())
+
+    async def create_room(self, room_id: str, max_participants: int, created_at: datetime) -> Room:
+        room = self.rooms[room_id] = Room(room_id, max_participants, created_at, next(self._versions))
+        if self.journal is not None:
+            self.journal.created(room)
+        key = room.key()
+        if not self._order or key > self._order[-1]:
+            self._order.append(key)
+        else:
+            insort(self._order, key)
+        return room
+
+    async def get_room(self, room_id: str) -> Optional[Room]:
+        return self.rooms.get(room_id)
+
+    async def room_version(self, room_id: str) -> Optional[int]:
+        room = self.rooms.get(room_id)
+        return None if room is None else room.version
+
+    async def iter_rooms(self, after: Optional[RoomKey] = None) -> AsyncIterator[Tuple[RoomKey, Room]]:
+        key = after
+        while True:
+            # Re-seek from the last key each time; the list may have changed
+            # while the consumer was suspended
+            index = 0 if key is None else bisect_right(self._order, key)
+            if index >= len(self._order):
+                return
+            key = self._order[index]
+            room = self.rooms.get(key[1])
+            if room is not None:
+                yield key, room
+
+    async def room_count(self) -> int:
+        return len(self.rooms)
+
+    async def add_participant(self, room_id: str, client_id: str) -> JoinResult:
+        room = self.rooms.get(room_id)
+        if room is None:
+            return JoinResult(JoinStatus.NOT_FOUND)
+        participants = room.participants
+        if client_id in participants:
+            return JoinResult(JoinStatus.ALREADY_JOINED, participants.snapshot(), room.version, room.version)
+        if len(participants) >= room.max_participants:
+            return JoinResult(JoinStatus.FULL)
+        participants.add(client_id)
+        previous, room.version = room.version, next(self._versions)
+        return JoinResult(JoinStatus.JOINED, participants.snapshot(), room.version, previous)
+
+    async def remove_participant(self, room_id: str, client_id: str) -> Optional[LeaveResult]:
+        room = self.rooms.get(room_id)
+        if room is None or not room.participants.discard(client_id):
+            return None
+        previous, room.version = room.version, next(self._versions)
+        return LeaveResult(len(room.participants), room.version, previous)
+
+    async def participants(self, room_id: str) -> Sequence[str]:
+        room = self.rooms.get(room_id)
+        return () if room is None else room.participants.snapshot()
+
+    async def delete_room_if_empty(self, room_id: str) -> bool:
+        room = self.rooms.get(room_id)
+        if room is None or room.participants:
+            return False
+        del self.rooms[room_id]
+        if self.journal is not None:
+            self.journal.deleted(room_id)
+        key = room.key()
+        index = bisect_left(self._order, key)
+        if index < len(self._order) and self._order[index] == key:
+            del self._order[index]
+        self.history.drop(room_id)
+        return True
+
+    async def append_chat(self, room_id: str, message: dict) -> int:
+        return self.history.append(room_id, message)
+
+    async def chat_since(self, room_id: str, after_seq: int) -> Tuple[List[dict], bool]:
+        return self.history.since(room_id, after_seq)
+
+    async def chat_seq(self, room_id: str) -> int:
+        return self.history.latest_seq(room_id)
+
+    def chat_usage(self) -> Dict[str, int]:
+        return {"messages": self.history.total_messages, "bytes": self.history.total_bytes}
+
+
+class RedisBackend(StateBackend):
+    """Shared state in a RESP server.
+
+    Keys, under a common prefix:
+      <prefix>:rooms            sorted set of room IDs scored by creation time
+      <prefix>:room:<id>        hash of room metadata
+      <prefix>:members:<id>     sorted set of members scored by join sequence
+      <prefix>:version:<id>     the room's version, swapped with SET ... GET
+      <prefix>:chat:<id>        list of the room's latest chat messages as JSON
+      <prefix>:chatseq:<id>     the room's chat sequence counter
+      <prefix>:seq              join sequence and room version counter
+      <prefix>:presence         hash of client ID -> node ID
+    and one pub/sub channel per node, <prefix>:node:<node_id>.
+    Chat history is bounded by message count only; the bytes it takes are
+    the RESP server's. Joins and room deletions check and change a room in
+    one optimistic transaction (WATCH, then MULTI/EXEC), so nodes racing on
+    the same room cannot interleave.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "collabshare", chat_history_messages: int = 100):
+        self.url = url
+        self.prefix = prefix
+        self.chat_history_messages = chat_history_messages
+        self.client = RespClient(url)
+        self._subscriber: Optional[RespSubscriber] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    async def start(self):
+        await self.client.connect()
+        logger.info("Connected to state backend at %s", self.url)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._subscriber is not None:
+            await self._subscriber.close()
+        await self.client.close()
+
+    async def create_room(self, room_id: str, max_participants: int, created_at: datetime) -> Room:
+        version = await self.client.execute("INCR", self._key("seq"))
+        await asyncio.gather(
+            self.client.execute(
+                "HSET", self._key("room", room_id),
+                "id", room_id,
+                "created_at", created_at.isoformat(),
+                "max_participants", max_participants,
+            ),
+            self.client.execute("SET", self._key("version", room_id), version),
+            self.client.execute("ZADD", self._key("rooms"), created_at.timestamp(), room_id),
+        )
+        return Room(room_id, max_participants, created_at, version)
+
+    async def get_room(self, room_id: str) -> Optional[Room]:
+        fields, participants, version = await asyncio.gather(
+            self.client.execute("HGETALL", self._key("room", room_id)),
+            self.client.execute("ZRANGE", self._key("members", room_id), 0, -1),
+            self.client.execute("GET", self._key("version", room_id)),
+        )
+        if not fields:
+            return None
+        room = dict(zip(fields[::2], fields[1::2]))
+        return Room(room["id"], int(room["max_participants"]), datetime.fromisoformat(room["created_at"]),
+                    int(version or 0), participants)
+
+    async def room_version(self, room_id: str) -> Optional[int]:
+        version = await self.client.execute("GET", self._key("version", room_id))
+        return None if version is None else int(version)
+
+    async def _bump_version(self, room_id: str, version: int) -> int:
+        """Set the room's version and return the one it replaced"""
+        previous = await self.client.execute("SET", self._key("version", room_id), version, "GET")
+        return int(previous or 0)
+
+    async def iter_rooms(self, after: Optional[RoomKey] = None, batch: int = 100) -> AsyncIterator[Tuple[RoomKey, Room]]:
+        count = batch
+        while True:
+            reply = await self.client.execute(
+                "ZRANGEBYSCORE", self._key("rooms"), "-inf" if after is None else repr(after[0]), "+inf",
+                "WITHSCORES", "LIMIT", 0, count,
+            )
+            entries = [(float(score), room_id) for room_id, score in zip(reply[::2], reply[1::2])]
+            fresh = [key for key in entries if after is None or key > after]
+            exhausted = len(entries) < count
+            if not fresh:
+                if exhausted:
+                    return
+                # A run of rooms created at the same instant fills the
+                # whole batch; widen it until the run is passed
+                count *= 2
+                continue
+            count = batch
+            rooms = await asyncio.gather(*(self.get_room(room_id) for _, room_id in fresh))
+            for key, room in zip(fresh, rooms):
+                if room is not None:
+                    yield key, room
+            if exhausted:
+                return
+            after = fresh[-1]
+
+    async def room_count(self) -> int:
+        return await self.client.execute("ZCARD", self._key("rooms"))
+
+    async def add_participant(self, room_id: str, client_id: str) -> JoinResult:
+        room, members, version_key = self._key("room", room_id), self._key("members", room_id), self._key("version", room_id)
+        # Check and join in one optimistic transaction, retried whenever
+        # another node changed the room in between, so a join can neither
+        # revive a deleted room nor overfill one
+        while True:
+            async with self.client.transaction(room, members) as transaction:
+                max_participants, participants, version = await transaction.read(
+                    ("HGET", room, "max_participants"),
+                    ("ZRANGE", members, 0, -1),
+                    ("GET", version_key),
+                )
+                if max_participants is None:
+                    return JoinResult(JoinStatus.NOT_FOUND)
+                if client_id in participants:
+                    version = int(version or 0)
+                    return JoinResult(JoinStatus.ALREADY_JOINED, tuple(participants), version, version)
+                if len(participants) >= int(max_participants):
+                    return JoinResult(JoinStatus.FULL)
+                # The join sequence number doubles as the room's new version
+                seq = await self.client.execute("INCR", self._key("seq"))
+                replies = await transaction.commit(
+                    ("ZADD", members, seq, client_id),
+                    ("SET", version_key, seq, "GET"),
+                )
+            if replies is not None:
+                return JoinResult(JoinStatus.JOINED, tuple(participants) + (client_id,), seq, int(replies[1] or 0))
+
+    async def remove_participant(self, room_id: str, client_id: str) -> Optional[LeaveResult]:
+        members = self._key("members", room_id)
+        removed, remaining = await asyncio.gather(
+            self.client.execute("ZREM", members, client_id),
+            self.client.execute("ZCARD", members),
+        )
+        if not removed:
+            return None
+        version = await self.client.execute("INCR", self._key("seq"))
+        return LeaveResult(remaining, version, await self._bump_version(room_id, version))
+
+    async def participants(self, room_id: str) -> Sequence[str]:
+        return tuple(await self.client.execute("ZRANGE", self._key("members", room_id), 0, -1))
+
+    async def delete_room_if_empty(self, room_id: str) -> bool:
+        room, members = self._key("room", room_id), self._key("members", room_id)
+        # Retried like add_participant, so a join that lands between the
+        # check and the delete keeps its room
+        while True:
+            async with self.client.transaction(room, members) as transaction:
+                count, = await transaction.read(("ZCARD", members))
+                if count:
+                    return False
+                replies = await transaction.commit(
+                    ("ZREM", self._key("rooms"), room_id),
+                    ("DEL", room, members, self._key("version", room_id), self._key("chat", room_id),
+                     self._key("chatseq", room_id)),
+                )
+            if replies is not None:
+                return bool(replies[0])
+
+    async def append_chat(self, room_id: str, message: dict) -> int:
+        seq = message["seq"] = await self.client.execute("INCR", self._key("chatseq", room_id))
+        key = self._key("chat", room_id)
+        await asyncio.gather(
+            self.client.execute("RPUSH", key, json.dumps(message)),
+            self.client.execute("LTRIM", key, -self.chat_history_messages, -1),
+        )
+        return seq
+
+    async def chat_since(self, room_id: str, after_seq: int) -> Tuple[List[dict], bool]:
+        kept = [json.loads(entry) for entry in await self.client.execute("LRANGE", self._key("chat", room_id), 0, -1)]
+        # Nodes append concurrently, so list order is only roughly seq order
+        kept.sort(key=lambda message: message["seq"])
+        messages = [message for message in kept if message["seq"] > after_seq]
+        if kept:
+            return messages, kept[0]["seq"] > after_seq + 1
+        return messages, await self.chat_seq(room_id) > after_seq
+
+    async def chat_seq(self, room_id: str) -> int:
+        return int(await self.client.execute("GET", self._key("chatseq", room_id)) or 0)
+
+    async def set_presence(self, client_id: str, node_id: str):
+        await self.client.execute("HSET", self._key("presence"), client_id, node_id)
+
+    async def clear_presence(self, client_id: str):
+        await self.client.execute("HDEL", self._key("presence"), client_id)
+
+    async def locate(self, client_ids: Iterable[str]) -> Dict[str, str]:
+        client_ids = list(client_ids)
+        if not client_ids:
+            return {}
+        nodes = await self.client.execute("HMGET", self._key("presence"), *client_ids)
+        return {client_id: node for client_id, node in zip(client_ids, nodes) if node is not None}
+
+    async def publish(self, node_id: str, envelope: dict):
+        await self.client.execute("PUBLISH", self._key("node", node_id), json.dumps(envelope))
+
+    async def subscribe(self, node_id: str, deliver: Deliver):
+        self._subscriber = RespSubscriber(self.url)
+        await self._subscriber.subscribe(self._key("node", node_id))
+        self._listener = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Deliver):
+        # The subscriber reconnects by itself, so this only ends on a bug
+        try:
+            async for _, data in self._subscriber.messages():
+                try:
+                    await deliver(json.loads(data))
+                except Exception:
+                    logger.exception("Failed to deliver relayed message")
+        except Exception:
+            logger.exception("Relay listener stopped; messages from other nodes will not be delivered")
+
+
+def create_backend(kind: str, rooms: Dict[str, Room], redis_url: str, history: ChatHistory,
+                   journal: Optional[RoomJournal] = None) -> StateBackend:
+    if kind == "memory":
+        return MemoryBackend(rooms, history, journal)
+    if kind == "redis":
+        return RedisBackend(redis_url, chat_history_messages=history.max_messages)
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
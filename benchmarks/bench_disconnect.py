@@ -0,0 +1,81 @@
+"""Disconnect cost as the number of rooms on a node grows.
+
+Fills the in-memory state backend with N two-person rooms, then times
+disconnecting a sample of clients: dropping the connection plus leaving
+each of the client's rooms, as the websocket handler does. With the
+client->rooms index the per-disconnect cost should stay flat as N grows;
+the legacy full scan is timed alongside for comparison.
+
+    python benchmarks/bench_disconnect.py [--sizes 1000,10000,100000]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from history import ChatHistory  # noqa: E402
+from server import ConnectionManager  # noqa: E402
+from state import MemoryBackend  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+async def populate(manager: ConnectionManager, room_count: int):
+    now = datetime.utcnow()
+    for i in range(room_count):
+        room_id = f"ROOM{i:07d}"
+        await manager.state.create_room(room_id, 2, now)
+        await manager.join_room(room_id, f"client_{i}_a")
+        await manager.join_room(room_id, f"client_{i}_b")
+
+
+def legacy_disconnect(room_connections, client_id):
+    """The pre-index disconnect: scan every room, then rebuild the dict"""
+    for participants in room_connections.values():
+        if client_id in participants:
+            participants.remove(client_id)
+    return {k: v for k, v in room_connections.items() if v}
+
+
+async def bench(room_count: int, samples: int):
+    manager = ConnectionManager(MemoryBackend({}, ChatHistory()))
+    await populate(manager, room_count)
+    step = max(1, room_count // samples)
+    victims = [f"client_{i}_a" for i in range(0, room_count, step)][:samples]
+
+    start = time.perf_counter()
+    for client_id in victims:
+        for room_id in await manager.disconnect(client_id):
+            await manager.state.remove_participant(room_id, client_id)
+    indexed = (time.perf_counter() - start) / len(victims)
+
+    room_connections = {
+        f"ROOM{i:07d}": [f"client_{i}_a", f"client_{i}_b"] for i in range(room_count)
+    }
+    legacy_victims = victims[: max(1, min(len(victims), 200_000 // room_count))]
+    start = time.perf_counter()
+    for client_id in legacy_victims:
+        room_connections = legacy_disconnect(room_connections, client_id)
+    scan = (time.perf_counter() - start) / len(legacy_victims)
+    return indexed, scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rooms':>10} {'indexed us/op':>15} {'full scan us/op':>17}")
+    for room_count in (int(size) for size in args.sizes.split(",")):
+        indexed, scan = asyncio.run(bench(room_count, args.samples))
+        print(f"{room_count:>10} {indexed * 1e6:>15.2f} {scan * 1e6:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Memory per idle room and per connected client at scale.
+
+Creates N idle rooms in the in-memory state backend and then connects N
+clients two to a room, measuring what each step allocates with
+tracemalloc. Rooms are compared with the dict-per-room layout the
+backend used before Room records, and client sessions with the separate
+per-client dicts (a room set and a resume token each) the connection
+manager used before ClientSession records. Client numbers include the
+connection object with its empty outbound queue and the client's entry in
+its room's membership.
+
+    python benchmarks/bench_memory.py [--sizes 10000,100000]
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import secrets
+import sys
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from codec import get_codec  # noqa: E402
+from history import ChatHistory  # noqa: E402
+from outbound import ClientConnection  # noqa: E402
+from rooms import Membership  # noqa: E402
+from server import ConnectionManager  # noqa: E402
+from sessions import ClientSession  # noqa: E402
+from state import MemoryBackend  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+def allocated(build) -> tuple:
+    """(bytes allocated by build(), its result)"""
+    gc.collect()
+    start = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - start, result
+
+
+def legacy_rooms(count: int) -> tuple:
+    """Rooms as the memory backend used to keep them, with their listing order"""
+    now = datetime.utcnow()
+    rooms, order = {}, []
+    for i in range(count):
+        room_id = f"ROOM{i:07d}"
+        rooms[room_id] = {"id": room_id, "participants": Membership(), "created_at": now, "max_participants": 5,
+                          "version": i + 1}
+        order.append((now.timestamp(), room_id))
+    return rooms, order
+
+
+async def create_rooms(backend: MemoryBackend, count: int):
+    now = datetime.utcnow()
+    for i in range(count):
+        await backend.create_room(f"ROOM{i:07d}", 5, now)
+
+
+async def connect_clients(manager: ConnectionManager, count: int):
+    websocket = SimpleNamespace(client=None)
+    codec = get_codec("json")
+    for i in range(count):
+        client_id = f"client_{i:07d}"
+        manager.active_connections[client_id] = ClientConnection(websocket, client_id, codec, manager.evict, {})
+        session = manager.sessions[client_id] = ClientSession()
+        session.resume_token = secrets.token_urlsafe(16)
+        await manager.join_room(f"ROOM{i // 2:07d}", client_id)
+
+
+def new_sessions(count: int) -> dict:
+    sessions = {}
+    for i in range(count):
+        session = sessions[f"client_{i:07d}"] = ClientSession()
+        session.rooms = (f"ROOM{i // 2:07d}",)
+        session.resume_token = secrets.token_urlsafe(16)
+    return sessions
+
+
+def legacy_sessions(count: int) -> tuple:
+    client_rooms, resume_tokens = {}, {}
+    for i in range(count):
+        client_id = f"client_{i:07d}"
+        client_rooms[client_id] = {f"ROOM{i // 2:07d}"}
+        resume_tokens[client_id] = secrets.token_urlsafe(16)
+    return client_rooms, resume_tokens
+
+
+def bench(count: int):
+    backend = MemoryBackend({}, ChatHistory())
+    room_bytes, _ = allocated(lambda: asyncio.run(create_rooms(backend, count)))
+    legacy_room_bytes, _ = allocated(lambda: legacy_rooms(count))
+
+    manager = ConnectionManager(backend)
+    client_bytes, _ = allocated(lambda: asyncio.run(connect_clients(manager, count)))
+    sessions_bytes, _ = allocated(lambda: new_sessions(count))
+    legacy_session_bytes, _ = allocated(lambda: legacy_sessions(count))
+    return room_bytes / count, legacy_room_bytes / count, client_bytes / count, sessions_bytes / count, \
+        legacy_session_bytes / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    print(f"{'count':>8} {'B/room':>8} {'B/room (dicts)':>15} {'B/client':>9} "
+          f"{'B/session':>10} {'B/session (dicts)':>18}")
+    for count in (int(size) for size in args.sizes.split(",")):
+        room, legacy_room, client, session, legacy_session = bench(count)
+        print(f"{count:>8} {room:>8.0f} {legacy_room:>15.0f} {client:>9.0f} {session:>10.0f} {legacy_session:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cost of the durable room registry on the write path and at startup.
+
+Creates rooms in the in-memory state backend with and without a room log
+and reports the time per create_room call, which should not include any
+disk I/O. Then churns rooms (creating and deleting many more than stay
+alive) and times restoring the registry from the log directory, which
+should follow the number of live rooms rather than the churn.
+
+    python benchmarks/bench_room_log.py [--live 10000,100000] [--churn 5]
+"""
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from history import ChatHistory  # noqa: E402
+from journal import RoomJournal  # noqa: E402
+from state import MemoryBackend  # noqa: E402
+
+
+async def create_rooms(backend: MemoryBackend, prefix: str, count: int) -> float:
+    """Seconds per create_room"""
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    for i in range(count):
+        await backend.create_room(f"{prefix}{i:07d}", 5, now)
+    return (time.perf_counter() - start) / count
+
+
+async def fill(directory: str, live: int, churn: int) -> float:
+    """Leave `live` rooms in a log that saw `churn` times as many come and go"""
+    journal = RoomJournal(directory, flush_interval=0.01)
+    backend = MemoryBackend(journal.load(), ChatHistory(), journal)
+    journal.start()
+    per_create = await create_rooms(backend, "LIVE", live)
+    for round_index in range(churn):
+        await create_rooms(backend, f"T{round_index}_", live)
+        for i in range(live):
+            await backend.delete_room_if_empty(f"T{round_index}_{i:07d}")
+        await asyncio.sleep(0)
+    await journal.close()
+    return per_create
+
+
+def restore(directory: str) -> tuple:
+    start = time.perf_counter()
+    journal = RoomJournal(directory)
+    rooms = journal.load()
+    elapsed = time.perf_counter() - start
+    asyncio.run(journal.close())
+    return len(rooms), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", default="10000,100000")
+    parser.add_argument("--churn", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'live rooms':>10} {'create us (no log)':>18} {'create us (log)':>16} {'restored':>9} {'restore ms':>11}")
+    for live in (int(size) for size in args.live.split(",")):
+        plain = asyncio.run(create_rooms(MemoryBackend({}, ChatHistory()), "ROOM", live))
+        directory = tempfile.mkdtemp(prefix="room-log-")
+        try:
+            logged = asyncio.run(fill(directory, live, args.churn))
+            restored, elapsed = restore(directory)
+        finally:
+            shutil.rmtree(directory)
+        print(f"{live:>10} {plain * 1e6:>18.2f} {logged * 1e6:>16.2f} {restored:>9} {elapsed * 1e3:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Bytes on the wire and CPU per relayed offer for each compression setting.
+
+Builds browser-like offers (audio, video and a data channel, with random
+ICE credentials, fingerprints, SSRCs and candidates) and relays them the
+way the server does: the `webrtc_offer` message is encoded once and sent
+through the permessage-deflate extension a connection would negotiate.
+Each setting is run for the first offer on a connection and for a
+renegotiation, where a compressor that keeps its context has seen an
+offer before. Reports frame bytes including the websocket header, server
+CPU per offer, and the compressor memory every connection holds.
+
+    python benchmarks/bench_sdp_compression.py [--offers 2000] [--window-bits 9,12,15]
+"""
+import argparse
+import json
+import random
+import secrets
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate  # noqa: E402
+from websockets.frames import Frame, Opcode  # noqa: E402
+
+from compression import SdpCompressor, ThresholdPerMessageDeflate, decompress_sdp  # noqa: E402
+
+AUDIO = """m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126
+c=IN IP4 0.0.0.0
+a=rtcp:9 IN IP4 0.0.0.0
+{candidates}a=ice-ufrag:{ufrag}
+a=ice-pwd:{pwd}
+a=ice-options:trickle
+a=fingerprint:sha-256 {fingerprint}
+a=setup:actpass
+a=mid:0
+a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level
+a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time
+a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01
+a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid
+a=sendrecv
+a=msid:{stream} {audio_track}
+a=rtcp-mux
+a=rtpmap:111 opus/48000/2
+a=rtcp-fb:111 transport-cc
+a=fmtp:111 minptime=10;useinbandfec=1
+a=rtpmap:63 red/48000/2
+a=fmtp:63 111/111
+a=rtpmap:9 G722/8000
+a=rtpmap:0 PCMU/8000
+a=rtpmap:8 PCMA/8000
+a=rtpmap:13 CN/8000
+a=rtpmap:110 telephone-event/48000
+a=rtpmap:126 telephone-event/8000
+a=ssrc:{audio_ssrc} cname:{cname}
+a=ssrc:{audio_ssrc} msid:{stream} {audio_track}
+"""
+
+VIDEO_CODECS = [(96, "VP8/90000", None), (98, "VP9/90000", "profile-id=0"), (100, "VP9/90000", "profile-id=2"),
+                (102, "H264/90000", "level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f"),
+                (104, "H264/90000", "level-asymmetry-allowed=1;packetization-mode=0;profile-level-id=42001f"),
+                (106, "H264/90000", "level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42e01f"),
+                (45, "AV1/90000", None)]
+
+
+def video_section(ids: dict) -> str:
+    payload_types = []
+    lines = []
+    for pt, codec, fmtp in VIDEO_CODECS:
+        payload_types += [pt, pt + 1]
+        lines.append(f"a=rtpmap:{pt} {codec}")
+        for feedback in ("goog-remb", "transport-cc", "ccm fir", "nack", "nack pli"):
+            lines.append(f"a=rtcp-fb:{pt} {feedback}")
+        if fmtp:
+            lines.append(f"a=fmtp:{pt} {fmtp}")
+        lines.append(f"a=rtpmap:{pt + 1} rtx/90000")
+        lines.append(f"a=fmtp:{pt + 1} apt={pt}")
+    header = [
+        f"m=video 9 UDP/TLS/RTP/SAVPF {' '.join(map(str, payload_types))}",
+        "c=IN IP4 0.0.0.0",
+        "a=rtcp:9 IN IP4 0.0.0.0",
+        f"a=ice-ufrag:{ids['ufrag']}",
+        f"a=ice-pwd:{ids['pwd']}",
+        "a=ice-options:trickle",
+        f"a=fingerprint:sha-256 {ids['fingerprint']}",
+        "a=setup:actpass",
+        "a=mid:1",
+        "a=extmap:14 urn:ietf:params:rtp-hdrext:toffset",
+        "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time",
+        "a=extmap:13 urn:3gpp:video-orientation",
+        "a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01",
+        "a=extmap:5 http://www.webrtc.org/experiments/rtp-hdrext/playout-delay",
+        "a=extmap:6 http://www.webrtc.org/experiments/rtp-hdrext/video-content-type",
+        "a=extmap:7 http://www.webrtc.org/experiments/rtp-hdrext/video-timing",
+        "a=extmap:8 http://www.webrtc.org/experiments/rtp-hdrext/color-space",
+        "a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid",
+        "a=extmap:10 urn:ietf:params:rtp-hdrext:sdes:rtp-stream-id",
+        "a=extmap:11 urn:ietf:params:rtp-hdrext:sdes:repaired-rtp-stream-id",
+        "a=sendrecv",
+        f"a=msid:{ids['stream']} {ids['video_track']}",
+        "a=rtcp-mux",
+        "a=rtcp-rsize",
+    ]
+    ssrc, rtx = ids["video_ssrcs"]
+    trailer = [
+        f"a=ssrc-group:FID {ssrc} {rtx}",
+        f"a=ssrc:{ssrc} cname:{ids['cname']}",
+        f"a=ssrc:{ssrc} msid:{ids['stream']} {ids['video_track']}",
+        f"a=ssrc:{rtx} cname:{ids['cname']}",
+        f"a=ssrc:{rtx} msid:{ids['stream']} {ids['video_track']}",
+    ]
+    return "\n".join(header + lines + trailer) + "\n"
+
+
+def candidates(rng: random.Random) -> str:
+    host = f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+    public = f"203.0.113.{rng.randrange(1, 255)}"
+    lines = []
+    for index, (kind, address) in enumerate([("host", host), ("srflx", public)]):
+        port = rng.randrange(10000, 65535)
+        extra = f" raddr {host} rport {port}" if kind == "srflx" else ""
+        lines.append(f"a=candidate:{rng.getrandbits(32)} 1 udp {rng.getrandbits(31)} {address} {port} "
+                     f"typ {kind}{extra} generation 0 network-id {index + 1}")
+    return "\n".join(lines) + "\n"
+
+
+def sample_offer(rng: random.Random) -> str:
+    ids = {
+        "ufrag": secrets.token_urlsafe(3),
+        "pwd": secrets.token_urlsafe(18),
+        "fingerprint": ":".join(f"{rng.randrange(256):02X}" for _ in range(32)),
+        "stream": secrets.token_hex(18),
+        "audio_track": secrets.token_hex(18),
+        "video_track": secrets.token_hex(18),
+        "cname": secrets.token_urlsafe(12),
+        "audio_ssrc": rng.getrandbits(32),
+        "video_ssrcs": (rng.getrandbits(32), rng.getrandbits(32)),
+    }
+    session = (f"v=0\no=- {rng.getrandbits(62)} 2 IN IP4 127.0.0.1\ns=-\nt=0 0\n"
+               "a=group:BUNDLE 0 1 2\na=extmap-allow-mixed\na=msid-semantic: WMS " + ids["stream"] + "\n")
+    data = ("m=application 9 UDP/DTLS/SCTP webrtc-datachannel\nc=IN IP4 0.0.0.0\n"
+            f"a=ice-ufrag:{ids['ufrag']}\na=ice-pwd:{ids['pwd']}\na=ice-options:trickle\n"
+            f"a=fingerprint:sha-256 {ids['fingerprint']}\na=setup:actpass\na=mid:2\n"
+            "a=sctp-port:5000\na=max-message-size:262144\n")
+    sdp = session + AUDIO.format(candidates=candidates(rng), **ids) + video_section(ids) + data
+    return sdp.replace("\n", "\r\n")
+
+
+def relayed(sdp: str, sdp_compressor: SdpCompressor = None) -> bytes:
+    offer = {"type": "offer", "sdp": sdp}
+    if sdp_compressor is not None:
+        offer = sdp_compressor.relay(offer, True)
+    message = {"type": "webrtc_offer", "offer": offer, "from": secrets.token_hex(16), "room_id": "ABC123"}
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def wire_size(payload_size: int) -> int:
+    """Size of an unmasked server frame carrying `payload_size` bytes"""
+    return payload_size + (2 if payload_size < 126 else 4 if payload_size < 65536 else 10)
+
+
+def compressor_memory(window_bits: int, mem_level: int) -> int:
+    """zlib's documented deflate state size for these parameters"""
+    return (1 << (window_bits + 2)) + (1 << (mem_level + 9))
+
+
+def new_extension(window_bits: int, mem_level: int, level: int, min_size: int) -> PerMessageDeflate:
+    extension = PerMessageDeflate(False, False, 15, window_bits, {"level": level, "memLevel": mem_level})
+    return ThresholdPerMessageDeflate(extension, min_size)
+
+
+def run(offers, window_bits, mem_level, level, app_level):
+    """Average (first offer bytes, renegotiation bytes, CPU seconds per offer)"""
+    sdp_compressor = SdpCompressor(min_size=0) if app_level else None
+    first = again = 0
+    start = time.process_time()
+    for offer, renegotiation in offers:
+        payloads = [relayed(offer, sdp_compressor), relayed(renegotiation, sdp_compressor)]
+        if window_bits:
+            extension = new_extension(window_bits, mem_level, level, 0)
+            payloads = [extension.encode(Frame(Opcode.TEXT, payload)).data for payload in payloads]
+        first += wire_size(len(payloads[0]))
+        again += wire_size(len(payloads[1]))
+    cpu = (time.process_time() - start) / (2 * len(offers))
+    return first / len(offers), again / len(offers), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers", type=int, default=2000)
+    parser.add_argument("--window-bits", default="9,10,12,15")
+    parser.add_argument("--mem-level", type=int, default=5)
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    offers = [(sdp_offer, sdp_offer.replace("a=setup:actpass", "a=setup:active", 1).replace(" 2 IN IP4", " 3 IN IP4", 1))
+              for sdp_offer in (sample_offer(rng) for _ in range(args.offers))]
+    assert decompress_sdp(SdpCompressor(0).relay({"sdp": offers[0][0]}, True)["sdp_deflate"]) == offers[0][0]
+
+    print(f"average SDP {sum(len(offer) for offer, _ in offers) / len(offers):.0f} bytes, "
+          f"{args.offers} offers, level {args.level}, memLevel {args.mem_level}")
+    print(f"{'setting':<28} {'first offer B':>14} {'renegotiation B':>16} {'cpu us/offer':>13} {'KiB/conn':>9}")
+    settings = [("uncompressed", 0, False)]
+    settings += [(f"deflate wbits={bits}", bits, False) for bits in map(int, args.window_bits.split(","))]
+    settings += [("sdp_deflate", 0, True)]
+    settings += [(f"sdp_deflate + wbits={bits}", bits, True) for bits in map(int, args.window_bits.split(","))]
+    for name, window_bits, app_level in settings:
+        first, again, cpu = run(offers, window_bits, args.mem_level, args.level, app_level)
+        memory = compressor_memory(window_bits, args.mem_level) / 1024 if window_bits else 0
+        print(f"{name:<28} {first:>14.0f} {again:>16.0f} {cpu * 1e6:>13.1f} {memory:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Joins/sec and broadcast latency with the server sharded across workers.
+
+For each worker count, starts `backend/server.py --workers N`, then drives
+it from several client processes: every room is created over REST, filled
+with clients that connect to the shared port (following room_redirect to
+the owning worker) and then exchanges chat broadcasts. Reports joins/sec
+and the time from sending a chat message until every member has it.
+
+    python benchmarks/bench_workers.py [--workers 1,2,4,8] [--rooms 200]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import websockets
+
+SERVER = Path(__file__).resolve().parent.parent / "backend" / "server.py"
+
+
+def wait_ready(port: int, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not become ready")
+
+
+def create_room(port: int, size: int) -> str:
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/api/rooms",
+        data=json.dumps({"max_participants": size}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    return json.loads(urllib.request.urlopen(request).read())["room_id"]
+
+
+async def recv_type(ws, msg_type: str):
+    while True:
+        message = json.loads(await ws.recv())
+        if message["type"] == msg_type:
+            return message
+
+
+async def join(port: int, client_id: str, room_id: str):
+    ws = await websockets.connect(f"ws://127.0.0.1:{port}/ws/{client_id}?codec=json")
+    join_message = json.dumps({"type": "join_room", "room_id": room_id, "username": client_id})
+    await ws.send(join_message)
+    while True:
+        message = json.loads(await ws.recv())
+        if message["type"] == "room_redirect":
+            await ws.close()
+            ws = await websockets.connect(message["url"])
+            await ws.send(join_message)
+        elif message["type"] == "room_joined":
+            return ws
+        elif message["type"] == "error":
+            raise RuntimeError(message["message"])
+
+
+async def drive_room(port: int, room_id: str, size: int, messages: int, latencies: list):
+    members = []
+    for i in range(size):
+        members.append(await join(port, f"{room_id}_{i}", room_id))
+    # Let the join broadcasts settle before timing chat fan-out
+    await asyncio.sleep(0.5)
+    for ws in members:
+        while True:
+            try:
+                await asyncio.wait_for(ws.recv(), timeout=0.05)
+            except asyncio.TimeoutError:
+                break
+    for n in range(messages):
+        text = f"bench-{n}"
+        start = time.perf_counter()
+        await members[0].send(json.dumps({"type": "chat_message", "room_id": room_id, "message": text}))
+        for ws in members:
+            while (await recv_type(ws, "chat_message"))["message"] != text:
+                pass
+        latencies.append(time.perf_counter() - start)
+    for ws in members:
+        await ws.close()
+
+
+def driver(port: int, rooms: int, size: int, messages: int, concurrency: int, queue):
+    async def run():
+        room_ids = [create_room(port, size) for _ in range(rooms)]
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(room_id):
+            async with semaphore:
+                await drive_room(port, room_id, size, messages, latencies)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(room_id) for room_id in room_ids))
+        return time.perf_counter() - start, latencies
+
+    elapsed, latencies = asyncio.run(run())
+    queue.put((rooms * size, elapsed, latencies))
+
+
+def bench(workers: int, port: int, args) -> dict:
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    server = subprocess.Popen(
+        [sys.executable, str(SERVER), "--workers", str(workers), "--port", str(port), "--host", "127.0.0.1"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(port)
+        queue = multiprocessing.Queue()
+        per_driver = max(1, args.rooms // args.drivers)
+        drivers = [
+            multiprocessing.Process(target=driver, args=(port, per_driver, args.size, args.messages, args.concurrency, queue))
+            for _ in range(args.drivers)
+        ]
+        for process in drivers:
+            process.start()
+        results = [queue.get() for _ in drivers]
+        for process in drivers:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    joins = sum(r[0] for r in results)
+    elapsed = max(r[1] for r in results)
+    latencies = sorted(l for r in results for l in r[2])
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "workers": workers,
+        "joins": joins,
+        "joins_per_sec": joins / elapsed,
+        "broadcast_p50_ms": quantiles[49] * 1000,
+        "broadcast_p99_ms": quantiles[98] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--size", type=int, default=4, help="clients per room")
+    parser.add_argument("--messages", type=int, default=5, help="chat broadcasts per room")
+    parser.add_argument("--drivers", type=int, default=4, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=25, help="rooms in flight per client process")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'workers':>8} {'joins':>7} {'joins/s':>9} {'bcast p50 ms':>13} {'bcast p99 ms':>13}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        result = bench(workers, args.port, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['workers']:>8} {result['joins']:>7} {result['joins_per_sec']:>9.1f} "
+                  f"{result['broadcast_p50_ms']:>13.2f} {result['broadcast_p99_ms']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
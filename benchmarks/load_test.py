@@ -0,0 +1,266 @@
+"""Load generator built on the flows exercised by test_api.py.
+
+Simulated clients arrive at a configurable rate and each goes through the
+same steps as WebRTCCollabAPITester: connect to /ws/{client_id}, send
+join_room and wait for room_joined (following room_redirect in
+multi-worker mode), then for a while send a mix of chat messages,
+offer/answer exchanges with a random room peer and ICE candidates. Every
+client answers offers it receives, as the second peer in
+test_webrtc_signaling does. Rooms are filled up to --room-size in arrival
+order, and each client process owns whole rooms so broadcast latency is
+measured on one clock.
+
+Reports joins/sec, time from connecting to room_joined, offer->answer
+round trip and chat broadcast latency (p50/p99/p999) as one JSON object.
+
+    python benchmarks/load_test.py --clients 2000 --arrival-rate 200 \\
+        --room-size 5 --hold 20 --mix chat=0.5,offer=0.2,ice=0.3
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import time
+import urllib.request
+from typing import Dict, List, Optional, Set
+
+import websockets
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        action, _, weight = entry.partition("=")
+        if action not in ("chat", "offer", "ice"):
+            raise ValueError(f"Unknown action in --mix: {action}")
+        mix[action] = float(weight)
+    return mix
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p99/p999/max in milliseconds (nearest rank)"""
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "p999": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] * 1000
+
+    return {"count": len(ordered), "p50": rank(0.5), "p99": rank(0.99), "p999": rank(0.999), "max": ordered[-1] * 1000}
+
+
+class Results:
+    def __init__(self):
+        self.joins = 0
+        self.join_times: List[float] = []
+        self.offer_answer: List[float] = []
+        self.broadcast: List[float] = []
+        self.sent = {"chat": 0, "offer": 0, "ice": 0}
+        self.errors: Dict[str, int] = {}
+        self.first_arrival: Optional[float] = None
+        self.last_join: Optional[float] = None
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class LoadClient:
+    def __init__(self, args, results: Results, client_id: str, room_id: str):
+        self.args = args
+        self.results = results
+        self.client_id = client_id
+        self.room_id = room_id
+        self.ws = None
+        self.peers: Set[str] = set()
+        self.pending_answers: Dict[str, float] = {}
+        self.seq = 0
+
+    async def connect_and_join(self):
+        """connect_websocket + join_room, timed from connecting to room_joined"""
+        start = time.perf_counter()
+        self.ws = await websockets.connect(f"{self.args.ws_url}/{self.client_id}?codec=json")
+        join = json.dumps({"type": "join_room", "room_id": self.room_id, "username": f"Load_{self.client_id[:8]}"})
+        await self.ws.send(join)
+        while True:
+            data = json.loads(await asyncio.wait_for(self.ws.recv(), timeout=self.args.timeout))
+            if data["type"] == "room_redirect":
+                await self.ws.close()
+                self.ws = await websockets.connect(data["url"])
+                await self.ws.send(join)
+            elif data["type"] == "room_joined":
+                self.peers = set(data["participants"]) - {self.client_id}
+                now = time.perf_counter()
+                self.results.join_times.append(now - start)
+                self.results.joins += 1
+                self.results.last_join = now
+                return
+            elif data["type"] == "error":
+                raise RuntimeError(data["message"])
+
+    async def read(self):
+        async for raw in self.ws:
+            data = json.loads(raw)
+            msg_type = data["type"]
+            now = time.perf_counter()
+            if msg_type == "chat_message":
+                text = data["message"]
+                if text.startswith("load|"):
+                    self.results.broadcast.append(now - float(text.split("|")[1]))
+            elif msg_type == "webrtc_offer":
+                # Answer like the receiving peer in test_webrtc_signaling
+                await self.ws.send(json.dumps({
+                    "type": "webrtc_answer",
+                    "target": data["from"],
+                    "answer": {"type": "answer", "sdp": data["offer"]["sdp"]},
+                    "room_id": self.room_id
+                }))
+            elif msg_type == "webrtc_answer":
+                sent_at = self.pending_answers.pop(data["answer"]["sdp"], None)
+                if sent_at is not None:
+                    self.results.offer_answer.append(now - sent_at)
+            elif msg_type == "participant_joined":
+                self.peers.add(data["client_id"])
+                self.peers.discard(self.client_id)
+            elif msg_type == "participant_left":
+                self.peers.discard(data["client_id"])
+            elif msg_type == "error":
+                self.results.error(data.get("message", "error"))
+
+    async def act(self, action: str):
+        self.seq += 1
+        if action == "chat":
+            message = {"type": "chat_message", "room_id": self.room_id, "message": f"load|{time.perf_counter()!r}|{self.seq}"}
+        elif not self.peers:
+            return
+        elif action == "offer":
+            token = f"load-offer-{self.client_id}-{self.seq}"
+            self.pending_answers[token] = time.perf_counter()
+            message = {"type": "webrtc_offer", "target": random.choice(tuple(self.peers)),
+                       "offer": {"type": "offer", "sdp": token}, "room_id": self.room_id}
+        else:
+            message = {"type": "webrtc_ice_candidate", "target": random.choice(tuple(self.peers)),
+                       "candidate": {"candidate": f"load_candidate_{self.seq}", "sdpMid": "0", "sdpMLineIndex": 0},
+                       "room_id": self.room_id}
+        await self.ws.send(json.dumps(message))
+        self.results.sent[action] += 1
+
+    async def run(self, mix: Dict[str, float]):
+        try:
+            await self.connect_and_join()
+        except Exception as e:
+            self.results.error(f"join: {e}")
+            if self.ws is not None:
+                await self.ws.close()
+            return
+        reader = asyncio.create_task(self.read())
+        actions, weights = list(mix), list(mix.values())
+        deadline = time.perf_counter() + self.args.hold
+        try:
+            while True:
+                delay = random.expovariate(self.args.action_rate) if self.args.action_rate > 0 else self.args.hold
+                if time.perf_counter() + delay >= deadline:
+                    break
+                await asyncio.sleep(delay)
+                await self.act(random.choices(actions, weights)[0])
+            await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+            # Give in-flight answers and broadcasts a moment to arrive
+            await asyncio.sleep(self.args.drain)
+        except websockets.ConnectionClosed:
+            self.results.error("connection closed")
+        finally:
+            reader.cancel()
+            await self.ws.close()
+        for _ in self.pending_answers:
+            self.results.error("unanswered offer")
+
+
+def create_room(api_url: str, size: int) -> str:
+    request = urllib.request.Request(
+        f"{api_url}/rooms",
+        data=json.dumps({"max_participants": size}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    return json.loads(urllib.request.urlopen(request).read())["room_id"]
+
+
+async def drive(args, clients: int, process_index: int) -> Results:
+    results = Results()
+    mix = parse_mix(args.mix)
+    loop = asyncio.get_running_loop()
+    rooms = math.ceil(clients / args.room_size)
+    room_ids = await asyncio.gather(*(loop.run_in_executor(None, create_room, args.api_url, args.room_size) for _ in range(rooms)))
+    # Arrivals are split evenly across processes, so each runs at its share of the rate
+    rate = args.arrival_rate / args.processes
+    tasks = []
+    results.first_arrival = time.perf_counter()
+    for i in range(clients):
+        client = LoadClient(args, results, f"load{process_index}_{i}_{random.getrandbits(24):06x}", room_ids[i // args.room_size])
+        tasks.append(asyncio.create_task(client.run(mix)))
+        if rate > 0:
+            await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def worker(args, clients: int, process_index: int, queue):
+    results = asyncio.run(drive(args, clients, process_index))
+    queue.put(vars(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api-url", default="http://localhost:8001/api")
+    parser.add_argument("--ws-url", default="ws://localhost:8001/ws")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--arrival-rate", type=float, default=100.0, help="new clients per second in total; 0 = all at once")
+    parser.add_argument("--room-size", type=int, default=5)
+    parser.add_argument("--hold", type=float, default=10.0, help="seconds each client stays after joining")
+    parser.add_argument("--action-rate", type=float, default=1.0, help="actions per client per second")
+    parser.add_argument("--mix", default="chat=0.5,offer=0.2,ice=0.3", help="relative weights of chat, offer and ice")
+    parser.add_argument("--processes", type=int, default=1, help="client processes; each owns whole rooms")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for room_joined")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to keep reading after the last action")
+    parser.add_argument("--output", help="write the JSON results here as well as to stdout")
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    # Whole rooms per process, so every member of a room shares one clock
+    rooms = math.ceil(args.clients / args.room_size)
+    shares = [(rooms // args.processes + (i < rooms % args.processes)) * args.room_size for i in range(args.processes)]
+    shares[-1] -= sum(shares) - args.clients
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(args, share, i, queue)) for i, share in enumerate(shares) if share > 0]
+    for process in processes:
+        process.start()
+    parts = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    joins = sum(part["joins"] for part in parts)
+    join_window = max((part["last_join"] or 0) - part["first_arrival"] for part in parts)
+    errors: Dict[str, int] = {}
+    for part in parts:
+        for kind, count in part["errors"].items():
+            errors[kind] = errors.get(kind, 0) + count
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "clients": args.clients,
+        "joins": joins,
+        "joins_per_sec": joins / join_window if join_window > 0 else None,
+        "time_to_room_joined_ms": percentiles([t for part in parts for t in part["join_times"]]),
+        "offer_answer_ms": percentiles([t for part in parts for t in part["offer_answer"]]),
+        "broadcast_ms": percentiles([t for part in parts for t in part["broadcast"]]),
+        "sent": {action: sum(part["sent"][action] for part in parts) for action in ("chat", "offer", "ice")},
+        "errors": errors,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,46 @@
 // WebSocket message types
 export type WebSocketMessage =
+  | SessionMessage
+  | PingMessage
+  | OverloadedMessage
   | RoomJoinedMessage
   | ParticipantJoinedMessage
   | ParticipantLeftMessage
+  | RosterDeltaMessage
+  | RosterSnapshotMessage
+  | MeshPlanMessage
   | WebRTCOfferMessage
   | WebRTCAnswerMessage
   | WebRTCIceCandidateMessage
+  | WebRTCIceCandidatesMessage
   | ChatMessage
+  | ChatHistoryMessage
+  | RoomRedirectMessage
   | ErrorMessage;
 
+export interface OverloadedMessage {
+  type: 'overloaded';
+  reason: string;
+  retry_after: number;
+}
+export interface PingMessage {
+  type: 'ping';
+  ts: number;
+}
+export interface SessionMessage {
+  type: 'session';
+  resume_token: string;
+  resume_grace: number;
+  resumed: boolean;
+  rooms: string[];
+}
 export interface RoomJoinedMessage {
   type: 'room_joined';
   room_id: string;
   participants: string[];
   username: string;
+  version?: number;
+  chat_seq?: number;
 }
 export interface ParticipantJoinedMessage {
   type: 'participant_joined';
@@ -25,6 +52,29 @@ export interface ParticipantLeftMessage {
   type: 'participant_left';
   client_id: string;
 }
+export interface RosterDeltaMessage {
+  type: 'roster_delta';
+  room_id: string;
+  op: 'add' | 'remove';
+  client_id: string;
+  username?: string;
+  version: number;
+  base_version: number;
+}
+export interface RosterSnapshotMessage {
+  type: 'roster_snapshot';
+  room_id: string;
+  participants: string[];
+  version: number;
+}
+// Our part of the server's negotiation plan: we offer to offer_to and are
+// the polite peer towards await_from
+export interface MeshPlanMessage {
+  type: 'mesh_plan';
+  room_id: string;
+  offer_to: string[];
+  await_from: string[];
+}
 export interface WebRTCOfferMessage {
   type: 'webrtc_offer';
   from: string;
@@ -43,12 +93,30 @@ export interface WebRTCIceCandidateMessage {
   candidate: RTCIceCandidateInit;
   room_id: string;
 }
+export interface WebRTCIceCandidatesMessage {
+  type: 'webrtc_ice_candidates';
+  from: string;
+  candidates: (RTCIceCandidateInit | null)[];
+  room_id: string;
+}
 export interface ChatMessage {
   type: 'chat_message';
   room_id: string;
   message: string;
   username: string;
   from?: string;
+  seq?: number;
+}
+export interface ChatHistoryMessage {
+  type: 'chat_history';
+  room_id: string;
+  messages: ChatMessage[];
+  truncated: boolean;
+}
+export interface RoomRedirectMessage {
+  type: 'room_redirect';
+  room_id: string;
+  url: string;
 }
 export interface ErrorMessage {
   type: 'error';
@@ -64,6 +132,15 @@ export interface LeaveRoomMessage {
   type: 'leave_room';
   room_id: string;
 }
+export interface RosterSyncMessage {
+  type: 'roster_sync';
+  room_id: string;
+}
+export interface ChatHistoryRequestMessage {
+  type: 'chat_history';
+  room_id: string;
+  after_seq: number;
+}
 
 export interface SendWebRTCOfferMessage {
   type: 'webrtc_offer';
@@ -4,6 +4,8 @@ import type {
   ChatMessage,
   JoinRoomMessage,
   LeaveRoomMessage,
+  RosterSyncMessage,
+  ChatHistoryRequestMessage,
   SendWebRTCOfferMessage,
   SendWebRTCAnswerMessage,
   SendWebRTCIceCandidateMessage
@@ -17,6 +19,9 @@ const ICE_SERVERS: RTCConfiguration = {
     { urls: 'stun:stun2.l.google.com:19302' }
   ]
 };
+// How long to wait for the server's mesh_plan about a new peer before
+// applying the same rule ourselves: the lower client ID offers
+const MESH_PLAN_FALLBACK_MS = 2000;
 
 interface UseWebRTCResult {
   isInRoom: boolean;
@@ -64,38 +69,77 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
   const localStreamRef = useRef<MediaStream | null>(null);
   const peerConnectionsRef = useRef<{ [key: string]: RTCPeerConnection }>({});
   const websocketRef = useRef<WebSocket | null>(null);
+  const usernameRef = useRef<string>('');
+  // Version of the roster we hold; null until room_joined delivers a snapshot
+  const rosterVersionRef = useRef<number | null>(null);
+  // Token from the server's last `session` message, for resuming after a drop
+  const resumeTokenRef = useRef<string | null>(null);
+  // False once the hook unmounts, so a late close or timer does not reconnect
+  const mountedRef = useRef<boolean>(true);
+  // Peers the server's mesh plan has us offer to, and peers we are the
+  // polite side with (we wait for their offer)
+  const offerTargetsRef = useRef<Set<string>>(new Set());
+  const politePeersRef = useRef<Set<string>>(new Set());
 
   // Generate unique client ID
   const generateClientId = () => {
     return 'client_' + Math.random().toString(36).substr(2, 9);
   };
 
-  // WebSocket connection
-  useEffect(() => {
-    const newClientId = generateClientId();
-    setClientId(newClientId);
-    clientIdRef.current = newClientId;
-    const wsUrl = BACKEND_URL.replace('http', 'ws') + `/ws/${newClientId}`;
+  // Open the signaling socket; onOpen runs once it is ready
+  const openWebSocket = (wsUrl: string, onOpen?: () => void) => {
     const newWebSocket = new WebSocket(wsUrl);
 
     newWebSocket.onopen = () => {
       setError('');
+      onOpen?.();
     };
     newWebSocket.onmessage = (event) => {
       const data: WebSocketMessage = JSON.parse(event.data);
       handleWebSocketMessage(data);
     };
-    newWebSocket.onclose = () => {
-      setError('Connection lost. Please refresh the page.');
+    newWebSocket.onclose = (event) => {
+      if (websocketRef.current === newWebSocket && mountedRef.current) {
+        const token = resumeTokenRef.current;
+        // A 1000 close is final on the server too, so only a drop is resumed
+        if (token && event.code !== 1000) {
+          // Reconnect within the server's grace period to keep our rooms and peers
+          resumeTokenRef.current = null;
+          const resumeUrl = new URL(newWebSocket.url);
+          resumeUrl.searchParams.set('resume', token);
+          setTimeout(() => {
+            if (mountedRef.current) {
+              openWebSocket(resumeUrl.toString());
+            }
+          }, 1000);
+          return;
+        }
+        setError('Connection lost. Please refresh the page.');
+      }
     };
     newWebSocket.onerror = () => {
-      setError('Connection failed. Please refresh the page.');
+      if (websocketRef.current === newWebSocket && !resumeTokenRef.current) {
+        setError('Connection failed. Please refresh the page.');
+      }
     };
     setWebsocket(newWebSocket);
     websocketRef.current = newWebSocket;
+    return newWebSocket;
+  };
+
+  // WebSocket connection
+  useEffect(() => {
+    mountedRef.current = true;
+    const newClientId = generateClientId();
+    setClientId(newClientId);
+    clientIdRef.current = newClientId;
+    openWebSocket(BACKEND_URL.replace('http', 'ws') + `/ws/${newClientId}?caps=ice_batch,roster_delta,resume,mesh_plan,heartbeat`);
     return () => {
-      if (newWebSocket.readyState === WebSocket.OPEN) {
-        newWebSocket.close();
+      mountedRef.current = false;
+      resumeTokenRef.current = null;
+      const current = websocketRef.current;
+      if (current && current.readyState === WebSocket.OPEN) {
+        current.close(1000);
       }
     };
     // eslint-disable-next-line
@@ -105,33 +149,78 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
   const handleWebSocketMessage = (data: WebSocketMessage) => {
     console.log('Received WebSocket message:', data);
     switch (data.type) {
+      case 'session':
+        resumeTokenRef.current = data.resume_token;
+        if (!data.resumed && new URL(websocketRef.current?.url ?? BACKEND_URL).searchParams.has('resume')) {
+          setError('Connection lost. Please refresh the page.');
+        }
+        break;
+      case 'overloaded':
+        setError(`Server is busy, please try again in ${data.retry_after} seconds.`);
+        break;
+      case 'ping':
+        // Heartbeat; a client that stays silent is dropped by the server
+        sendWebSocketMessage({ type: 'pong' });
+        break;
       case 'room_joined':
         setIsInRoom(true);
         setParticipants(data.participants);
-      
-        // 👇 Create PeerConnections for each existing participant
-        data.participants.forEach((participantId: string) => {
-          if (participantId !== clientIdRef.current) {
-            createPeerConnection(participantId);
-          }
-        });
-      
+        rosterVersionRef.current = data.version ?? null;
+        // Catch up on the chat that happened before we arrived
+        if (data.chat_seq) {
+          sendWebSocketMessage({ type: 'chat_history', room_id: data.room_id, after_seq: 0 } as ChatHistoryRequestMessage);
+        }
+        // Peer connections are opened as the mesh_plan that follows says
         break;       
       case 'participant_joined':
         console.log('Participant joined:', data);
         setParticipants(data.participants);
-        // Only create peer connection if the participant is not self
-        if (data.client_id !== clientIdRef.current) {
-          createPeerConnection(data.client_id);
-        }
+        expectPlan(data.client_id);
+        break;
+      case 'mesh_plan':
+        // Offer to the peers we are told to; the others will offer to us
+        data.offer_to.forEach((participantId: string) => {
+          offerTargetsRef.current.add(participantId);
+          if (!peerConnectionsRef.current[participantId]) {
+            createPeerConnection(participantId);
+          }
+        });
+        data.await_from.forEach((participantId: string) => politePeersRef.current.add(participantId));
         break;
       case 'participant_left':
         console.log('Participant left:', data);
-        setParticipants(prev => prev.filter(p => p !== data.client_id));
-        if (peerConnectionsRef.current[data.client_id]) {
-          peerConnectionsRef.current[data.client_id].close();
-          delete peerConnectionsRef.current[data.client_id];
+        removeParticipant(data.client_id);
+        break;
+      case 'roster_delta':
+        // Ignore deltas until we have a snapshot, and ones it already covers
+        if (rosterVersionRef.current === null || data.version <= rosterVersionRef.current) {
+          break;
         }
+        if (data.base_version !== rosterVersionRef.current) {
+          sendWebSocketMessage({ type: 'roster_sync', room_id: data.room_id } as RosterSyncMessage);
+          break;
+        }
+        rosterVersionRef.current = data.version;
+        if (data.op === 'add') {
+          setParticipants(prev => (prev.includes(data.client_id) ? prev : [...prev, data.client_id]));
+          expectPlan(data.client_id);
+        } else {
+          removeParticipant(data.client_id);
+        }
+        break;
+      case 'roster_snapshot':
+        rosterVersionRef.current = data.version;
+        setParticipants(data.participants);
+        data.participants.forEach((participantId: string) => {
+          if (offerTargetsRef.current.has(participantId) && !peerConnectionsRef.current[participantId]) {
+            createPeerConnection(participantId);
+          }
+        });
+        Object.keys(peerConnectionsRef.current).forEach(participantId => {
+          if (!data.participants.includes(participantId)) {
+            removeParticipant(participantId);
+          }
+        });
         break;
       case 'webrtc_offer':
         handleWebRTCOffer(data);
@@ -142,9 +231,32 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
       case 'webrtc_ice_candidate':
         handleICECandidate(data);
         break;
+      case 'webrtc_ice_candidates':
+        handleICECandidates(data);
+        break;
       case 'chat_message':
         setMessages(prev => [...prev, data]);
         break;
+      case 'chat_history':
+        // Older than anything received live; skip messages we already have
+        setMessages(prev => {
+          const seen = new Set(prev.map(message => message.seq));
+          return [...data.messages.filter(message => !seen.has(message.seq)), ...prev];
+        });
+        break;
+      case 'room_redirect': {
+        // The room lives on another server worker; reconnect there and join again
+        const previous = websocketRef.current;
+        openWebSocket(data.url, () => {
+          sendWebSocketMessage({
+            type: 'join_room',
+            room_id: data.room_id,
+            username: usernameRef.current,
+          } as JoinRoomMessage);
+        });
+        previous?.close(1000);
+        break;
+      }
       case 'error':
         alert(data.message)
         console.error('Server error:', data.message);
@@ -156,6 +268,36 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
     }
   };
 
+  // A mesh_plan may not come, e.g. from a server node that does not know
+  // our caps; fall back to the plan's own rule for peers it never covered
+  const expectPlan = (participantId: string) => {
+    if (participantId === clientIdRef.current) {
+      return;
+    }
+    setTimeout(() => {
+      if (!mountedRef.current || peerConnectionsRef.current[participantId]
+          || offerTargetsRef.current.has(participantId) || politePeersRef.current.has(participantId)) {
+        return;
+      }
+      if (clientIdRef.current < participantId) {
+        offerTargetsRef.current.add(participantId);
+        createPeerConnection(participantId);
+      } else {
+        politePeersRef.current.add(participantId);
+      }
+    }, MESH_PLAN_FALLBACK_MS);
+  };
+
+  const removeParticipant = (participantId: string) => {
+    setParticipants(prev => prev.filter(p => p !== participantId));
+    offerTargetsRef.current.delete(participantId);
+    politePeersRef.current.delete(participantId);
+    if (peerConnectionsRef.current[participantId]) {
+      peerConnectionsRef.current[participantId].close();
+      delete peerConnectionsRef.current[participantId];
+    }
+  };
+
   // Send WebSocket message with retry
   const sendWebSocketMessage = (message: object) => {
     console.log('Attempting to send WebSocket message:', message);
@@ -184,6 +326,7 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
       setError('Please enter a username');
       return;
     }
+    usernameRef.current = username;
     if (!roomIdInput.trim()) {
       // Create room
       console.log('Creating new room...');
@@ -253,6 +396,8 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
     }
     Object.values(peerConnectionsRef.current).forEach(pc => pc.close());
     peerConnectionsRef.current = {};
+    offerTargetsRef.current.clear();
+    politePeersRef.current.clear();
     setIsScreenSharing(false);
     setIsVideoOn(false);
     setIsAudioOn(false);
@@ -388,6 +533,11 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
     } catch {}
   };
   const handleWebRTCOffer = async (data: any) => {
+    const existing = peerConnectionsRef.current[data.from];
+    // Glare: the impolite side keeps its own offer and ignores the peer's
+    if (existing && existing.signalingState === 'have-local-offer' && !politePeersRef.current.has(data.from)) {
+      return;
+    }
     try {
       const pc = new RTCPeerConnection(ICE_SERVERS);
       pc.onicecandidate = (event) => {
@@ -435,6 +585,14 @@ export function useWebRTC(localVideoRef: React.RefObject<HTMLVideoElement>): Use
       await pc.addIceCandidate(data.candidate);
     } catch {}
   };
+  const handleICECandidates = async (data: any) => {
+    const pc = peerConnectionsRef.current[data.from];
+    for (const candidate of data.candidates) {
+      try {
+        await pc.addIceCandidate(candidate);
+      } catch {}
+    }
+  };
 
   // Chat
   const sendMessage = useCallback(() => {
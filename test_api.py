@@ -1,12 +1,74 @@
 import requests
 import unittest
 import sys
+import os
 import json
+import time
 import asyncio
+import socket
+import shutil
+import subprocess
+import tempfile
+import msgpack
 import websockets
 import uuid
 from datetime import datetime
 
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_DIR, "backend"))
+
+from codec import Frame, get_codec
+from compression import compress_sdp, decompress_sdp
+from history import ChatHistory, message_size
+from journal import RoomJournal, log_name
+from outbound import DEFAULT_POLICIES, ClientConnection, DeliveryStatus, OverflowPolicy
+from state import JoinStatus, MemoryBackend, RedisBackend
+
+# A browser-like offer, long enough to be relayed compressed
+SAMPLE_SDP = "\r\n".join([
+    "v=0",
+    "o=- 4611731400430051336 2 IN IP4 127.0.0.1",
+    "s=-",
+    "t=0 0",
+    "a=group:BUNDLE 0 1",
+    "a=extmap-allow-mixed",
+    "a=msid-semantic: WMS",
+    "m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=ice-ufrag:Xq7v",
+    "a=ice-pwd:0nB2aYcM3S5fJq8kTz1wEp4R",
+    "a=ice-options:trickle",
+    "a=fingerprint:sha-256 3A:91:0C:55:7E:AB:12:F4:60:2D:C8:19:E7:73:4B:AA:05:DE:36:81:9F:C2:58:0B:6A:14:E2:7D:93:CB:40:1F",
+    "a=setup:actpass",
+    "a=mid:0",
+    "a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level",
+    "a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid",
+    "a=sendrecv",
+    "a=rtcp-mux",
+    "a=rtpmap:111 opus/48000/2",
+    "a=rtcp-fb:111 transport-cc",
+    "a=fmtp:111 minptime=10;useinbandfec=1",
+    "m=application 9 UDP/DTLS/SCTP webrtc-datachannel",
+    "c=IN IP4 0.0.0.0",
+    "a=ice-ufrag:Xq7v",
+    "a=ice-pwd:0nB2aYcM3S5fJq8kTz1wEp4R",
+    "a=mid:1",
+    "a=sctp-port:5000",
+    "a=max-message-size:262144",
+    "",
+])
+
+class StalledWebSocket:
+    """Stands in for the websocket of a client that stopped reading: sends never complete"""
+    client = None
+    
+    async def send_text(self, data):
+        await asyncio.Event().wait()
+    
+    async def close(self, code=1000):
+        pass
+
 class WebRTCCollabAPITester:
     def __init__(self, base_url="http://localhost:8001/api", ws_url="ws://localhost:8001/ws"):
         self.base_url = base_url
@@ -92,6 +154,31 @@ class WebRTCCollabAPITester:
             200
         )
 
+    def test_room_etag(self, room_id=None):
+        """Test that an unchanged room is answered with 304 Not Modified"""
+        if room_id is None:
+            room_id = self.created_room_id
+        
+        self.tests_run += 1
+        print(f"\n🔍 Testing Conditional Room Get...")
+        
+        try:
+            url = f"{self.base_url}/rooms/{room_id}"
+            etag = requests.get(url).headers.get("ETag")
+            if not etag:
+                print(f"❌ Failed - No ETag on room response")
+                return False
+            response = requests.get(url, headers={"If-None-Match": etag})
+            if response.status_code == 304:
+                self.tests_passed += 1
+                print(f"✅ Passed - Status: 304 for ETag {etag}")
+                return True
+            print(f"❌ Failed - Expected 304, got {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_list_rooms(self):
         """Test listing all rooms"""
         return self.run_test(
@@ -101,6 +188,116 @@ class WebRTCCollabAPITester:
             200
         )
 
+    def test_list_rooms_pages(self, page_size=2):
+        """Test that following next_cursor lists every room exactly once"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Paged Room Listing...")
+        
+        try:
+            url = f"{self.base_url}/rooms"
+            created = [requests.post(url, json={"max_participants": 2}).json()["room_id"] for _ in range(5)]
+            listed, cursor, pages = [], None, 0
+            while True:
+                params = {"limit": page_size}
+                if cursor:
+                    params["cursor"] = cursor
+                page = requests.get(url, params=params).json()
+                pages += 1
+                if len(page["rooms"]) > page_size:
+                    print(f"❌ Page of {len(page['rooms'])} rooms exceeds limit {page_size}")
+                    return False
+                listed += page["rooms"]
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            if len(listed) != len(set(listed)) or not set(created) <= set(listed):
+                print(f"❌ Pages listed {listed}, expected each of {created} once")
+                return False
+            print(f"✅ {len(listed)} rooms listed once each over {pages} pages")
+            
+            response = requests.get(url, params={"cursor": "not-a-cursor"})
+            if response.status_code == 400:
+                self.tests_passed += 1
+                print(f"✅ Invalid cursor rejected with 400")
+                return True
+            print(f"❌ Expected 400 for an invalid cursor, got {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_stats(self, reclaimed_above=None):
+        """Test the server stats endpoint, optionally that rooms were reclaimed since an earlier count"""
+        success, response = self.run_test(
+            "Server Stats",
+            "GET",
+            "stats",
+            200
+        )
+        if not success:
+            return success, response
+        reclaimed = response.get('rooms_reclaimed')
+        if not isinstance(reclaimed, int) or not 0 <= reclaimed <= response.get('rooms_created', 0):
+            print(f"❌ Stats response has no valid rooms_reclaimed count: {response}")
+            self.tests_passed -= 1
+            return False, response
+        if reclaimed_above is not None and reclaimed <= reclaimed_above:
+            print(f"❌ rooms_reclaimed stayed at {reclaimed} after rooms were emptied")
+            self.tests_passed -= 1
+            return False, response
+        print(f"rooms_reclaimed: {reclaimed}")
+        return success, response
+
+    def test_metrics(self):
+        """Test the Prometheus exposition on /metrics"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Metrics Exposition...")
+        
+        try:
+            response = requests.get(f"{self.base_url.rsplit('/api', 1)[0]}/metrics")
+            content_type = response.headers.get("Content-Type", "")
+            if response.status_code != 200 or not content_type.startswith("text/plain; version=0.0.4"):
+                print(f"❌ Failed - Status {response.status_code}, Content-Type {content_type}")
+                return False
+            types, samples = {}, {}
+            for line in response.text.splitlines():
+                if line.startswith("# TYPE "):
+                    _, _, name, kind = line.split(" ")
+                    types[name] = kind
+                elif line and not line.startswith("#"):
+                    name, value = line.rsplit(" ", 1)
+                    samples[name] = float(value)
+            expected = {
+                "collabshare_rooms_created_total": "counter",
+                "collabshare_http_request_seconds": "histogram",
+                "collabshare_event_loop_lag_seconds": "histogram",
+                "collabshare_admission_loop_lag_seconds": "gauge",
+            }
+            missing = {name: kind for name, kind in expected.items() if types.get(name) != kind}
+            if missing:
+                print(f"❌ Missing or mistyped families: {missing}")
+                return False
+            if samples.get("collabshare_rooms_created_total", 0) < 1:
+                print(f"❌ Room creations not counted")
+                return False
+            for histogram in ("collabshare_http_request_seconds", "collabshare_event_loop_lag_seconds"):
+                present = {suffix for suffix in ("_bucket", "_sum", "_count")
+                           if any(name.startswith(histogram + suffix) for name in samples)}
+                infinite = any(name.startswith(histogram + "_bucket") and 'le="+Inf"' in name for name in samples)
+                if len(present) < 3 or not infinite:
+                    print(f"❌ Histogram {histogram} lacks _bucket/_sum/_count samples")
+                    return False
+            lag_count = samples.get("collabshare_event_loop_lag_seconds_count", 0)
+            if samples.get('collabshare_event_loop_lag_seconds_bucket{le="+Inf"}') != lag_count or lag_count < 1:
+                print(f"❌ Loop lag +Inf bucket does not match its count of {lag_count}")
+                return False
+            self.tests_passed += 1
+            print(f"✅ Passed - {len(types)} families, {lag_count:.0f} loop lag probes")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_nonexistent_room(self):
         """Test getting a nonexistent room"""
         return self.run_test(
@@ -551,6 +748,1005 @@ class WebRTCCollabAPITester:
             print(f"❌ Room cleanup test failed: {str(e)}")
             return False
 
+    @staticmethod
+    async def receive_all(websocket, timeout=0.5):
+        """Messages that arrive on `websocket` until it goes quiet for `timeout` seconds"""
+        messages = []
+        try:
+            while True:
+                messages.append(json.loads(await asyncio.wait_for(websocket.recv(), timeout=timeout)))
+        except asyncio.TimeoutError:
+            return messages
+
+    async def test_session_resume(self, room_id):
+        """Test that a dropped client resumes its session and gets what was sent while it was away"""
+        self.tests_run += 1
+        client_id = f"resume_client_{uuid.uuid4().hex[:8]}"
+        peer_id = f"resume_peer_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Session Resume for client {client_id}...")
+        
+        try:
+            url = f"{self.ws_url}/{client_id}"
+            websocket = await websockets.connect(f"{url}?caps=resume")
+            session = json.loads(await asyncio.wait_for(websocket.recv(), timeout=5))
+            if session.get("type") != "session" or not session.get("resume_token"):
+                print(f"❌ No session message with a resume token: {session}")
+                return False
+            await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(websocket)
+            peer = await websockets.connect(f"{self.ws_url}/{peer_id}")
+            self.ws_connections[peer_id] = peer
+            await peer.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(peer)
+            
+            for caps in ("resume", None):
+                # Drop the socket without a close frame, like a network loss
+                websocket.transport.abort()
+                await asyncio.sleep(0.5)
+                text = f"sent while away ({caps or 'no caps'})"
+                await peer.send(json.dumps({"type": "chat_message", "room_id": room_id, "message": text}))
+                await self.receive_all(peer)
+                query = f"resume={session['resume_token']}" + (f"&caps={caps}" if caps else "")
+                websocket = await websockets.connect(f"{url}?{query}")
+                messages = await self.receive_all(websocket)
+                if caps:
+                    session = messages[0] if messages else {}
+                    if session.get("type") != "session" or not session.get("resumed"):
+                        print(f"❌ Session not resumed: {messages}")
+                        return False
+                if not any(m.get("type") == "chat_message" and m.get("message") == text for m in messages):
+                    print(f"❌ Buffered chat message not replayed after resuming with {caps or 'no caps'}: {messages}")
+                    return False
+                print(f"✅ Resumed with {caps or 'no caps'} and got the buffered chat message")
+            
+            success, response = self.test_get_room(room_id)
+            if success and client_id in response.get('room', {}).get('participants', []):
+                self.tests_passed += 1
+                print(f"✅ {client_id} kept its room membership across resumes")
+                await websocket.close()
+                return True
+            print(f"❌ {client_id} lost its room membership: {response}")
+            return False
+        except Exception as e:
+            print(f"❌ Session resume test failed: {str(e)}")
+            return False
+
+    async def test_codec_negotiation(self, room_id):
+        """Test that a codec can be picked by subprotocol or by ?codec= and mixed in one room"""
+        self.tests_run += 1
+        binary_id = f"msgpack_client_{uuid.uuid4().hex[:8]}"
+        text_id = f"orjson_client_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Codec Negotiation...")
+        
+        try:
+            binary = await websockets.connect(f"{self.ws_url}/{binary_id}", subprotocols=["collabshare.msgpack"])
+            self.ws_connections[binary_id] = binary
+            if binary.subprotocol != "collabshare.msgpack":
+                print(f"❌ Subprotocol not echoed back: {binary.subprotocol}")
+                return False
+            await binary.send(msgpack.packb({"type": "join_room", "room_id": room_id}))
+            frames = []
+            while not frames or msgpack.unpackb(frames[-1]).get("type") != "room_joined":
+                frames.append(await asyncio.wait_for(binary.recv(), timeout=5))
+                if not isinstance(frames[-1], bytes):
+                    print(f"❌ Expected binary frames, got {frames[-1]!r}")
+                    return False
+            print(f"✅ {binary_id} joined over msgpack binary frames")
+            
+            text = await websockets.connect(f"{self.ws_url}/{text_id}?codec=orjson")
+            self.ws_connections[text_id] = text
+            await text.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(text)
+            await asyncio.sleep(0.1)
+            while True:
+                try:
+                    await asyncio.wait_for(binary.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    break
+            
+            await text.send(json.dumps({"type": "chat_message", "room_id": room_id, "message": "across codecs"}))
+            frame = msgpack.unpackb(await asyncio.wait_for(binary.recv(), timeout=5))
+            if frame.get("type") == "chat_message" and frame.get("message") == "across codecs":
+                self.tests_passed += 1
+                print(f"✅ Chat from the orjson client reached the msgpack client")
+                return True
+            print(f"❌ Expected the chat message, got {frame}")
+            return False
+        except Exception as e:
+            print(f"❌ Codec negotiation test failed: {str(e)}")
+            return False
+
+    async def test_malformed_frames(self, room_id):
+        """Test that undecodable frames get an error reply and leave the connection usable"""
+        self.tests_run += 1
+        client_id = f"malformed_client_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Malformed Frame Handling for client {client_id}...")
+        
+        try:
+            websocket = await websockets.connect(f"{self.ws_url}/{client_id}")
+            self.ws_connections[client_id] = websocket
+            for frame in ("{not json", "[1, 2, 3]"):
+                await websocket.send(frame)
+                response_data = json.loads(await asyncio.wait_for(websocket.recv(), timeout=5))
+                if response_data != {"type": "error", "message": "Malformed frame"}:
+                    print(f"❌ Expected a malformed frame error for {frame!r}, got {response_data}")
+                    return False
+                print(f"✅ {frame!r} answered with a malformed frame error")
+            
+            await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            messages = await self.receive_all(websocket)
+            if any(m.get("type") == "room_joined" for m in messages):
+                self.tests_passed += 1
+                print(f"✅ Connection still usable after malformed frames")
+                return True
+            print(f"❌ Could not join after malformed frames: {messages}")
+            return False
+        except Exception as e:
+            print(f"❌ Malformed frame test failed: {str(e)}")
+            return False
+
+    async def test_ice_batching(self, room_id):
+        """Test that trickled candidates reach a batching client deduplicated and in order"""
+        self.tests_run += 1
+        sender_id = f"ice_sender_{uuid.uuid4().hex[:8]}"
+        target_id = f"ice_target_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing ICE Candidate Batching from {sender_id} to {target_id}...")
+        
+        try:
+            sender = await websockets.connect(f"{self.ws_url}/{sender_id}")
+            target = await websockets.connect(f"{self.ws_url}/{target_id}?caps=ice_batch")
+            self.ws_connections[sender_id] = sender
+            self.ws_connections[target_id] = target
+            for websocket in (sender, target):
+                await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(sender)
+            await self.receive_all(target)
+            
+            for name in ("c1", "c2", "c2", "c3", "c1"):
+                candidate = {"candidate": name, "sdpMid": "0", "sdpMLineIndex": 0}
+                await sender.send(json.dumps({"type": "webrtc_ice_candidate", "target": target_id, "room_id": room_id, "candidate": candidate}))
+            await sender.send(json.dumps({"type": "webrtc_ice_candidate", "target": target_id, "room_id": room_id, "candidate": None}))
+            
+            messages = await self.receive_all(target)
+            if any(m.get("type") != "webrtc_ice_candidates" or m.get("from") != sender_id for m in messages):
+                print(f"❌ Expected only webrtc_ice_candidates batches from {sender_id}, got {messages}")
+                return False
+            received = [c and c["candidate"] for m in messages for c in m["candidates"]]
+            if received == ["c1", "c2", "c3", None]:
+                self.tests_passed += 1
+                print(f"✅ Received {received} in {len(messages)} batch(es)")
+                return True
+            print(f"❌ Expected ['c1', 'c2', 'c3', None], got {received}")
+            return False
+        except Exception as e:
+            print(f"❌ ICE batching test failed: {str(e)}")
+            return False
+
+    async def test_roster_deltas(self, room_id):
+        """Test that a roster_delta client follows joins and leaves and can resync on request"""
+        self.tests_run += 1
+        watcher_id = f"roster_watcher_{uuid.uuid4().hex[:8]}"
+        peer_id = f"roster_peer_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Roster Deltas for client {watcher_id}...")
+        
+        try:
+            watcher = await websockets.connect(f"{self.ws_url}/{watcher_id}?caps=roster_delta")
+            self.ws_connections[watcher_id] = watcher
+            await watcher.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            joined = [m for m in await self.receive_all(watcher) if m.get("type") == "room_joined"]
+            if not joined:
+                print(f"❌ {watcher_id} did not join room {room_id}")
+                return False
+            version = joined[0]["version"]
+            
+            peer = await websockets.connect(f"{self.ws_url}/{peer_id}")
+            await peer.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(peer)
+            await peer.close()
+            deltas = await self.receive_all(watcher)
+            expected = [("add", peer_id), ("remove", peer_id)]
+            if [(m.get("type"), m.get("op"), m.get("client_id")) for m in deltas] != [("roster_delta",) + op for op in expected]:
+                print(f"❌ Expected add and remove deltas for {peer_id}, got {deltas}")
+                return False
+            for delta in deltas:
+                if delta["base_version"] != version:
+                    print(f"❌ Delta {delta} does not follow version {version}")
+                    return False
+                version = delta["version"]
+            print(f"✅ Received chained add and remove deltas up to version {version}")
+            
+            await watcher.send(json.dumps({"type": "roster_sync", "room_id": room_id}))
+            snapshot = json.loads(await asyncio.wait_for(watcher.recv(), timeout=5))
+            if snapshot.get("type") == "roster_snapshot" and snapshot.get("participants") == [watcher_id] and snapshot.get("version") == version:
+                self.tests_passed += 1
+                print(f"✅ roster_sync answered with a snapshot at version {version}")
+                return True
+            print(f"❌ Unexpected roster_sync reply: {snapshot}")
+            return False
+        except Exception as e:
+            print(f"❌ Roster delta test failed: {str(e)}")
+            return False
+
+    async def test_chat_history(self, room_id):
+        """Test that chat_seq and chat_history let a late joiner catch up, and report truncation"""
+        self.tests_run += 1
+        sender_id = f"history_sender_{uuid.uuid4().hex[:8]}"
+        reader_id = f"history_reader_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Chat History for room {room_id}...")
+        
+        try:
+            sender = await websockets.connect(f"{self.ws_url}/{sender_id}")
+            self.ws_connections[sender_id] = sender
+            await sender.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(sender)
+            # Enough large messages to overflow the room's history budget
+            for i in range(18):
+                await sender.send(json.dumps({"type": "chat_message", "room_id": room_id, "message": f"{i:02d}" + "x" * 5000}))
+            seqs = [m.get("seq") for m in await self.receive_all(sender) if m.get("type") == "chat_message"]
+            if seqs != list(range(1, 19)):
+                print(f"❌ Expected chat seqs 1-18, got {seqs}")
+                return False
+            
+            reader = await websockets.connect(f"{self.ws_url}/{reader_id}")
+            self.ws_connections[reader_id] = reader
+            await reader.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            joined = [m for m in await self.receive_all(reader) if m.get("type") == "room_joined"]
+            if not joined or joined[0].get("chat_seq") != 18:
+                print(f"❌ Expected chat_seq 18 on joining, got {joined}")
+                return False
+            print(f"✅ Late joiner told chat_seq {joined[0]['chat_seq']}")
+            
+            await reader.send(json.dumps({"type": "chat_history", "room_id": room_id, "after_seq": 0}))
+            history = json.loads(await asyncio.wait_for(reader.recv(), timeout=5))
+            kept = [m["seq"] for m in history.get("messages", [])]
+            # The memory backend's byte budget drops the oldest messages; a
+            # backend that only bounds the count may keep them all
+            if not kept or kept != list(range(kept[0], 19)) or history.get("truncated") != (kept[0] > 1):
+                print(f"❌ Expected the tail of the history, got seqs {kept} truncated={history.get('truncated')}")
+                return False
+            print(f"✅ Full history request returned seqs {kept[0]}-{kept[-1]} truncated={history['truncated']}")
+            
+            await reader.send(json.dumps({"type": "chat_history", "room_id": room_id, "after_seq": 16}))
+            history = json.loads(await asyncio.wait_for(reader.recv(), timeout=5))
+            if [m["message"][:2] for m in history.get("messages", [])] == ["16", "17"] and history.get("truncated") is False:
+                self.tests_passed += 1
+                print(f"✅ History after seq 16 returned the last two messages untruncated")
+                return True
+            print(f"❌ Unexpected history after seq 16: {history}")
+            return False
+        except Exception as e:
+            print(f"❌ Chat history test failed: {str(e)}")
+            return False
+
+    async def test_rate_limits(self, room_id):
+        """Test that the default limits drop chat floods, delay offer bursts and evict spammers"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Inbound Rate Limits in room {room_id}...")
+        
+        async def joined_client(role):
+            client_id = f"rate_{role}_{uuid.uuid4().hex[:8]}"
+            websocket = await websockets.connect(f"{self.ws_url}/{client_id}")
+            self.ws_connections[client_id] = websocket
+            await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(websocket)
+            return websocket
+        
+        try:
+            # chat_message=5:20 drops what goes over the burst
+            flooder = await joined_client("flooder")
+            for i in range(40):
+                await flooder.send(json.dumps({"type": "chat_message", "room_id": room_id, "message": f"flood {i}"}))
+            messages = await self.receive_all(flooder)
+            delivered = sum(1 for m in messages if m.get("type") == "chat_message")
+            errors = [m.get("message") for m in messages if m.get("type") == "error"]
+            if not 20 <= delivered < 40 or "Rate limit exceeded for chat_message" not in errors:
+                print(f"❌ Expected about 20 of 40 chat messages and a rate limit error, got {delivered} and {errors}")
+                return False
+            print(f"✅ {delivered} of 40 chat messages delivered, the rest dropped")
+            
+            # webrtc_offer=5:20:throttle delays the 10 offers over the burst by about 2s
+            offerer = await joined_client("offerer")
+            started = time.perf_counter()
+            for i in range(30):
+                await offerer.send(json.dumps({"type": "webrtc_offer", "target": "nobody", "room_id": room_id,
+                                               "offer": {"type": "offer", "sdp": "x"}}))
+            await offerer.send(json.dumps({"type": "chat_history", "room_id": room_id, "after_seq": 0}))
+            messages = []
+            while not messages or messages[-1].get("type") != "chat_history":
+                messages.append(json.loads(await asyncio.wait_for(offerer.recv(), timeout=10)))
+            elapsed = time.perf_counter() - started
+            if elapsed < 1.5 or any("Rate limit" in m.get("message", "") for m in messages):
+                print(f"❌ Offers over the burst were not delayed: {elapsed:.2f}s, {messages[:-1]}")
+                return False
+            print(f"✅ 30 offers throttled rather than dropped, taking {elapsed:.2f}s")
+            
+            # Too many violations within the window closes the connection
+            spammer = await joined_client("spammer")
+            for i in range(400):
+                await spammer.send(json.dumps({"type": "chat_message", "room_id": room_id, "message": "spam"}))
+            try:
+                while True:
+                    await asyncio.wait_for(spammer.recv(), timeout=5)
+            except websockets.ConnectionClosed as e:
+                if e.rcvd is not None and e.rcvd.code == 1008:
+                    self.tests_passed += 1
+                    print(f"✅ Spammer disconnected with code 1008")
+                    return True
+                print(f"❌ Spammer closed without a policy violation code: {e}")
+                return False
+        except asyncio.TimeoutError:
+            print(f"❌ Rate limit test timed out")
+            return False
+        except Exception as e:
+            print(f"❌ Rate limit test failed: {str(e)}")
+            return False
+
+    async def test_mesh_plan(self, room_id):
+        """Test that mesh_plan clients are told who offers and off-plan offers are suppressed"""
+        self.tests_run += 1
+        suffix = uuid.uuid4().hex[:8]
+        # The ID that sorts first makes the first offer
+        low_id, high_id = f"mesh_a_{suffix}", f"mesh_b_{suffix}"
+        print(f"\n🔍 Testing Mesh Plan for {low_id} and {high_id}...")
+        
+        async def join(client_id):
+            websocket = await websockets.connect(f"{self.ws_url}/{client_id}?caps=mesh_plan")
+            self.ws_connections[client_id] = websocket
+            await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            return websocket
+        
+        def plans(messages):
+            return [(m["offer_to"], m["await_from"]) for m in messages if m.get("type") == "mesh_plan"]
+        
+        async def offer(sender, sender_id, target_id):
+            await sender.send(json.dumps({"type": "webrtc_offer", "target": target_id, "room_id": room_id,
+                                          "offer": {"type": "offer", "sdp": f"v=0 from {sender_id}"}}))
+            return await self.receive_all(sender)
+        
+        try:
+            low = await join(low_id)
+            await self.receive_all(low)
+            high = await join(high_id)
+            high_plans = plans(await self.receive_all(high))
+            low_plans = plans(await self.receive_all(low))
+            if high_plans != [([], [low_id])] or low_plans != [([high_id], [])]:
+                print(f"❌ Unexpected plans: {high_id} got {high_plans}, {low_id} got {low_plans}")
+                return False
+            print(f"✅ {low_id} told to offer to {high_id}, which waits")
+            
+            replies = await offer(high, high_id, low_id)
+            if not any(m.get("type") == "offer_suppressed" and m.get("target") == low_id for m in replies):
+                print(f"❌ Offer against the plan not suppressed: {replies}")
+                return False
+            if await self.receive_all(low):
+                print(f"❌ Suppressed offer still reached {low_id}")
+                return False
+            print(f"✅ Offer from {high_id} suppressed")
+            
+            # Once the planned negotiation is done either side may renegotiate
+            await offer(low, low_id, high_id)
+            await self.receive_all(high)
+            await high.send(json.dumps({"type": "webrtc_answer", "target": low_id, "room_id": room_id,
+                                        "answer": {"type": "answer", "sdp": "v=0"}}))
+            await self.receive_all(low)
+            await offer(high, high_id, low_id)
+            if not any(m.get("type") == "webrtc_offer" for m in await self.receive_all(low)):
+                print(f"❌ Renegotiation offer from {high_id} not relayed")
+                return False
+            print(f"✅ Renegotiation from {high_id} relayed after the first answer")
+            
+            # A rejoining offerer starts over, so the old answer no longer counts
+            await low.close()
+            await self.receive_all(high)
+            low = await join(low_id)
+            await self.receive_all(low)
+            await self.receive_all(high)
+            replies = await offer(high, high_id, low_id)
+            if any(m.get("type") == "offer_suppressed" for m in replies):
+                self.tests_passed += 1
+                print(f"✅ Offer from {high_id} suppressed again after {low_id} rejoined")
+                return True
+            print(f"❌ Offer from {high_id} slipped through after {low_id} rejoined: {replies}")
+            return False
+        except Exception as e:
+            print(f"❌ Mesh plan test failed: {str(e)}")
+            return False
+
+    async def test_sdp_deflate_relay(self, room_id):
+        """Test that offers are relayed compressed to sdp_deflate clients and plain to others"""
+        self.tests_run += 1
+        plain_id = f"sdp_plain_{uuid.uuid4().hex[:8]}"
+        deflate_id = f"sdp_deflate_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Compressed SDP Relay between {plain_id} and {deflate_id}...")
+        
+        try:
+            plain = await websockets.connect(f"{self.ws_url}/{plain_id}")
+            deflate = await websockets.connect(f"{self.ws_url}/{deflate_id}?caps=sdp_deflate")
+            self.ws_connections[plain_id] = plain
+            self.ws_connections[deflate_id] = deflate
+            for websocket in (plain, deflate):
+                await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(plain)
+            await self.receive_all(deflate)
+            
+            await plain.send(json.dumps({"type": "webrtc_offer", "target": deflate_id, "room_id": room_id,
+                                         "offer": {"type": "offer", "sdp": SAMPLE_SDP}}))
+            offer = json.loads(await asyncio.wait_for(deflate.recv(), timeout=5))["offer"]
+            if "sdp" in offer or decompress_sdp(offer.get("sdp_deflate", "")) != SAMPLE_SDP:
+                print(f"❌ Expected the offer compressed for {deflate_id}, got {offer}")
+                return False
+            print(f"✅ Plain offer relayed as sdp_deflate to {deflate_id}")
+            
+            await deflate.send(json.dumps({"type": "webrtc_offer", "target": plain_id, "room_id": room_id,
+                                           "offer": {"type": "offer", "sdp_deflate": compress_sdp(SAMPLE_SDP)}}))
+            offer = json.loads(await asyncio.wait_for(plain.recv(), timeout=5))["offer"]
+            if offer.get("sdp") != SAMPLE_SDP or "sdp_deflate" in offer:
+                print(f"❌ Expected the offer decompressed for {plain_id}, got {offer}")
+                return False
+            print(f"✅ Compressed offer relayed as plain sdp to {plain_id}")
+            
+            for data in ("not base64!", compress_sdp("a=x\r\n" * 300000)):
+                await deflate.send(json.dumps({"type": "webrtc_offer", "target": plain_id, "room_id": room_id,
+                                               "offer": {"type": "offer", "sdp_deflate": data}}))
+                reply = json.loads(await asyncio.wait_for(deflate.recv(), timeout=5))
+                if reply.get("type") != "error" or "SDP" not in reply.get("message", ""):
+                    print(f"❌ Expected an error for bad compressed SDP, got {reply}")
+                    return False
+            if await self.receive_all(plain):
+                print(f"❌ Bad compressed SDP was relayed to {plain_id}")
+                return False
+            self.tests_passed += 1
+            print(f"✅ Malformed and oversized compressed SDP answered with errors")
+            return True
+        except Exception as e:
+            print(f"❌ Compressed SDP relay test failed: {str(e)}")
+            return False
+
+    @staticmethod
+    def free_port():
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            return probe.getsockname()[1]
+
+    def start_resp_standin(self, port):
+        """Start tools/resp_standin.py on `port` and wait until it listens"""
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "tools", "resp_standin.py"), "--port", str(port)],
+            stdout=subprocess.PIPE
+        )
+        process.stdout.readline()
+        return process
+
+    def start_server(self, port, **environ):
+        """Start a server on `port` with extra environment settings and wait until it answers"""
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port)],
+            cwd=os.path.join(REPO_DIR, "backend"),
+            env={**os.environ, **environ},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        for _ in range(100):
+            try:
+                requests.get(f"http://127.0.0.1:{port}/api/", timeout=1)
+                return process
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        process.kill()
+        raise RuntimeError(f"Server on port {port} did not start")
+
+    async def test_heartbeat(self):
+        """Test that heartbeat clients are pinged, kept alive by pongs and reaped when silent"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Application Heartbeat...")
+        
+        port = self.free_port()
+        server = self.start_server(port, HEARTBEAT_INTERVAL="0.3", HEARTBEAT_TIMEOUT="1")
+        base_url, ws_url = f"http://127.0.0.1:{port}/api", f"ws://127.0.0.1:{port}/ws"
+        live_id = f"heartbeat_live_{uuid.uuid4().hex[:8]}"
+        silent_id = f"heartbeat_silent_{uuid.uuid4().hex[:8]}"
+        
+        async def answer_pings(websocket, seen):
+            async for frame in websocket:
+                message = json.loads(frame)
+                seen.append(message["type"])
+                if message["type"] == "ping":
+                    await websocket.send(json.dumps({"type": "pong"}))
+        
+        try:
+            room_id = requests.post(f"{base_url}/rooms", json={"max_participants": 3}).json()["room_id"]
+            live = await websockets.connect(f"{ws_url}/{live_id}?caps=heartbeat")
+            silent = await websockets.connect(f"{ws_url}/{silent_id}?caps=heartbeat")
+            for websocket in (live, silent):
+                await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            seen = []
+            ponger = asyncio.create_task(answer_pings(live, seen))
+            
+            # The silent client reads its frames but never answers
+            pinged = False
+            try:
+                while True:
+                    message = json.loads(await asyncio.wait_for(silent.recv(), timeout=5))
+                    pinged = pinged or message.get("type") == "ping"
+            except websockets.ConnectionClosed:
+                pass
+            if not pinged:
+                print(f"❌ Silent client was closed without being pinged first")
+                return False
+            print(f"✅ Silent client pinged, then disconnected")
+            
+            await asyncio.sleep(1)
+            participants = requests.get(f"{base_url}/rooms/{room_id}").json()["room"]["participants"]
+            ponger.cancel()
+            if "ping" not in seen or live.close_code is not None:
+                print(f"❌ Answering client not kept alive: saw {seen}, close code {live.close_code}")
+                return False
+            print(f"✅ Answering client saw {seen.count('ping')} pings and stayed connected")
+            if participants == [live_id]:
+                self.tests_passed += 1
+                print(f"✅ Reaped client dropped out of the room roster")
+                await live.close()
+                return True
+            print(f"❌ Expected only {live_id} left in the room, got {participants}")
+            return False
+        except Exception as e:
+            print(f"❌ Heartbeat test failed: {str(e)}")
+            return False
+        finally:
+            server.kill()
+            server.wait()
+
+    async def test_admission_control(self):
+        """Test that room creation and new connections are refused with a retry hint at the limits"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Admission Control...")
+        
+        port = self.free_port()
+        server = self.start_server(port, MAX_ROOMS="2", ADMISSION_MAX_CONNECTIONS="2", ADMISSION_RETRY_AFTER="1")
+        base_url, ws_url = f"http://127.0.0.1:{port}/api", f"ws://127.0.0.1:{port}/ws"
+        
+        try:
+            room_ids = [requests.post(f"{base_url}/rooms", json={"max_participants": 2}).json()["room_id"] for _ in range(2)]
+            response = requests.post(f"{base_url}/rooms", json={"max_participants": 2})
+            if response.status_code != 503 or response.headers.get("Retry-After") not in ("1", "2"):
+                print(f"❌ Expected 503 with Retry-After at MAX_ROOMS, got {response.status_code} {response.headers}")
+                return False
+            print(f"✅ Room over MAX_ROOMS refused: {response.json()}, Retry-After {response.headers['Retry-After']}")
+            
+            clients = [await websockets.connect(f"{ws_url}/admitted_{i}_{uuid.uuid4().hex[:8]}") for i in range(2)]
+            refused = await websockets.connect(f"{ws_url}/refused_{uuid.uuid4().hex[:8]}")
+            message = json.loads(await asyncio.wait_for(refused.recv(), timeout=5))
+            close_code = None
+            try:
+                await asyncio.wait_for(refused.recv(), timeout=5)
+            except websockets.ConnectionClosed as e:
+                close_code = e.rcvd.code if e.rcvd else None
+            if message.get("type") != "overloaded" or close_code != 1013:
+                print(f"❌ Expected an overloaded message and close 1013, got {message} and {close_code}")
+                return False
+            print(f"✅ Connection over the limit refused with {message} and close code 1013")
+            
+            # Emptying a room makes room for a new one
+            await clients[1].close()
+            await clients[0].send(json.dumps({"type": "join_room", "room_id": room_ids[0]}))
+            await self.receive_all(clients[0])
+            await clients[0].send(json.dumps({"type": "leave_room", "room_id": room_ids[0]}))
+            await self.receive_all(clients[0])
+            response = requests.post(f"{base_url}/rooms", json={"max_participants": 2})
+            await clients[0].close()
+            if response.status_code == 200:
+                self.tests_passed += 1
+                print(f"✅ Room created once an emptied room was reclaimed")
+                return True
+            print(f"❌ Room creation still refused after a room was emptied: {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Admission control test failed: {str(e)}")
+            return False
+        finally:
+            server.kill()
+            server.wait()
+
+    async def test_state_backend_reconnect(self):
+        """Test that the Redis backend fails fast while its server is down and recovers after a restart"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing State Backend Reconnect...")
+        
+        port = self.free_port()
+        standin = self.start_resp_standin(port)
+        backend = RedisBackend(f"redis://127.0.0.1:{port}/0", prefix=f"test_{uuid.uuid4().hex[:8]}")
+        relayed = []
+        
+        async def deliver(envelope):
+            relayed.append(envelope)
+        
+        try:
+            await backend.start()
+            await backend.subscribe("test_node", deliver)
+            await backend.create_room("RECON1", 2, datetime.utcnow())
+            
+            # Kill the server under the live backend
+            standin.kill()
+            standin.wait()
+            await asyncio.sleep(0.5)
+            try:
+                await asyncio.wait_for(backend.get_room("RECON1"), timeout=2)
+                print(f"❌ Command succeeded with the state server down")
+                return False
+            except asyncio.TimeoutError:
+                print(f"❌ Command hung with the state server down")
+                return False
+            except ConnectionError:
+                print(f"✅ Command failed fast with the state server down")
+            
+            # Restart it; commands and the relay subscription must come back
+            standin = self.start_resp_standin(port)
+            for _ in range(100):
+                try:
+                    await backend.create_room("RECON2", 2, datetime.utcnow())
+                    break
+                except ConnectionError:
+                    await asyncio.sleep(0.1)
+            else:
+                print(f"❌ Backend did not reconnect after the state server restarted")
+                return False
+            print(f"✅ Backend reconnected and created a room")
+            
+            for _ in range(50):
+                await backend.publish("test_node", {"kind": "probe"})
+                await asyncio.sleep(0.1)
+                if relayed:
+                    break
+            if {"kind": "probe"} not in relayed:
+                print(f"❌ Relay not resubscribed after reconnect: {relayed}")
+                return False
+            print(f"✅ Relayed message delivered after resubscribing")
+            self.tests_passed += 1
+            return True
+        except Exception as e:
+            print(f"❌ State backend reconnect test failed: {str(e)}")
+            return False
+        finally:
+            await backend.close()
+            standin.kill()
+            standin.wait()
+
+    async def test_state_backend_races(self):
+        """Test that joins and room deletes from two nodes on the Redis backend never interleave"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing State Backend Join/Delete Races...")
+        
+        port = self.free_port()
+        standin = self.start_resp_standin(port)
+        prefix = f"test_{uuid.uuid4().hex[:8]}"
+        node1 = RedisBackend(f"redis://127.0.0.1:{port}/0", prefix=prefix)
+        node2 = RedisBackend(f"redis://127.0.0.1:{port}/0", prefix=prefix)
+        try:
+            await node1.start()
+            await node2.start()
+            for i in range(50):
+                # Two joiners race for the last slot: exactly one gets it
+                room_id = f"SLOT{i}"
+                await node1.create_room(room_id, 2, datetime.utcnow())
+                await node1.add_participant(room_id, "first")
+                results = await asyncio.gather(node1.add_participant(room_id, "a"), node2.add_participant(room_id, "b"))
+                statuses = sorted(result.status.value for result in results)
+                if statuses != ["full", "joined"] or len(await node1.participants(room_id)) != 2:
+                    print(f"❌ Last slot race gave {statuses}")
+                    return False
+                
+                # A join racing a delete either keeps the room or finds it gone
+                room_id = f"GONE{i}"
+                await node1.create_room(room_id, 2, datetime.utcnow())
+                joined, deleted = await asyncio.gather(node2.add_participant(room_id, "a"),
+                                                       node1.delete_room_if_empty(room_id))
+                room = await node1.get_room(room_id)
+                if joined.status == JoinStatus.JOINED and (deleted or room is None):
+                    print(f"❌ Room {room_id} deleted under a successful join")
+                    return False
+                if joined.status == JoinStatus.NOT_FOUND and (not deleted or await node1.participants(room_id)):
+                    print(f"❌ Join on deleted room {room_id} left members behind")
+                    return False
+            print(f"✅ 50 last-slot races and 50 join/delete races resolved consistently")
+            self.tests_passed += 1
+            return True
+        except Exception as e:
+            print(f"❌ State backend race test failed: {str(e)}")
+            return False
+        finally:
+            await node1.close()
+            await node2.close()
+            standin.kill()
+            standin.wait()
+
+    def test_chat_history_reused_code(self):
+        """Test that a room code reused after its room was deleted starts its history afresh"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Chat History for a Reused Room Code...")
+        
+        try:
+            size = message_size({"type": "chat_message", "message": "x", "seq": 1})
+            history = ChatHistory(max_total_bytes=3 * size)
+            history.append("REUSED", {"type": "chat_message", "message": "x"})
+            history.drop("REUSED")
+            history.append("OLDEST", {"type": "chat_message", "message": "x"})
+            history.append("REUSED", {"type": "chat_message", "message": "x"})
+            history.append("NEWEST", {"type": "chat_message", "message": "x"})
+            # Over the global budget: the oldest message still kept must go
+            history.append("NEWEST", {"type": "chat_message", "message": "x"})
+            
+            kept = {room_id: [m["seq"] for m in history.since(room_id, 0)[0]] for room_id in ("OLDEST", "REUSED", "NEWEST")}
+            if kept == {"OLDEST": [], "REUSED": [1], "NEWEST": [1, 2]} and history.total_messages == 3:
+                self.tests_passed += 1
+                print(f"✅ Evicted the oldest message, not the reused room's: {kept}")
+                return True
+            print(f"❌ Unexpected messages kept: {kept}, total {history.total_messages}")
+            return False
+        except Exception as e:
+            print(f"❌ Reused room code history test failed: {str(e)}")
+            return False
+
+    def test_sdp_compression(self):
+        """Test that compressed SDP round-trips through the preset dictionary and bad input is refused"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing SDP Compression...")
+        
+        try:
+            packed = compress_sdp(SAMPLE_SDP)
+            if decompress_sdp(packed) != SAMPLE_SDP or len(packed) >= len(SAMPLE_SDP) // 2:
+                print(f"❌ SDP of {len(SAMPLE_SDP)} bytes did not round-trip well: {len(packed)} bytes packed")
+                return False
+            print(f"✅ {len(SAMPLE_SDP)} bytes of SDP round-trip through {len(packed)} bytes")
+            
+            bad_inputs = {
+                "not base64": "not base64!",
+                "not deflate": "AAAA",
+                "truncated": packed[:len(packed) // 2 // 4 * 4],
+                "oversized": compress_sdp("a=x\r\n" * 300000),
+            }
+            for name, data in bad_inputs.items():
+                try:
+                    decompress_sdp(data)
+                except ValueError:
+                    continue
+                print(f"❌ {name} compressed SDP was accepted")
+                return False
+            self.tests_passed += 1
+            print(f"✅ Refused {', '.join(bad_inputs)} input")
+            return True
+        except Exception as e:
+            print(f"❌ SDP compression test failed: {str(e)}")
+            return False
+
+    async def test_overflow_policies(self):
+        """Test what each overflow policy does with a message for a full outbound queue"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Outbound Overflow Policies...")
+        
+        evictions = []
+        policies = {**DEFAULT_POLICIES, "cursor": OverflowPolicy.COALESCE}
+        
+        def full_queue(*types, **kwargs):
+            # The writer is never started, so whatever is enqueued stays queued
+            connection = ClientConnection(StalledWebSocket(), "full", get_codec("json"),
+                                          lambda client_id, reason: evictions.append(reason), policies,
+                                          max_messages=2, **kwargs)
+            for i, msg_type in enumerate(types):
+                connection.enqueue(Frame({"type": msg_type, "n": i}), key=(msg_type, i))
+            return connection
+        
+        def queued(connection):
+            return [(item.msg_type, item.frame.message["n"]) for item in connection._queue]
+        
+        try:
+            cases = []
+            # KEEP goes in, pushing out the oldest droppable message
+            connection = full_queue("chat_message", "webrtc_offer")
+            cases.append(("keep", connection.enqueue(Frame({"type": "webrtc_answer", "n": 2})), queued(connection),
+                          DeliveryStatus.QUEUED, [("webrtc_offer", 1), ("webrtc_answer", 2)]))
+            # ... or over the limit when nothing queued may be dropped
+            connection = full_queue("webrtc_offer", "webrtc_offer")
+            cases.append(("keep over limit", connection.enqueue(Frame({"type": "webrtc_answer", "n": 2})), queued(connection),
+                          DeliveryStatus.QUEUED, [("webrtc_offer", 0), ("webrtc_offer", 1), ("webrtc_answer", 2)]))
+            # DROP_OLDEST makes room by dropping the oldest droppable message
+            connection = full_queue("chat_message", "chat_message")
+            cases.append(("drop_oldest", connection.enqueue(Frame({"type": "chat_message", "n": 2})), queued(connection),
+                          DeliveryStatus.QUEUED, [("chat_message", 1), ("chat_message", 2)]))
+            # ... and is dropped itself when only KEEP messages are queued
+            connection = full_queue("webrtc_offer", "webrtc_offer")
+            cases.append(("drop_oldest behind keep", connection.enqueue(Frame({"type": "chat_message", "n": 2})),
+                          queued(connection), DeliveryStatus.DROPPED, [("webrtc_offer", 0), ("webrtc_offer", 1)]))
+            # DROP_NEWEST discards the incoming message
+            connection = full_queue("chat_message", "chat_message")
+            cases.append(("drop_newest", connection.enqueue(Frame({"type": "ping", "n": 2})), queued(connection),
+                          DeliveryStatus.DROPPED, [("chat_message", 0), ("chat_message", 1)]))
+            # COALESCE replaces the queued message with the same key
+            connection = full_queue("cursor", "chat_message")
+            cases.append(("coalesce", connection.enqueue(Frame({"type": "cursor", "n": 2}), key=("cursor", 0)),
+                          queued(connection), DeliveryStatus.COALESCED, [("cursor", 2), ("chat_message", 1)]))
+            
+            for name, status, contents, expected_status, expected_contents in cases:
+                if (status, contents) != (expected_status, expected_contents):
+                    print(f"❌ {name}: got {status.value} {contents}, expected {expected_status.value} {expected_contents}")
+                    return False
+                print(f"✅ {name}: {status.value}, queue {contents}")
+            
+            # A queue kept over its limit for longer than the grace gets its client evicted
+            connection = full_queue("webrtc_offer", "webrtc_offer", overlimit_grace=0.1)
+            connection.enqueue(Frame({"type": "webrtc_offer", "n": 2}))
+            await asyncio.sleep(0.2)
+            status = connection.enqueue(Frame({"type": "webrtc_offer", "n": 3}))
+            if status is DeliveryStatus.EVICTED and evictions == ["outbound queue over limit"]:
+                self.tests_passed += 1
+                print(f"✅ Evicted once the queue stayed over its limit past the grace period")
+                return True
+            print(f"❌ Expected eviction for a queue over its limit, got {status.value} and {evictions}")
+            return False
+        except Exception as e:
+            print(f"❌ Overflow policy test failed: {str(e)}")
+            return False
+
+    async def test_stalled_reader_eviction(self):
+        """Test that a client whose sends keep missing their deadline is evicted"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Stalled Reader Eviction...")
+        
+        evictions = []
+        connection = ClientConnection(StalledWebSocket(), "stalled", get_codec("json"),
+                                      lambda client_id, reason: evictions.append((client_id, reason)), {},
+                                      send_timeout=0.1, max_missed_sends=2)
+        try:
+            connection.start()
+            for i in range(3):
+                connection.enqueue(Frame({"type": "chat_message", "message": f"m{i}"}))
+            await asyncio.sleep(0.5)
+            if evictions == [("stalled", "too many missed send deadlines")] and connection.missed_sends == 2:
+                self.tests_passed += 1
+                print(f"✅ Evicted after {connection.missed_sends} missed send deadlines")
+                return True
+            print(f"❌ Expected one eviction after 2 missed deadlines, got {evictions} after {connection.missed_sends}")
+            return False
+        except Exception as e:
+            print(f"❌ Stalled reader eviction test failed: {str(e)}")
+            return False
+        finally:
+            connection.stop()
+
+    async def open_logged_backend(self, directory, **kwargs):
+        """A memory backend restored from the room log in `directory`"""
+        journal = RoomJournal(directory, flush_interval=0.01, **kwargs)
+        backend = MemoryBackend(journal.load(), ChatHistory(), journal)
+        journal.start()
+        return journal, backend
+
+    async def test_room_log_restore(self):
+        """Test that rooms created and deleted before a restart are restored as they were"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Room Log Restore...")
+        
+        directory = tempfile.mkdtemp(prefix="room-log-")
+        try:
+            journal, backend = await self.open_logged_backend(directory)
+            for i in range(20):
+                await backend.create_room(f"KEEP{i:02d}", 4, datetime.utcnow())
+                await backend.create_room(f"DROP{i:02d}", 4, datetime.utcnow())
+                await backend.delete_room_if_empty(f"DROP{i:02d}")
+            await journal.close()
+            
+            journal, backend = await self.open_logged_backend(directory)
+            restored = sorted(backend.rooms)
+            await journal.close()
+            expected = [f"KEEP{i:02d}" for i in range(20)]
+            if sorted(restored) != expected or (await backend.get_room("KEEP00")).max_participants != 4:
+                print(f"❌ Restored {restored}, expected {expected}")
+                return False
+            print(f"✅ Restored {len(restored)} rooms after a restart")
+            
+            # A server restored from its log keeps unjoined rooms past the new-room grace
+            port = self.free_port()
+            settings = {"ROOM_LOG_DIR": os.path.join(directory, "server"), "NEW_ROOM_GRACE": "0.5"}
+            server = self.start_server(port, **settings)
+            base_url = f"http://127.0.0.1:{port}/api"
+            restored_id = requests.post(f"{base_url}/rooms", json={"max_participants": 2}).json()["room_id"]
+            await asyncio.sleep(0.5)
+            server.kill()
+            server.wait()
+            server = self.start_server(port, **settings)
+            try:
+                new_id = requests.post(f"{base_url}/rooms", json={"max_participants": 2}).json()["room_id"]
+                await asyncio.sleep(1)
+                # A disconnect runs the cleanup of rooms past their grace
+                websocket = await websockets.connect(f"ws://127.0.0.1:{port}/ws/restore_{uuid.uuid4().hex[:8]}")
+                await websocket.close()
+                await asyncio.sleep(0.5)
+                restored_kept = 'room' in requests.get(f"{base_url}/rooms/{restored_id}").json()
+                new_kept = 'room' in requests.get(f"{base_url}/rooms/{new_id}").json()
+            finally:
+                server.kill()
+                server.wait()
+            if restored_kept and not new_kept:
+                self.tests_passed += 1
+                print(f"✅ Restored room {restored_id} kept past NEW_ROOM_GRACE; new room {new_id} reclaimed")
+                return True
+            print(f"❌ Restored room kept: {restored_kept} (expected True), new room kept: {new_kept} (expected False)")
+            return False
+        except Exception as e:
+            print(f"❌ Room log restore test failed: {str(e)}")
+            return False
+        finally:
+            shutil.rmtree(directory)
+
+    async def test_room_log_compaction(self):
+        """Test that a log that outgrows the live rooms is compacted into a snapshot"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Room Log Compaction...")
+        
+        directory = tempfile.mkdtemp(prefix="room-log-")
+        try:
+            journal, backend = await self.open_logged_backend(directory, compact_min=10)
+            await backend.create_room("LIVE", 4, datetime.utcnow())
+            for i in range(50):
+                await backend.create_room(f"CHURN{i:02d}", 4, datetime.utcnow())
+                await backend.delete_room_if_empty(f"CHURN{i:02d}")
+                await journal.flush()
+            await journal.close()
+            snapshots = journal.snapshots
+            if snapshots == 0:
+                print(f"❌ Log was never compacted after {journal.records_written} records")
+                return False
+            files = sorted(os.listdir(directory))
+            if files != sorted(["rooms.snapshot", log_name(journal.generation)]) and files != ["rooms.snapshot"]:
+                print(f"❌ Old log generations left behind: {files}")
+                return False
+            
+            journal, backend = await self.open_logged_backend(directory, compact_min=10)
+            restored = sorted(backend.rooms)
+            await journal.close()
+            if restored == ["LIVE"]:
+                self.tests_passed += 1
+                print(f"✅ Compacted {snapshots} times; restored {restored} from {files}")
+                return True
+            print(f"❌ Restored {restored} after compaction, expected ['LIVE']")
+            return False
+        except Exception as e:
+            print(f"❌ Room log compaction test failed: {str(e)}")
+            return False
+        finally:
+            shutil.rmtree(directory)
+
+    async def test_room_log_torn_record(self):
+        """Test that a record cut off by a crash is ignored and later records still restore"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Room Log Truncated Last Record...")
+        
+        directory = tempfile.mkdtemp(prefix="room-log-")
+        try:
+            journal, backend = await self.open_logged_backend(directory)
+            await backend.create_room("WHOLE", 4, datetime.utcnow())
+            await journal.close()
+            # A crash in the middle of a write leaves half a record behind
+            with open(os.path.join(directory, log_name(journal.generation)), "ab") as log:
+                log.write(b"c\tTORN\t4\t2026-01-")
+            
+            journal, backend = await self.open_logged_backend(directory)
+            await backend.create_room("AFTER", 4, datetime.utcnow())
+            await journal.close()
+            
+            journal, backend = await self.open_logged_backend(directory)
+            restored = sorted(backend.rooms)
+            await journal.close()
+            if restored == ["AFTER", "WHOLE"]:
+                self.tests_passed += 1
+                print(f"✅ Torn record dropped; restored {restored}")
+                return True
+            print(f"❌ Restored {restored}, expected ['AFTER', 'WHOLE']")
+            return False
+        except Exception as e:
+            print(f"❌ Room log torn record test failed: {str(e)}")
+            return False
+        finally:
+            shutil.rmtree(directory)
+
     async def close_connections(self):
         """Close all WebSocket connections"""
         for client_id, websocket in self.ws_connections.items():
@@ -568,13 +1764,41 @@ class WebRTCCollabAPITester:
         self.test_health_check()
         self.test_create_room()
         self.test_get_room()
+        self.test_room_etag()
         self.test_list_rooms()
+        self.test_list_rooms_pages()
         self.test_nonexistent_room()
+        self.test_metrics()
+        success, stats = self.test_stats()
         max_participants_test = self.test_max_participants_limit()
         
         # Run WebSocket tests asynchronously
         asyncio.get_event_loop().run_until_complete(self.run_websocket_tests())
         
+        # Rooms emptied by the WebSocket tests must show up as reclaimed
+        self.test_stats(reclaimed_above=stats.get('rooms_reclaimed', 0))
+        
+        # Run tests that need a server with settings of their own
+        asyncio.get_event_loop().run_until_complete(self.test_heartbeat())
+        asyncio.get_event_loop().run_until_complete(self.test_admission_control())
+        
+        # Run state backend tests against a local RESP stand-in
+        asyncio.get_event_loop().run_until_complete(self.test_state_backend_reconnect())
+        asyncio.get_event_loop().run_until_complete(self.test_state_backend_races())
+        
+        # Run outbound queue tests in process
+        asyncio.get_event_loop().run_until_complete(self.test_overflow_policies())
+        asyncio.get_event_loop().run_until_complete(self.test_stalled_reader_eviction())
+        
+        # Run chat history and SDP compression tests in process
+        self.test_chat_history_reused_code()
+        self.test_sdp_compression()
+        
+        # Run room log tests in temporary directories
+        asyncio.get_event_loop().run_until_complete(self.test_room_log_restore())
+        asyncio.get_event_loop().run_until_complete(self.test_room_log_compaction())
+        asyncio.get_event_loop().run_until_complete(self.test_room_log_torn_record())
+        
         # Print results
         print(f"\n📊 Tests passed: {self.tests_passed}/{self.tests_run}")
         return self.tests_passed == self.tests_run
@@ -582,6 +1806,8 @@ class WebRTCCollabAPITester:
     async def run_websocket_tests(self):
         """Run all WebSocket tests"""
         try:
+            await self.test_pending_cleanup_count()
+            
             # Create a room for WebSocket tests
             success, response = self.test_create_room(max_participants=3)
             if not success:
@@ -653,6 +1879,51 @@ class WebRTCCollabAPITester:
             # Test room cleanup
             await self.test_room_cleanup(room_id)
             
+            # Test session resume in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_session_resume(response['room_id'])
+            
+            # Test codec negotiation in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_codec_negotiation(response['room_id'])
+            
+            # Test malformed frames in a room of their own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_malformed_frames(response['room_id'])
+            
+            # Test ICE candidate batching in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_ice_batching(response['room_id'])
+            
+            # Test roster deltas in a room of their own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_roster_deltas(response['room_id'])
+            
+            # Test chat history in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_chat_history(response['room_id'])
+            
+            # Test rate limits in a room of their own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_rate_limits(response['room_id'])
+            
+            # Test the mesh plan in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_mesh_plan(response['room_id'])
+            
+            # Test compressed SDP relay in a room of its own
+            success, response = self.test_create_room(max_participants=3)
+            if success:
+                await self.test_sdp_deflate_relay(response['room_id'])
+            
             # Close all WebSocket connections
             await self.close_connections()
             
@@ -660,6 +1931,32 @@ class WebRTCCollabAPITester:
             print(f"❌ WebSocket tests failed: {str(e)}")
             await self.close_connections()
 
+    async def test_pending_cleanup_count(self):
+        """Test that a new room counts as pending cleanup only until somebody joins it"""
+        self.tests_run += 1
+        client_id = f"pending_client_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Testing Pending Cleanup Count...")
+        
+        try:
+            stats_url = f"{self.base_url}/stats"
+            before = requests.get(stats_url).json()["rooms_pending_cleanup"]
+            room_id = requests.post(f"{self.base_url}/rooms", json={"max_participants": 2}).json()["room_id"]
+            created = requests.get(stats_url).json()["rooms_pending_cleanup"]
+            websocket = await websockets.connect(f"{self.ws_url}/{client_id}")
+            self.ws_connections[client_id] = websocket
+            await websocket.send(json.dumps({"type": "join_room", "room_id": room_id}))
+            await self.receive_all(websocket)
+            joined = requests.get(stats_url).json()["rooms_pending_cleanup"]
+            if (created, joined) == (before + 1, before):
+                self.tests_passed += 1
+                print(f"✅ Pending cleanup went {before} -> {created} on creation -> {joined} on join")
+                return True
+            print(f"❌ Expected pending cleanup {before} -> {before + 1} -> {before}, got {before} -> {created} -> {joined}")
+            return False
+        except Exception as e:
+            print(f"❌ Pending cleanup count test failed: {str(e)}")
+            return False
+
     async def test_enter_room_flow(self, room_id):
         """Basic test: connect a client and join room successfully."""
         self.tests_run += 1
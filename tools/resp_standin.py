@@ -0,0 +1,279 @@
+"""Single-process stand-in for a Redis server, for local multi-node testing.
+
+Implements only the commands the collabshare state backend uses, in
+memory, with no persistence. Point nodes at it with
+
+    python tools/resp_standin.py --port 6379
+    STATE_BACKEND=redis REDIS_URL=redis://localhost:6379/0 python backend/server.py
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from resp import encode_command, read_reply  # noqa: E402
+
+
+def simple(text: str) -> bytes:
+    return b"+%s\r\n" % text.encode()
+
+
+def error(text: str) -> bytes:
+    return b"-ERR %s\r\n" % text.encode()
+
+
+def integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def bulk(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def array(values) -> bytes:
+    return b"*%d\r\n" % len(values) + b"".join(bulk(v) for v in values)
+
+
+# Commands that modify their key (every key, for DEL), which invalidates
+# transactions watching it
+WRITES = {"HSET", "HDEL", "DEL", "SET", "INCR", "RPUSH", "LTRIM", "ZADD", "ZREM"}
+
+
+class Store:
+    def __init__(self):
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.zsets: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.strings: Dict[str, str] = {}
+        self.lists: Dict[str, List[str]] = {}
+        self.channels: Dict[str, Set[asyncio.StreamWriter]] = {}
+        # Modification count per key, compared by EXEC for watched keys
+        self.versions: Dict[str, int] = {}
+
+    def execute(self, args: List[str]) -> bytes:
+        name = args[0].upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            return error(f"unknown command '{name}'")
+        if name in WRITES:
+            for key in args[1:] if name == "DEL" else args[1:2]:
+                self.versions[key] = self.versions.get(key, 0) + 1
+        return handler(*args[1:])
+
+    def cmd_ping(self, *args):
+        return simple("PONG")
+
+    def cmd_select(self, db):
+        return simple("OK")
+
+    def cmd_auth(self, *args):
+        return simple("OK")
+
+    def cmd_hset(self, key, *pairs):
+        h = self.hashes.setdefault(key, {})
+        added = sum(1 for field in pairs[::2] if field not in h)
+        h.update(zip(pairs[::2], pairs[1::2]))
+        return integer(added)
+
+    def cmd_hget(self, key, field):
+        return bulk(self.hashes.get(key, {}).get(field))
+
+    def cmd_hgetall(self, key):
+        return array([x for item in self.hashes.get(key, {}).items() for x in item])
+
+    def cmd_hmget(self, key, *fields):
+        h = self.hashes.get(key, {})
+        return array([h.get(field) for field in fields])
+
+    def cmd_hdel(self, key, *fields):
+        h = self.hashes.get(key, {})
+        return integer(sum(1 for field in fields if h.pop(field, None) is not None))
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            for store in (self.hashes, self.zsets, self.counters, self.strings, self.lists):
+                if store.pop(key, None) is not None:
+                    removed += 1
+        return integer(removed)
+
+    def cmd_get(self, key):
+        value = self.strings.get(key)
+        return bulk(self.counters.get(key) if value is None else value)
+
+    def cmd_set(self, key, value, *options):
+        previous = self.strings.get(key)
+        self.strings[key] = value
+        if any(option.upper() == "GET" for option in options):
+            return bulk(previous)
+        return simple("OK")
+
+    def cmd_incr(self, key):
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return integer(self.counters[key])
+
+    def cmd_rpush(self, key, *values):
+        items = self.lists.setdefault(key, [])
+        items.extend(values)
+        return integer(len(items))
+
+    def _list_range(self, key, start, stop):
+        items = self.lists.get(key, [])
+        start, stop = int(start), int(stop)
+        start = max(0, len(items) + start if start < 0 else start)
+        stop = len(items) + stop if stop < 0 else stop
+        return start, stop + 1
+
+    def cmd_ltrim(self, key, start, stop):
+        if key in self.lists:
+            start, stop = self._list_range(key, start, stop)
+            self.lists[key] = self.lists[key][start:stop]
+            if not self.lists[key]:
+                del self.lists[key]
+        return simple("OK")
+
+    def cmd_lrange(self, key, start, stop):
+        start, stop = self._list_range(key, start, stop)
+        return array(self.lists.get(key, [])[start:stop])
+
+    def cmd_zadd(self, key, *args):
+        nx = args and args[0].upper() == "NX"
+        if nx:
+            args = args[1:]
+        z = self.zsets.setdefault(key, {})
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            if member in z:
+                if nx:
+                    continue
+            else:
+                added += 1
+            z[member] = float(score)
+        return integer(added)
+
+    def cmd_zrem(self, key, *members):
+        z = self.zsets.get(key, {})
+        removed = sum(1 for member in members if z.pop(member, None) is not None)
+        if key in self.zsets and not z:
+            del self.zsets[key]
+        return integer(removed)
+
+    def cmd_zcard(self, key):
+        return integer(len(self.zsets.get(key, {})))
+
+    def cmd_zrange(self, key, start, stop):
+        ordered = [m for m, _ in sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))]
+        start, stop = int(start), int(stop)
+        stop = len(ordered) + stop if stop < 0 else stop
+        return array(ordered[start:stop + 1])
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        def bound(value, default):
+            if value in ("-inf", "+inf"):
+                return default
+            return float(value.lstrip("("))
+        low_value, high_value = bound(low, float("-inf")), bound(high, float("inf"))
+        ordered = [
+            (m, score) for m, score in sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+            if (score > low_value if low.startswith("(") else score >= low_value)
+            and (score < high_value if high.startswith("(") else score <= high_value)
+        ]
+        upper = [option.upper() for option in options]
+        if "LIMIT" in upper:
+            offset, count = (int(options[upper.index("LIMIT") + i]) for i in (1, 2))
+            ordered = ordered[offset:offset + count if count >= 0 else None]
+        if "WITHSCORES" in upper:
+            return array([x for member, score in ordered for x in (member, repr(score))])
+        return array([member for member, _ in ordered])
+
+    def cmd_publish(self, channel, message):
+        subscribers = self.channels.get(channel, set())
+        frame = encode_command(("message", channel, message))
+        for writer in subscribers:
+            writer.write(frame)
+        return integer(len(subscribers))
+
+
+class Session:
+    """Transaction state of one client connection"""
+
+    def __init__(self, store: Store):
+        self.store = store
+        self.watched: Dict[str, int] = {}
+        self.queued: Optional[List[List[str]]] = None
+
+    def execute(self, args: List[str]) -> bytes:
+        name = args[0].upper()
+        if name == "WATCH":
+            if self.queued is not None:
+                return error("WATCH inside MULTI is not allowed")
+            for key in args[1:]:
+                self.watched.setdefault(key, self.store.versions.get(key, 0))
+            return simple("OK")
+        if name == "UNWATCH":
+            self.watched.clear()
+            return simple("OK")
+        if name == "MULTI":
+            if self.queued is not None:
+                return error("MULTI calls can not be nested")
+            self.queued = []
+            return simple("OK")
+        if name in ("EXEC", "DISCARD"):
+            if self.queued is None:
+                return error(f"{name} without MULTI")
+            queued, self.queued = self.queued, None
+            watched, self.watched = self.watched, {}
+            if name == "DISCARD":
+                return simple("OK")
+            if any(self.store.versions.get(key, 0) != version for key, version in watched.items()):
+                return b"*-1\r\n"
+            return b"*%d\r\n" % len(queued) + b"".join(self.store.execute(command) for command in queued)
+        if self.queued is not None:
+            self.queued.append(args)
+            return simple("QUEUED")
+        return self.store.execute(args)
+
+
+async def serve_client(store: Store, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    session = Session(store)
+    try:
+        while True:
+            args = await read_reply(reader)
+            if not isinstance(args, list) or not args:
+                writer.write(error("expected a command array"))
+                continue
+            if args[0].upper() == "SUBSCRIBE":
+                for index, channel in enumerate(args[1:], 1):
+                    store.channels.setdefault(channel, set()).add(writer)
+                    writer.write(b"*3\r\n" + bulk("subscribe") + bulk(channel) + integer(index))
+                continue
+            writer.write(session.execute(args))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        for subscribers in store.channels.values():
+            subscribers.discard(writer)
+        writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    store = Store()
+    server = await asyncio.start_server(lambda r, w: serve_client(store, r, w), args.host, args.port)
+    print(f"RESP stand-in listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())